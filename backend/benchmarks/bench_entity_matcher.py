@@ -0,0 +1,96 @@
+"""
+Microbenchmark: per-keyword regex search vs the compiled KeywordMatcher.
+
+    cd backend && python benchmarks/bench_entity_matcher.py
+
+Vocabularies grow from the built-in keywords to several thousand synthetic
+entries; the per-message cost of the matcher should stay roughly flat while
+the per-keyword baseline grows linearly.
+"""
+
+import os
+import random
+import re
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.entity_matcher import KeywordMatcher  # noqa: E402
+from services.memory_service import (  # noqa: E402
+    EMOTION_KEYWORDS,
+    PEOPLE_KEYWORDS,
+    SITUATION_KEYWORDS,
+)
+
+SIZES = [0, 1_000, 5_000, 20_000]
+MESSAGES = 200
+REPEAT = 3
+
+
+def _synthetic_vocabulary(extra: int, rng: random.Random) -> dict:
+    vocabulary = {
+        "people": dict(PEOPLE_KEYWORDS),
+        "emotions": dict(EMOTION_KEYWORDS),
+        "situations": dict(SITUATION_KEYWORDS),
+    }
+    categories = list(vocabulary)
+    for i in range(extra):
+        word = "".join(rng.choices(string.ascii_lowercase, k=rng.randint(4, 10)))
+        vocabulary[categories[i % 3]][word] = f"{word}-value"
+    return vocabulary
+
+
+def _messages(vocabulary: dict, rng: random.Random) -> list:
+    keywords = [k for words in vocabulary.values() for k in words]
+    filler = "i have been feeling like everything is a bit much lately and".split()
+    return [
+        " ".join(rng.choice(filler) for _ in range(25)) + " " + " ".join(rng.sample(keywords, 3))
+        for _ in range(MESSAGES)
+    ]
+
+
+def _baseline(vocabulary: dict, text: str) -> dict:
+    """The original extractor: one f-string regex search per keyword."""
+    lowered = text.lower()
+    return {
+        category: sorted({v for k, v in words.items() if re.search(rf"\b{re.escape(k)}\b", lowered)})
+        for category, words in vocabulary.items()
+    }
+
+
+def _per_message_us(fn, messages) -> float:
+    best = float("inf")
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        for text in messages:
+            fn(text)
+        best = min(best, time.perf_counter() - start)
+    return best / len(messages) * 1e6
+
+
+def main():
+    rng = random.Random(7)
+    print(f"{'keywords':>9} {'build ms':>9} {'baseline us/msg':>16} {'matcher us/msg':>15} {'speedup':>8}")
+    for extra in SIZES:
+        vocabulary = _synthetic_vocabulary(extra, rng)
+        messages = _messages(vocabulary, rng)
+
+        start = time.perf_counter()
+        matcher = KeywordMatcher(vocabulary)
+        build_ms = (time.perf_counter() - start) * 1000
+
+        for text in messages[:5]:
+            assert matcher.extract(text) == _baseline(vocabulary, text)
+
+        # re's internal cache only holds a few hundred patterns, so large
+        # vocabularies make the baseline recompile on every call, as it
+        # does in production once the vocabulary grows.
+        baseline = _per_message_us(lambda t: _baseline(vocabulary, t), messages[:5])
+        compiled = _per_message_us(matcher.extract, messages)
+        print(f"{len(matcher):>9} {build_ms:>9.1f} {baseline:>16.1f} {compiled:>15.1f} {baseline / compiled:>7.0f}x")
+
+
+if __name__ == "__main__":
+    main()
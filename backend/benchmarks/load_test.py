@@ -0,0 +1,237 @@
+"""
+Load test: /chat (or /chat/stream) at increasing concurrency against local
+mock upstreams.
+
+    cd backend && python benchmarks/load_test.py --levels 1,4,16 --requests 40
+
+By default this starts ``benchmarks/mock_upstreams.py`` and a backend wired
+to it (fresh TTS cache directory, no Redis), so no API credits are spent;
+``--target http://host:port`` drives an already running backend instead.
+Extra ``--mock`` arguments are passed to the mock server, e.g.
+``--mock=--error-rate --mock=llm=0.05``.
+
+Each level runs ``--requests`` turns from ``level`` concurrent clients, each
+client keeping its own session. The report gives requests per second, error
+count and p50/p95/p99 for the end-to-end time and for every entry of the
+response's ``timings`` (stage durations for /chat, time-since-start marks
+for /chat/stream).
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+import httpx
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from services.audio_preprocess import SAMPLE_RATE, to_wav  # noqa: E402
+
+
+def _speech_like_clip(seconds: float = 2.0) -> bytes:
+    """Voiced harmonics under a syllable-rate envelope, with silent edges."""
+    t = np.arange(int(SAMPLE_RATE * seconds)) / SAMPLE_RATE
+    voice = sum(np.sin(2 * np.pi * 140 * k * t) / k for k in range(1, 6))
+    envelope = np.clip(np.sin(2 * np.pi * 4 * t), 0, None)
+    envelope[(t < 0.3) | (t > seconds - 0.3)] = 0
+    return to_wav((0.2 * voice * envelope).astype(np.float32))
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_until_up(url: str, proc: subprocess.Popen, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"{url} exited with {proc.returncode}")
+        try:
+            if httpx.get(url, timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up in {timeout}s")
+
+
+def start_stack(mock_args, tts_cache_dir: str):
+    mock_port, backend_port = _free_port(), _free_port()
+    mock_url = f"http://127.0.0.1:{mock_port}"
+    mock = subprocess.Popen(
+        [sys.executable, os.path.join(BACKEND_DIR, "benchmarks", "mock_upstreams.py"),
+         "--port", str(mock_port), *mock_args],
+        cwd=BACKEND_DIR,
+    )
+    env = {
+        **os.environ,
+        "MISTRAL_API_KEY": "bench",
+        "ELEVENLABS_API_KEY": "bench",
+        "MISTRAL_API_BASE": mock_url,
+        "ELEVENLABS_API_BASE": mock_url,
+        "TTS_CACHE_DIR": tts_cache_dir,
+        "SESSION_REDIS_URL": "",
+        "EMOTION_CACHE_REDIS_URL": "",
+    }
+    backend = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(backend_port), "--log-level", "warning"],
+        cwd=BACKEND_DIR,
+        env=env,
+    )
+    try:
+        _wait_until_up(f"{mock_url}/stats", mock)
+        _wait_until_up(f"http://127.0.0.1:{backend_port}/", backend)
+    except Exception:
+        stop_stack([mock, backend])
+        raise
+    return f"http://127.0.0.1:{backend_port}", mock_url, [mock, backend]
+
+
+def stop_stack(procs):
+    for proc in procs:
+        proc.terminate()
+    for proc in procs:
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+async def _chat(client: httpx.AsyncClient, clip: bytes, session_id: str):
+    resp = await client.post(
+        "/chat",
+        params={"session_id": session_id, "audio_mode": "url"},
+        files={"audio": ("clip.wav", clip, "audio/wav")},
+    )
+    resp.raise_for_status()
+    data = resp.json()
+    return data["session_id"], data.get("timings", {})
+
+
+async def _chat_stream(client: httpx.AsyncClient, clip: bytes, session_id: str):
+    async with client.stream(
+        "POST",
+        "/chat/stream",
+        params={"session_id": session_id, "audio_mode": "url"},
+        files={"audio": ("clip.wav", clip, "audio/wav")},
+    ) as resp:
+        resp.raise_for_status()
+        event = None
+        async for line in resp.aiter_lines():
+            if line.startswith("event:"):
+                event = line[6:].strip()
+            elif line.startswith("data:") and event in ("done", "error"):
+                data = json.loads(line[5:])
+                if event == "error":
+                    raise RuntimeError(data.get("error"))
+                return data["session_id"], data.get("timings", {})
+    raise RuntimeError("stream ended without a done event")
+
+
+async def run_level(target: str, clip: bytes, concurrency: int, total: int, stream: bool) -> dict:
+    samples = defaultdict(list)
+    errors = 0
+    remaining = total
+    call = _chat_stream if stream else _chat
+
+    async def client_loop(client: httpx.AsyncClient):
+        nonlocal remaining, errors
+        session_id = ""
+        while remaining > 0:
+            remaining -= 1
+            started = time.perf_counter()
+            try:
+                session_id, timings = await call(client, clip, session_id)
+            except Exception:
+                errors += 1
+                continue
+            samples["end_to_end"].append((time.perf_counter() - started) * 1000)
+            for name, ms in timings.items():
+                samples[name].append(ms)
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=target, timeout=120, limits=limits) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(client_loop(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    completed = len(samples["end_to_end"])
+    return {
+        "concurrency": concurrency,
+        "completed": completed,
+        "errors": errors,
+        "rps": completed / elapsed if elapsed else 0.0,
+        "percentiles": {
+            name: np.percentile(values, [50, 95, 99]).round(1).tolist()
+            for name, values in samples.items()
+        },
+    }
+
+
+def print_level(result: dict):
+    print(
+        f"\nconcurrency {result['concurrency']:>3}: {result['completed']} ok, "
+        f"{result['errors']} errors, {result['rps']:.2f} req/s"
+    )
+    print(f"  {'stage':<22}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    percentiles = result["percentiles"]
+    for name in ["end_to_end"] + sorted(n for n in percentiles if n != "end_to_end"):
+        if name in percentiles:
+            p50, p95, p99 = percentiles[name]
+            print(f"  {name:<22}{p50:>10.1f}{p95:>10.1f}{p99:>10.1f}")
+
+
+async def run(args, target: str):
+    clip = _speech_like_clip()
+    results = []
+    for level in args.levels:
+        result = await run_level(target, clip, level, args.requests, args.stream)
+        print_level(result)
+        results.append(result)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--target", help="base URL of a running backend (default: start one)")
+    parser.add_argument(
+        "--levels", default="1,2,4,8,16",
+        type=lambda s: [int(x) for x in s.split(",")], help="comma-separated concurrency levels",
+    )
+    parser.add_argument("--requests", type=int, default=40, help="turns per level")
+    parser.add_argument("--stream", action="store_true", help="drive /chat/stream instead of /chat")
+    parser.add_argument("--mock", action="append", default=[], help="argument for mock_upstreams.py (repeatable)")
+    parser.add_argument("--json", metavar="PATH", help="also write the results as JSON")
+    args = parser.parse_args()
+
+    procs = []
+    try:
+        if args.target:
+            target = args.target.rstrip("/")
+        else:
+            cache_dir = tempfile.mkdtemp(prefix="soultalk-bench-tts-")
+            target, mock_url, procs = start_stack(args.mock, cache_dir)
+            print(f"backend {target}, mock upstreams {mock_url}")
+        results = asyncio.run(run(args, target))
+        if procs:
+            print("\nmock upstream calls:", httpx.get(f"{mock_url}/stats").json())
+    finally:
+        stop_stack(procs)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
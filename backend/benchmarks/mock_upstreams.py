@@ -0,0 +1,201 @@
+"""
+Local stand-ins for the Mistral and ElevenLabs endpoints the backend calls,
+so /chat can be load-tested without spending API credits.
+
+    cd backend && python benchmarks/mock_upstreams.py --port 8900 \
+        --latency stt=400:0.3 --latency llm=600:0.4 --error-rate tts=0.02
+
+Point the backend at it with ``MISTRAL_API_BASE`` / ``ELEVENLABS_API_BASE``
+(any non-empty API keys will do). Latencies are lognormal, given as
+``median_ms:sigma`` per endpoint (stt, emotion, llm, tts); an error rate makes
+that share of calls answer 503. Streamed completions spread the latency over
+the tokens, with the first token after ``--ttft`` of it. Replies are drawn
+from small pools, so transcripts and responses vary and the TTS cache only
+absorbs what it would in practice.
+"""
+
+import argparse
+import asyncio
+import json
+import random
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+DEFAULT_LATENCY = {
+    "stt": (350.0, 0.3),
+    "emotion": (250.0, 0.3),
+    "llm": (700.0, 0.35),
+    "tts": (300.0, 0.3),
+}
+
+TRANSCRIPTS = [
+    "I have been feeling really stressed about work lately.",
+    "My sister called me today and we had a long talk.",
+    "I don't know, I just feel kind of tired all the time.",
+    "Exams start next week and I can't focus on anything.",
+    "Today was actually a pretty good day for once.",
+    "I keep thinking about the argument I had with my friend.",
+    "I'm worried about my mom, she hasn't been well.",
+    "Work was fine but I feel lonely in the evenings.",
+]
+EMOTIONS = ["stressed", "sad", "anxious", "happy", "neutral", "lonely", "tired"]
+REPLY_SENTENCES = [
+    "That sounds like a lot to carry right now.",
+    "I'm really glad you told me about it.",
+    "It makes sense that you'd feel that way.",
+    "What part of it has been weighing on you the most?",
+    "You don't have to figure it all out tonight.",
+    "How have you been sleeping with all of this going on?",
+    "It sounds like that mattered to you.",
+    "Would it help to talk through what happened?",
+]
+
+
+class Behaviour:
+    def __init__(self, latency: dict, error_rate: dict, ttft: float, seed: int):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.ttft = ttft
+        self.rng = random.Random(seed)
+        self.calls = {name: 0 for name in DEFAULT_LATENCY}
+        self.errors = {name: 0 for name in DEFAULT_LATENCY}
+
+    def delay(self, endpoint: str) -> float:
+        median_ms, sigma = self.latency[endpoint]
+        return median_ms / 1000 * self.rng.lognormvariate(0, sigma)
+
+    def fails(self, endpoint: str) -> bool:
+        self.calls[endpoint] += 1
+        if self.rng.random() < self.error_rate.get(endpoint, 0.0):
+            self.errors[endpoint] += 1
+            return True
+        return False
+
+    def reply(self) -> str:
+        return " ".join(self.rng.sample(REPLY_SENTENCES, 2))
+
+
+def _unavailable():
+    return JSONResponse(status_code=503, content={"error": "mock_upstream_unavailable"})
+
+
+def _completion(content: str) -> dict:
+    return {"choices": [{"index": 0, "message": {"role": "assistant", "content": content}}]}
+
+
+def _fake_mp3(rng: random.Random, text: str) -> bytes:
+    # ~1 KB per word of speech at 64 kbps, random so each reply is distinct
+    size = 1024 * max(4, len(text.split()))
+    return b"ID3" + rng.randbytes(size)
+
+
+def create_app(behaviour: Behaviour) -> FastAPI:
+    app = FastAPI(title="SoulTalk mock upstreams")
+
+    @app.post("/v1/audio/transcriptions")
+    async def transcriptions(request: Request):
+        await request.body()
+        await asyncio.sleep(behaviour.delay("stt"))
+        if behaviour.fails("stt"):
+            return _unavailable()
+        return {"text": behaviour.rng.choice(TRANSCRIPTS)}
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        payload = json.loads(await request.body())
+        if payload.get("response_format", {}).get("type") == "json_object":
+            await asyncio.sleep(behaviour.delay("emotion"))
+            if behaviour.fails("emotion"):
+                return _unavailable()
+            result = {
+                "emotion": behaviour.rng.choice(EMOTIONS),
+                "intensity": round(behaviour.rng.uniform(0.2, 0.9), 2),
+                "summary": "mock classification",
+            }
+            return _completion(json.dumps(result))
+
+        # Audio-in chat (the STT fallback) carries a list of content parts
+        endpoint = "llm"
+        messages = payload.get("messages") or [{}]
+        if isinstance(messages[-1].get("content"), list):
+            endpoint = "stt"
+        total = behaviour.delay(endpoint)
+        if behaviour.fails(endpoint):
+            await asyncio.sleep(total * behaviour.ttft)
+            return _unavailable()
+        content = behaviour.rng.choice(TRANSCRIPTS) if endpoint == "stt" else behaviour.reply()
+
+        if not payload.get("stream"):
+            await asyncio.sleep(total)
+            return _completion(content)
+
+        tokens = content.split(" ")
+        per_token = total * (1 - behaviour.ttft) / max(1, len(tokens) - 1)
+
+        async def events():
+            await asyncio.sleep(total * behaviour.ttft)
+            for i, token in enumerate(tokens):
+                if i:
+                    await asyncio.sleep(per_token)
+                chunk = {"choices": [{"index": 0, "delta": {"content": token if i == 0 else " " + token}}]}
+                yield f"data: {json.dumps(chunk)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.post("/v1/text-to-speech/{voice_id}")
+    async def text_to_speech(voice_id: str, request: Request):
+        payload = json.loads(await request.body())
+        await asyncio.sleep(behaviour.delay("tts"))
+        if behaviour.fails("tts"):
+            return _unavailable()
+        return Response(content=_fake_mp3(behaviour.rng, payload.get("text", "")), media_type="audio/mpeg")
+
+    @app.get("/stats")
+    async def stats():
+        return {"calls": behaviour.calls, "errors": behaviour.errors}
+
+    return app
+
+
+def _parse_latency(values) -> dict:
+    latency = dict(DEFAULT_LATENCY)
+    for value in values or []:
+        endpoint, spec = value.split("=", 1)
+        median, _, sigma = spec.partition(":")
+        latency[endpoint] = (float(median), float(sigma or 0.3))
+    return latency
+
+
+def _parse_rates(values) -> dict:
+    rates = {}
+    for value in values or []:
+        endpoint, rate = value.split("=", 1)
+        rates[endpoint] = float(rate)
+    return rates
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument(
+        "--latency", action="append", metavar="ENDPOINT=MEDIAN_MS[:SIGMA]",
+        help="lognormal latency for stt, emotion, llm or tts (repeatable)",
+    )
+    parser.add_argument(
+        "--error-rate", action="append", metavar="ENDPOINT=RATE",
+        help="share of calls answered with 503 (repeatable)",
+    )
+    parser.add_argument("--ttft", type=float, default=0.3, help="share of LLM latency before the first token")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    behaviour = Behaviour(_parse_latency(args.latency), _parse_rates(args.error_rate), args.ttft, args.seed)
+    uvicorn.run(create_app(behaviour), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -9,4 +9,171 @@ MISTRAL_API_KEY = os.getenv("MISTRAL_API_KEY", "")
 ELEVENLABS_API_KEY = os.getenv("ELEVENLABS_API_KEY", "")
 ELEVENLABS_VOICE_ID = os.getenv("ELEVENLABS_VOICE_ID", "EXAVITQu4vr4xnSDxMaL")  # Default: "Sarah" voice
 
+# Upstream API base URLs (point at benchmarks/mock_upstreams.py for load tests)
+MISTRAL_API_BASE = os.getenv("MISTRAL_API_BASE", "https://api.mistral.ai").rstrip("/")
+ELEVENLABS_API_BASE = os.getenv("ELEVENLABS_API_BASE", "https://api.elevenlabs.io").rstrip("/")
+
 SYSTEM_PROMPT_PATH = os.path.join(os.path.dirname(__file__), "..", "prompts", "system_prompt.txt")
+PROMPTS_DIR = os.getenv("PROMPTS_DIR", os.path.dirname(SYSTEM_PROMPT_PATH))
+PROMPT_RELOAD_INTERVAL = float(os.getenv("PROMPT_RELOAD_INTERVAL", "2"))  # 0 disables hot reload
+
+# Upstream HTTP connection pools (one shared client per upstream)
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "1") == "1"
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_POOL_LIMITS = {
+    "mistral": int(os.getenv("MISTRAL_POOL_MAX_CONNECTIONS", "50")),
+    "elevenlabs": int(os.getenv("ELEVENLABS_POOL_MAX_CONNECTIONS", "20")),
+}
+HTTP_POOL_KEEPALIVE = {
+    "mistral": int(os.getenv("MISTRAL_POOL_MAX_KEEPALIVE", "20")),
+    "elevenlabs": int(os.getenv("ELEVENLABS_POOL_MAX_KEEPALIVE", "10")),
+}
+
+# Per-call read timeouts (seconds)
+STT_TIMEOUT = float(os.getenv("STT_TIMEOUT", "60"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "30"))
+EMOTION_TIMEOUT = float(os.getenv("EMOTION_TIMEOUT", "15"))
+TTS_TIMEOUT = float(os.getenv("TTS_TIMEOUT", "30"))
+
+# /chat pipeline stage timeouts (seconds). Stages with a fallback degrade
+# instead of failing the turn when they run over.
+STAGE_TIMEOUTS = {
+    "transcript": float(os.getenv("STAGE_TIMEOUT_TRANSCRIPT", "90")),
+    "emotion": float(os.getenv("STAGE_TIMEOUT_EMOTION", "8")),
+    "response": float(os.getenv("STAGE_TIMEOUT_RESPONSE", "35")),
+    "tts": float(os.getenv("STAGE_TIMEOUT_TTS", "35")),
+}
+
+# Start the reply LLM call with the local (provisional) emotion while the
+# Mistral classification is still running; kept if the labels agree, else
+# cancelled and restarted. Costs a wasted call on every disagreement.
+SPECULATIVE_LLM = os.getenv("SPECULATIVE_LLM", "0") == "1"
+
+# Short-lived synthesized audio served at /audio/{id}
+AUDIO_TTL_SECONDS = float(os.getenv("AUDIO_TTL_SECONDS", "120"))
+AUDIO_STORE_MAX_BYTES = int(os.getenv("AUDIO_STORE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+# Session storage: "memory" (single process), "sqlite" or "redis" (shared)
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "memory").lower()
+SESSION_SQLITE_PATH = os.getenv("SESSION_SQLITE_PATH", os.path.join(BASE_DIR, "sessions.db"))
+SESSION_REDIS_URL = os.getenv("SESSION_REDIS_URL", "redis://localhost:6379/0")
+SESSION_REDIS_PREFIX = os.getenv("SESSION_REDIS_PREFIX", "soultalk:session:")
+SESSION_TTL_SECONDS = int(os.getenv("SESSION_TTL_SECONDS", str(7 * 24 * 3600)))
+
+# In-process session limits (memory backend); idle sessions past the TTL and
+# least-recently-used ones over the count/byte budget are evicted.
+SESSION_IDLE_TTL_SECONDS = float(os.getenv("SESSION_IDLE_TTL_SECONDS", str(6 * 3600)))
+SESSION_MAX_COUNT = int(os.getenv("SESSION_MAX_COUNT", "10000"))
+SESSION_MAX_BYTES = int(os.getenv("SESSION_MAX_BYTES", str(256 * 1024 * 1024)))
+SESSION_SWEEP_INTERVAL = float(os.getenv("SESSION_SWEEP_INTERVAL", "60"))
+
+# Journal for the memory backend: mutations are appended to SESSION_JOURNAL_DIR
+# with one fsync per SESSION_JOURNAL_FSYNC_MS at most, folded into a snapshot
+# every SESSION_JOURNAL_SNAPSHOT_EVENTS events, and replayed on startup.
+# Empty disables it.
+SESSION_JOURNAL_DIR = os.getenv("SESSION_JOURNAL_DIR", "")
+SESSION_JOURNAL_FSYNC_MS = float(os.getenv("SESSION_JOURNAL_FSYNC_MS", "50"))
+SESSION_JOURNAL_SNAPSHOT_EVENTS = int(os.getenv("SESSION_JOURNAL_SNAPSHOT_EVENTS", "10000"))
+
+# Optional extra entity vocabulary (JSON or TSV), merged into the built-in keywords
+ENTITY_KEYWORDS_PATH = os.getenv("ENTITY_KEYWORDS_PATH", "")
+
+# Local emotion classifier; turns below the confidence threshold escalate to
+# the Mistral classifier. A sample of confident turns can also be checked
+# against Mistral in the background to measure agreement.
+EMOTION_MODEL_PATH = os.getenv("EMOTION_MODEL_PATH", os.path.join(BASE_DIR, "data", "emotion_model.npz"))
+EMOTION_LOCAL_THRESHOLD = float(os.getenv("EMOTION_LOCAL_THRESHOLD", "0.7"))
+EMOTION_SHADOW_SAMPLE_RATE = float(os.getenv("EMOTION_SHADOW_SAMPLE_RATE", "0"))
+
+# Content-addressed TTS cache: in-memory LRU tier plus an on-disk tier
+# holding only the pre-warmed fixed phrases (TTS_CACHE_DIR="" disables it).
+TTS_CACHE_MEMORY_BYTES = int(os.getenv("TTS_CACHE_MEMORY_BYTES", str(32 * 1024 * 1024)))
+TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR", os.path.join(BASE_DIR, "tts_cache"))
+TTS_PREWARM = os.getenv("TTS_PREWARM", "1") == "1"
+
+# /chat/stream: send the emotion's pre-synthesized filler clip ("Hmm…") as soon
+# as the emotion is known, and only synthesize the rest of the reply
+STREAM_PREFETCH_FILLER = os.getenv("STREAM_PREFETCH_FILLER", "1") == "1"
+
+# Per-upstream scheduling: concurrent calls, token-bucket rate (requests/s,
+# burst), and a bounded wait queue. Calls that would exceed the queue or wait
+# longer than UPSTREAM_MAX_WAIT are shed and take the service's fallback path.
+UPSTREAM_LIMITS = {
+    "mistral": {
+        "max_concurrency": int(os.getenv("MISTRAL_MAX_CONCURRENCY", "16")),
+        "rate": float(os.getenv("MISTRAL_RATE_LIMIT", "10")),
+        "burst": int(os.getenv("MISTRAL_RATE_BURST", "20")),
+        "max_queue": int(os.getenv("MISTRAL_MAX_QUEUE", "100")),
+    },
+    "elevenlabs": {
+        "max_concurrency": int(os.getenv("ELEVENLABS_MAX_CONCURRENCY", "5")),
+        "rate": float(os.getenv("ELEVENLABS_RATE_LIMIT", "10")),
+        "burst": int(os.getenv("ELEVENLABS_RATE_BURST", "10")),
+        "max_queue": int(os.getenv("ELEVENLABS_MAX_QUEUE", "50")),
+    },
+}
+UPSTREAM_MAX_WAIT = float(os.getenv("UPSTREAM_MAX_WAIT", "10"))
+
+# STT hedging: the next model is started once the current one has run past its
+# recent p95 latency (STT_HEDGE_DELAY until enough samples exist). A model that
+# fails STT_BREAKER_THRESHOLD times in a row is skipped for STT_BREAKER_COOLDOWN.
+STT_HEDGE_DELAY = float(os.getenv("STT_HEDGE_DELAY", "4"))
+STT_HEDGE_MIN_DELAY = float(os.getenv("STT_HEDGE_MIN_DELAY", "0.5"))
+STT_BREAKER_THRESHOLD = int(os.getenv("STT_BREAKER_THRESHOLD", "3"))
+STT_BREAKER_COOLDOWN = float(os.getenv("STT_BREAKER_COOLDOWN", "30"))
+
+# Audio preprocessing before STT: decode, mono 16 kHz, trim silence with an
+# energy VAD (frames below VAD_THRESHOLD_DB dBFS), re-encode. Clips with less
+# than VAD_MIN_SPEECH_MS of voiced audio skip STT entirely.
+AUDIO_PREPROCESS = os.getenv("AUDIO_PREPROCESS", "1") == "1"
+VAD_THRESHOLD_DB = float(os.getenv("VAD_THRESHOLD_DB", "-45"))
+VAD_PAD_MS = int(os.getenv("VAD_PAD_MS", "200"))
+VAD_MIN_SPEECH_MS = int(os.getenv("VAD_MIN_SPEECH_MS", "150"))
+
+# Upload limits for /chat audio: bytes (enforced while the body streams in)
+# and decoded duration in seconds
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(10 * 1024 * 1024)))
+MAX_AUDIO_SECONDS = float(os.getenv("MAX_AUDIO_SECONDS", "120"))
+
+# Batch jobs (/batch): state and inputs live under BATCH_DIR so jobs resume
+# after a restart. BATCH_CONCURRENCY clips are in flight across all jobs
+# (kept low so batch traffic leaves upstream capacity to live turns),
+# preprocessing runs on BATCH_WORKERS processes. Manifest paths must be
+# inside BATCH_INPUT_DIR (empty disables manifests).
+BATCH_DIR = os.getenv("BATCH_DIR", os.path.join(BASE_DIR, "batch_jobs"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+BATCH_WORKERS = int(os.getenv("BATCH_WORKERS", "2"))
+BATCH_MAX_FILES = int(os.getenv("BATCH_MAX_FILES", "1000"))
+BATCH_MAX_UPLOAD_BYTES = int(os.getenv("BATCH_MAX_UPLOAD_BYTES", str(512 * 1024 * 1024)))
+BATCH_INPUT_DIR = os.getenv("BATCH_INPUT_DIR", "")
+
+# /ws/session: trailing silence that ends an utterance
+WS_END_SILENCE_MS = int(os.getenv("WS_END_SILENCE_MS", "700"))
+
+# Conversation history: recent turns sent verbatim are capped at
+# HISTORY_TOKEN_BUDGET (local estimate); once SUMMARY_MIN_TOKENS of older turns
+# have fallen out of that window they are folded into a rolling summary of up
+# to SUMMARY_MAX_TOKENS in the background
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "800"))
+SUMMARY_MIN_TOKENS = int(os.getenv("SUMMARY_MIN_TOKENS", "300"))
+SUMMARY_MAX_TOKENS = int(os.getenv("SUMMARY_MAX_TOKENS", "200"))
+HISTORY_MAX_MESSAGES = int(os.getenv("HISTORY_MAX_MESSAGES", "60"))
+
+# Cache for escalated (Mistral) emotion classifications: LRU size, TTL in
+# seconds, MinHash similarity for near-duplicate reuse, and an optional Redis
+# URL to share entries between workers
+EMOTION_CACHE_SIZE = int(os.getenv("EMOTION_CACHE_SIZE", "5000"))
+EMOTION_CACHE_TTL = float(os.getenv("EMOTION_CACHE_TTL", str(24 * 3600)))
+EMOTION_CACHE_SIMILARITY = float(os.getenv("EMOTION_CACHE_SIMILARITY", "0.7"))
+EMOTION_CACHE_REDIS_URL = os.getenv("EMOTION_CACHE_REDIS_URL", "")
+
+# Emotion trajectory kept per session (points, ~6 bytes each) and the
+# rolling distress level / rise over one window that counts as escalation
+MOOD_MAX_POINTS = int(os.getenv("MOOD_MAX_POINTS", "20000"))
+MOOD_WINDOW = int(os.getenv("MOOD_WINDOW", "10"))
+MOOD_ESCALATION_LEVEL = float(os.getenv("MOOD_ESCALATION_LEVEL", "0.6"))
+MOOD_ESCALATION_DELTA = float(os.getenv("MOOD_ESCALATION_DELTA", "0.2"))
+
+# Add a Server-Timing header with the spans recorded for each response
+SERVER_TIMING = os.getenv("SERVER_TIMING", "0") == "1"
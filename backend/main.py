@@ -2,26 +2,93 @@
 SoulTalk AI — Backend API
 """
 
+import asyncio
 import base64
-from fastapi import FastAPI, UploadFile, File
+import json
+import re
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, UploadFile, File, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
 
-from services.voxtral_service import transcribe_audio
-from services.mistral_service import generate_response
-from services.elevenlabs_service import text_to_speech
-from services.emotion_service import detect_emotion
+from config import (
+    BATCH_MAX_FILES,
+    BATCH_MAX_UPLOAD_BYTES,
+    MAX_UPLOAD_BYTES,
+    MOOD_MAX_POINTS,
+    MOOD_WINDOW,
+    PROMPT_RELOAD_INTERVAL,
+    SERVER_TIMING,
+    SESSION_SWEEP_INTERVAL,
+    TTS_PREWARM,
+)
+from services.audio_store import get_audio, put_audio
+from services.batch_jobs import (
+    BatchError,
+    batch_stats,
+    cancel_job,
+    create_job_from_files,
+    create_job_from_manifest,
+    job_status,
+    resume_jobs,
+    start_job,
+    stream_results,
+)
+from services.batch_jobs import shutdown as shutdown_batch
+from services.chat_pipeline import run_chat_turn, stream_chat_turn
+from services.elevenlabs_service import prewarm, speech_cache_key
+from services.emotion_service import emotion_stats
+from services.http_client import close_clients, pool_stats, start_clients
+from services.metrics import MetricsMiddleware, observe_size, register_collector, render, span
+from services.mistral_service import known_replies
+from services.prompt_registry import load_prompts, prompt_stats, watch_prompts
+from services.speculative import speculation_stats
+from services.tts_cache import cached_path, tts_cache_stats
+from services.upload_limits import UploadLimitMiddleware, UploadTooLarge, read_upload
+from services.upstream_scheduler import scheduler_stats
+from services.voice_session import MAX_SAMPLE_RATE, MIN_SAMPLE_RATE, VoiceSession
+from services.voxtral_service import stt_model_stats
 from services.memory_service import (
+    close_store,
     create_session,
-    get_session,
-    add_message,
-    get_history,
-    get_memory_context,
-    update_session,
+    get_mood,
+    get_store,
+    offload,
+    run_session_sweeper,
+    session_stats,
+    start_journal,
 )
 
-app = FastAPI(title="SoulTalk AI", version="0.1.0")
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await start_clients()
+    get_store()
+    start_journal()
+    load_prompts()
+    background = [asyncio.create_task(run_session_sweeper(SESSION_SWEEP_INTERVAL))]
+    if PROMPT_RELOAD_INTERVAL > 0:
+        background.append(asyncio.create_task(watch_prompts(PROMPT_RELOAD_INTERVAL)))
+    if TTS_PREWARM:
+        background.append(asyncio.create_task(prewarm(known_replies())))
+    resume_jobs()
+    try:
+        yield
+    finally:
+        for task in background:
+            task.cancel()
+        await shutdown_batch()
+        await close_clients()
+        close_store()
+
+
+app = FastAPI(title="SoulTalk AI", version="0.1.0", lifespan=lifespan)
+
+# Added first so it sits inside CORS: its 413 then carries CORS headers
+app.add_middleware(
+    UploadLimitMiddleware,
+    limits={"/chat": MAX_UPLOAD_BYTES, "/batch": BATCH_MAX_UPLOAD_BYTES},
+)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -29,6 +96,17 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(MetricsMiddleware, server_timing=SERVER_TIMING)
+
+register_collector("pool", pool_stats, label="upstream")
+register_collector("sessions", session_stats)
+register_collector("emotion", emotion_stats)
+register_collector("tts_cache", tts_cache_stats)
+register_collector("upstream", scheduler_stats, label="upstream")
+register_collector("batch", batch_stats)
+register_collector("speculation", speculation_stats)
+register_collector("prompts", prompt_stats)
+register_collector("stt", lambda: stt_model_stats()["models"], label="model")
 
 
 @app.get("/")
@@ -36,49 +114,127 @@ async def root():
     return {"status": "ok", "app": "SoulTalk AI"}
 
 
+@app.get("/stats/pools")
+async def http_pool_stats():
+    return pool_stats()
+
+
+@app.get("/stats/sessions")
+async def session_store_stats():
+    return await offload(session_stats)
+
+
+@app.get("/stats/emotion")
+async def emotion_classifier_stats():
+    return emotion_stats()
+
+
+@app.get("/stats/tts")
+async def tts_stats():
+    return tts_cache_stats()
+
+
+@app.get("/stats/upstreams")
+async def upstream_stats():
+    return scheduler_stats()
+
+
+@app.get("/stats/speculation")
+async def speculative_llm_stats():
+    return speculation_stats()
+
+
+@app.get("/stats/stt")
+async def stt_stats():
+    return stt_model_stats()
+
+
+@app.get("/stats/prompts")
+async def prompt_registry_stats():
+    return prompt_stats()
+
+
+@app.get("/metrics")
+async def metrics():
+    return Response(content=render(), media_type="text/plain; version=0.0.4")
+
+
 @app.post("/session")
 async def new_session():
-    sid = create_session()
+    sid = await offload(create_session)
     return {"session_id": sid}
 
 
-@app.post("/chat")
-async def full_chat(audio: UploadFile = File(...), session_id: str = ""):
-    """Full pipeline: audio → transcript → emotion → AI response → TTS."""
-    try:
-        audio_bytes = await audio.read()
-        mime = audio.content_type or "audio/wav"
-        transcript = await transcribe_audio(audio_bytes, mime)
+@app.get("/session/{session_id}/mood")
+async def session_mood(session_id: str, window: int = MOOD_WINDOW, points: int = 200):
+    """Emotion trajectory analytics: label mix, distress trend, rolling mean, escalations."""
+    mood = await offload(get_mood, session_id, max(1, min(window, MOOD_MAX_POINTS)), max(1, min(points, 2000)))
+    if mood is None:
+        return JSONResponse(status_code=404, content={"error": "session_not_found"})
+    return mood
 
-        if not session_id or not get_session(session_id):
-            session_id = create_session()
 
-        add_message(session_id, "user", transcript)
+def _encode_audio(audio: bytes, audio_mode: str, text: str = "") -> dict:
+    """
+    ``audio_mode=base64`` inlines the clip (default, backwards compatible);
+    ``audio_mode=url`` returns a URL instead: the content-addressed /tts clip
+    when ``text`` is already in the on-disk TTS cache, else a short-lived
+    /audio entry.
+    """
+    observe_size("response_audio", len(audio))
+    with span("audio_encode", audio_mode):
+        if audio_mode == "url":
+            if not audio:
+                return {"audio_base64": "", "audio_url": ""}
+            key = speech_cache_key(text) if text else None
+            if key and cached_path(key):
+                return {"audio_base64": "", "audio_url": f"/tts/{key}.mp3"}
+            return {"audio_base64": "", "audio_url": f"/audio/{put_audio(audio)}"}
+        return {"audio_base64": base64.b64encode(audio).decode("utf-8") if audio else ""}
 
-        memory = get_memory_context(session_id)
-        history = get_history(session_id)
-        emotion_data = await detect_emotion(transcript)
 
-        response_text = await generate_response(
-            transcript, memory, history, emotion=emotion_data
-        )
-        add_message(session_id, "assistant", response_text)
-        update_session(
-            session_id,
-            topic=transcript[:50],
-            tone=emotion_data.get("emotion", "neutral"),
-        )
+@app.get("/tts/{key}.mp3")
+async def fetch_cached_speech(key: str):
+    path = cached_path(key) if re.fullmatch(r"[0-9a-f]{64}", key) else None
+    if path is None:
+        return JSONResponse(status_code=404, content={"error": "audio_not_found"})
+    # Content-addressed, so the clip for a key never changes.
+    return FileResponse(path, media_type="audio/mpeg", headers={"Cache-Control": "public, max-age=31536000, immutable"})
+
+
+@app.get("/audio/{audio_id}")
+async def fetch_audio(audio_id: str):
+    clip = get_audio(audio_id)
+    if clip is None:
+        return JSONResponse(status_code=404, content={"error": "audio_not_found"})
+    audio, media_type = clip
+    return Response(content=audio, media_type=media_type, headers={"Cache-Control": "private, max-age=60"})
+
 
-        tts_audio = await text_to_speech(response_text)
-        audio_b64 = base64.b64encode(tts_audio).decode("utf-8") if tts_audio else ""
+@app.post("/chat")
+async def full_chat(
+    audio: UploadFile = File(...),
+    session_id: str = "",
+    audio_mode: str = "base64",
+    persona: str = "",
+    language: str = "",
+):
+    """Full pipeline: audio → transcript → emotion → AI response → TTS."""
+    try:
+        audio_bytes = await _read_audio(audio)
+        mime = audio.content_type or "audio/wav"
+        turn = await run_chat_turn(audio_bytes, mime, session_id, persona or None, language or None)
 
         return {
-            "transcript": transcript,
-            "response": response_text,
-            "emotion": emotion_data,
-            "audio_base64": audio_b64,
-            "session_id": session_id,
+            "transcript": turn["transcript"],
+            "response": turn["response"],
+            "emotion": turn["emotion"],
+            **_encode_audio(turn["tts_audio"], audio_mode, turn["response"]),
+            "session_id": turn["session_id"],
+            "timings": turn["timings"],
         }
+    except UploadTooLarge as e:
+        return _upload_too_large(e)
     except Exception as e:
         return JSONResponse(
             status_code=500,
@@ -86,6 +242,165 @@ async def full_chat(audio: UploadFile = File(...), session_id: str = ""):
         )
 
 
+async def _read_audio(audio: UploadFile) -> bytes:
+    with span("upload_read"):
+        data = await read_upload(audio, MAX_UPLOAD_BYTES)
+    observe_size("upload", len(data))
+    return data
+
+
+def _upload_too_large(exc: UploadTooLarge) -> JSONResponse:
+    return JSONResponse(status_code=413, content={"error": "upload_too_large", "detail": str(exc)})
+
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@app.post("/chat/stream")
+async def stream_chat(
+    audio: UploadFile = File(...),
+    session_id: str = "",
+    audio_mode: str = "base64",
+    persona: str = "",
+    language: str = "",
+):
+    """
+    Streaming pipeline over Server-Sent Events: ``transcript`` and ``emotion``
+    as soon as they are known, the ``filler`` clip, then ``text``/``audio``
+    per sentence, then ``done``.
+    """
+    try:
+        audio_bytes = await _read_audio(audio)
+    except UploadTooLarge as e:
+        return _upload_too_large(e)
+    mime = audio.content_type or "audio/wav"
+
+    async def events():
+        try:
+            async for event, data in stream_chat_turn(
+                audio_bytes, mime, session_id, persona or None, language or None
+            ):
+                if event in ("audio", "filler"):
+                    data.update(_encode_audio(data.pop("audio"), audio_mode, data.get("text", "")))
+                yield _sse(event, data)
+        except UploadTooLarge as e:
+            yield _sse("error", {"error": "upload_too_large", "detail": str(e)})
+        except Exception as e:
+            yield _sse("error", {"error": "chat_pipeline_failed", "detail": str(e)})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.post("/batch")
+async def create_batch(request: Request):
+    """
+    Start a batch transcription + emotion job, from multipart ``files`` or a
+    JSON manifest (``{"items": [{"path": ..., "id": ...}]}``, paths under
+    ``BATCH_INPUT_DIR``). Poll ``/batch/{job_id}``, read ``/batch/{job_id}/results``.
+    """
+    form = None
+    try:
+        if request.headers.get("content-type", "").startswith("multipart/form-data"):
+            form = await request.form(max_files=BATCH_MAX_FILES)
+            # Spooled uploads are copied to the job directory one by one,
+            # never all held in memory at once
+            files = [
+                (upload.filename, upload.content_type, upload.file)
+                for upload in form.getlist("files")
+                if not isinstance(upload, str)
+            ]
+            meta = await asyncio.to_thread(create_job_from_files, files)
+        else:
+            meta = await asyncio.to_thread(create_job_from_manifest, await request.json())
+    except UploadTooLarge as e:
+        return _upload_too_large(e)
+    except (BatchError, ValueError) as e:
+        return JSONResponse(status_code=400, content={"error": "invalid_batch", "detail": str(e)})
+    finally:
+        if form is not None:
+            await form.close()  # removes the spooled temp files
+    start_job(meta)
+    return JSONResponse(status_code=202, content=await job_status(meta["job_id"]))
+
+
+@app.get("/batch/{job_id}")
+async def batch_status(job_id: str):
+    status = await job_status(job_id)
+    if status is None:
+        return JSONResponse(status_code=404, content={"error": "job_not_found"})
+    return status
+
+
+@app.get("/batch/{job_id}/results")
+async def batch_results(job_id: str, follow: bool = True):
+    """NDJSON, one line per finished clip; with ``follow`` open until the job ends."""
+    if await job_status(job_id) is None:
+        return JSONResponse(status_code=404, content={"error": "job_not_found"})
+    return StreamingResponse(stream_results(job_id, follow), media_type="application/x-ndjson")
+
+
+@app.delete("/batch/{job_id}")
+async def batch_cancel(job_id: str):
+    status = await cancel_job(job_id)
+    if status is None:
+        return JSONResponse(status_code=404, content={"error": "job_not_found"})
+    return status
+
+
+@app.websocket("/ws/session/{session_id}")
+async def voice_session(
+    websocket: WebSocket,
+    session_id: str,
+    audio_mode: str = "base64",
+    persona: str = "",
+    language: str = "",
+    sample_rate: int = 16000,
+):
+    """
+    Real-time voice session: binary frames carry 16-bit mono PCM at
+    ``sample_rate``; the server detects the end of each utterance and replies
+    with the same events as ``/chat/stream`` as JSON messages.
+    """
+    await websocket.accept()
+    if not MIN_SAMPLE_RATE <= sample_rate <= MAX_SAMPLE_RATE:
+        await websocket.send_json(
+            {
+                "type": "error",
+                "error": "invalid_sample_rate",
+                "detail": f"sample_rate must be {MIN_SAMPLE_RATE}-{MAX_SAMPLE_RATE}",
+            }
+        )
+        await websocket.close(code=1008)
+        return
+    session = VoiceSession(
+        websocket.send_json,
+        lambda audio, text: _encode_audio(audio, audio_mode, text),
+        session_id,
+        persona or None,
+        language or None,
+        sample_rate,
+    )
+    try:
+        await session.start()
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            if message.get("bytes") is not None:
+                await session.feed_audio(message["bytes"])
+            elif message.get("text") is not None:
+                await session.handle_control(message["text"])
+    except WebSocketDisconnect:
+        pass
+    finally:
+        await session.close()
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
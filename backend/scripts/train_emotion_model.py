@@ -0,0 +1,94 @@
+"""
+Train the local emotion classifier from the seed corpus.
+
+    cd backend && python scripts/train_emotion_model.py [corpus.tsv ...]
+
+Fits the confidence temperature on 5-fold held-out predictions, reports
+cross-validated accuracy and how accuracy/coverage move with the confidence
+threshold (EMOTION_LOCAL_THRESHOLD), then writes data/emotion_model.npz.
+"""
+
+import os
+import random
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import EMOTION_MODEL_PATH  # noqa: E402
+from services.emotion_model import EmotionModel  # noqa: E402
+from services.emotion_service import EMOTIONS  # noqa: E402
+
+DEFAULT_CORPUS = os.path.join(os.path.dirname(EMOTION_MODEL_PATH), "emotion_seed.tsv")
+FOLDS = 5
+TEMPERATURES = (1, 1.5, 2, 3, 4, 6, 8, 12, 16)
+
+
+def _read_corpus(paths):
+    rows = []
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.rstrip("\n")
+                if not line or line.startswith("#"):
+                    continue
+                label, text = line.split("\t", 1)
+                if label not in EMOTIONS:
+                    raise SystemExit(f"{path}: unknown label {label!r}")
+                rows.append((text, label))
+    return rows
+
+
+def _softmax(scores: np.ndarray) -> np.ndarray:
+    scores = np.exp(scores - scores.max(axis=1, keepdims=True))
+    return scores / scores.sum(axis=1, keepdims=True)
+
+
+def _cross_validate(rows) -> float:
+    """Print held-out accuracy/coverage and return the fitted temperature."""
+    rng = random.Random(13)
+    rows = rows[:]
+    rng.shuffle(rows)
+    scores, targets = [], []
+    for fold in range(FOLDS):
+        test = rows[fold::FOLDS]
+        train = [r for i, r in enumerate(rows) if i % FOLDS != fold]
+        model = EmotionModel.train([t for t, _ in train], [l for _, l in train], EMOTIONS)
+        for text, label in test:
+            scores.append(model.log_scores(text))
+            targets.append(EMOTIONS.index(label))
+    scores = np.array(scores, dtype=np.float64)
+    targets = np.array(targets)
+
+    def nll(temperature):
+        probs = _softmax(scores / temperature)
+        return -np.log(probs[np.arange(len(targets)), targets]).mean()
+
+    temperature = min(TEMPERATURES, key=nll)
+    probs = _softmax(scores / temperature)
+    correct = probs.argmax(axis=1) == targets
+    confidence = probs.max(axis=1)
+
+    print(f"{FOLDS}-fold accuracy: {correct.mean():.3f} over {len(targets)} utterances")
+    print(f"temperature: {temperature} (held-out NLL {nll(temperature):.3f})")
+    print(f"{'threshold':>9} {'coverage':>9} {'accuracy':>9}")
+    for threshold in (0.4, 0.5, 0.6, 0.7, 0.8, 0.9):
+        kept = confidence >= threshold
+        acc = correct[kept].mean() if kept.any() else 0.0
+        print(f"{threshold:>9.2f} {kept.mean():>9.2f} {acc:>9.3f}")
+    return temperature
+
+
+def main():
+    paths = sys.argv[1:] or [DEFAULT_CORPUS]
+    rows = _read_corpus(paths)
+    temperature = _cross_validate(rows)
+    model = EmotionModel.train([t for t, _ in rows], [l for _, l in rows], EMOTIONS)
+    model.temperature = temperature
+    model.save(EMOTION_MODEL_PATH)
+    print(f"wrote {EMOTION_MODEL_PATH} ({model.n_features} features, {len(rows)} utterances)")
+
+
+if __name__ == "__main__":
+    main()
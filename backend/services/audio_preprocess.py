@@ -0,0 +1,266 @@
+"""
+Audio preprocessing before speech-to-text.
+Uploads are decoded (WAV natively, anything else through ffmpeg when it is
+installed), downmixed to mono, resampled to 16 kHz and trimmed to the voiced
+region with a frame-energy VAD, then re-encoded (Ogg/Opus with ffmpeg, 16-bit
+WAV otherwise). STT is billed and paced by audio length, so trimming leading
+and trailing silence cuts both latency and cost; clips with no speech at all
+never reach the upstream. Anything that cannot be decoded is passed through
+unchanged. Clips longer than ``MAX_AUDIO_SECONDS`` are rejected with
+:class:`UploadTooLarge` (for WAV, from the header before any samples are read).
+"""
+
+from __future__ import annotations
+import io
+import os
+import shutil
+import subprocess
+import wave
+from typing import Optional
+
+import numpy as np
+
+from config import (
+    AUDIO_PREPROCESS,
+    MAX_AUDIO_SECONDS,
+    MAX_UPLOAD_BYTES,
+    VAD_MIN_SPEECH_MS,
+    VAD_PAD_MS,
+    VAD_THRESHOLD_DB,
+)
+from services.upload_limits import UploadTooLarge
+
+SAMPLE_RATE = 16000
+FRAME_MS = 30
+FRAME_SAMPLES = SAMPLE_RATE * FRAME_MS // 1000
+_FFMPEG = shutil.which("ffmpeg")
+_FFMPEG_TIMEOUT = 20
+_WAV_MIMES = {"audio/wav", "audio/x-wav", "audio/wave"}
+
+
+def _run_ffmpeg(args: list[str], data: bytes) -> Optional[bytes]:
+    try:
+        proc = subprocess.run(
+            [_FFMPEG, "-hide_banner", "-loglevel", "error", *args],
+            input=data,
+            capture_output=True,
+            timeout=_FFMPEG_TIMEOUT,
+            check=True,
+        )
+        return proc.stdout
+    except Exception:
+        return None
+
+
+def _pcm_to_float(raw: bytes, width: int) -> np.ndarray:
+    if width == 1:
+        return (np.frombuffer(raw, dtype=np.uint8).astype(np.float32) - 128) / 128
+    if width == 2:
+        return np.frombuffer(raw, dtype="<i2").astype(np.float32) / 32768
+    if width == 3:
+        b = np.frombuffer(raw, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        ints = b[:, 0] | (b[:, 1] << 8) | (b[:, 2] << 16)
+        ints = np.where(ints & 0x800000, ints - 0x1000000, ints)
+        return ints.astype(np.float32) / 8388608
+    if width == 4:
+        return np.frombuffer(raw, dtype="<i4").astype(np.float32) / 2147483648
+    raise ValueError(f"unsupported sample width {width}")
+
+
+def resample(samples: np.ndarray, rate: int) -> np.ndarray:
+    if rate == SAMPLE_RATE or samples.size == 0:
+        return samples
+    if rate % SAMPLE_RATE == 0:
+        # Integer decimation (48k, 32k): block averaging doubles as a cheap low-pass
+        step = rate // SAMPLE_RATE
+        usable = samples.size - samples.size % step
+        return samples[:usable].reshape(-1, step).mean(axis=1)
+    n_out = int(round(samples.size * SAMPLE_RATE / rate))
+    positions = np.arange(n_out, dtype=np.float64) * (rate / SAMPLE_RATE)
+    return np.interp(positions, np.arange(samples.size), samples).astype(np.float32)
+
+
+class StreamResampler:
+    """
+    :func:`resample` for audio that arrives in chunks. Unconsumed input and
+    the fractional read position carry over between calls, so chunk
+    boundaries add no discontinuities and drop no samples.
+    """
+
+    def __init__(self, rate: int):
+        self.rate = rate
+        self._tail = np.empty(0, dtype=np.float32)  # input not consumed yet
+        self._pos = 0.0  # next output position, in input samples from _tail[0]
+
+    def feed(self, samples: np.ndarray) -> np.ndarray:
+        if self.rate == SAMPLE_RATE:
+            return samples
+        data = np.concatenate([self._tail, samples])
+        if self.rate % SAMPLE_RATE == 0:
+            step = self.rate // SAMPLE_RATE
+            usable = data.size - data.size % step
+            self._tail = data[usable:]
+            return data[:usable].reshape(-1, step).mean(axis=1)
+        step = self.rate / SAMPLE_RATE
+        # Each output needs the input sample on its right to interpolate
+        n_out = int((data.size - 1 - self._pos) // step) + 1 if data.size - 1 >= self._pos else 0
+        positions = self._pos + np.arange(n_out, dtype=np.float64) * step
+        out = np.interp(positions, np.arange(data.size), data).astype(np.float32)
+        next_pos = self._pos + n_out * step
+        consumed = min(int(next_pos), data.size)
+        self._tail = data[consumed:]
+        self._pos = next_pos - consumed
+        return out
+
+
+def _check_duration(seconds: float):
+    if seconds > MAX_AUDIO_SECONDS:
+        raise UploadTooLarge(f"audio is {seconds:.0f}s, limit is {MAX_AUDIO_SECONDS:.0f}s")
+
+
+def _decode_wav(audio: bytes) -> np.ndarray:
+    with wave.open(io.BytesIO(audio)) as wav:
+        channels, width, rate = wav.getnchannels(), wav.getsampwidth(), wav.getframerate()
+        _check_duration(wav.getnframes() / rate)
+        raw = wav.readframes(wav.getnframes())
+    samples = _pcm_to_float(raw, width)
+    if channels > 1:
+        samples = samples[: samples.size - samples.size % channels].reshape(-1, channels).mean(axis=1)
+    return resample(samples, rate)
+
+
+def decode(audio: bytes, mime: str) -> Optional[np.ndarray]:
+    """Mono float32 samples at 16 kHz, or None if the format can't be decoded here."""
+    if mime in _WAV_MIMES or audio[:4] == b"RIFF":
+        try:
+            return _decode_wav(audio)
+        except UploadTooLarge:
+            raise
+        except Exception:
+            pass
+    if _FFMPEG is None:
+        return None
+    # -t caps the decoded output just past the limit so the check below can fire
+    raw = _run_ffmpeg(
+        ["-i", "pipe:0", "-t", str(MAX_AUDIO_SECONDS + 1), "-f", "s16le", "-ac", "1",
+         "-ar", str(SAMPLE_RATE), "pipe:1"],
+        audio,
+    )
+    if raw is None:
+        return None
+    samples = _pcm_to_float(raw, 2)
+    _check_duration(samples.size / SAMPLE_RATE)
+    return samples
+
+
+def frame_levels(samples: np.ndarray) -> np.ndarray:
+    """RMS level in dBFS of each complete ``FRAME_MS`` frame."""
+    n_frames = samples.size // FRAME_SAMPLES
+    frames = samples[: n_frames * FRAME_SAMPLES].reshape(n_frames, FRAME_SAMPLES)
+    return 10 * np.log10(np.mean(frames * frames, axis=1) + 1e-10)
+
+
+def voiced_bounds(samples: np.ndarray) -> Optional[tuple[int, int]]:
+    """
+    Sample range ``[start, end)`` spanning all voiced frames plus padding, or
+    None when nothing is voiced. A frame is voiced when its RMS level clears
+    both ``VAD_THRESHOLD_DB`` and the clip's own noise floor by 10 dB (or sits
+    within 10 dB of the loudest frame).
+    """
+    frame = FRAME_SAMPLES
+    level_db = frame_levels(samples)
+    if level_db.size == 0:
+        return None
+    noise_floor = np.percentile(level_db, 10)
+    # Capped below the peak so a clip that is speech throughout still passes
+    adaptive = min(noise_floor + 10, level_db.max() - 10)
+    voiced = np.flatnonzero(level_db > max(VAD_THRESHOLD_DB, adaptive))
+    if voiced.size * FRAME_MS < VAD_MIN_SPEECH_MS:
+        return None
+    pad = SAMPLE_RATE * VAD_PAD_MS // 1000
+    start = max(0, voiced[0] * frame - pad)
+    end = min(samples.size, (voiced[-1] + 1) * frame + pad)
+    return int(start), int(end)
+
+
+def _to_pcm16(samples: np.ndarray) -> bytes:
+    return (np.clip(samples, -1.0, 1.0) * 32767).astype("<i2").tobytes()
+
+
+def to_wav(samples: np.ndarray) -> bytes:
+    """16-bit mono WAV at 16 kHz."""
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(SAMPLE_RATE)
+        wav.writeframes(_to_pcm16(samples))
+    return buf.getvalue()
+
+
+def encode(samples: np.ndarray) -> tuple[bytes, str]:
+    pcm = _to_pcm16(samples)
+    if _FFMPEG is not None:
+        opus = _run_ffmpeg(
+            ["-f", "s16le", "-ar", str(SAMPLE_RATE), "-ac", "1", "-i", "pipe:0",
+             "-c:a", "libopus", "-b:a", "24k", "-f", "ogg", "pipe:1"],
+            pcm,
+        )
+        if opus:
+            return opus, "audio/ogg"
+    return to_wav(samples), "audio/wav"
+
+
+def preprocess_audio(audio: bytes, mime: str) -> dict:
+    """
+    Returns ``{"audio", "mime", "silent", "processed", "duration", "speech_duration"}``.
+    Blocking (NumPy + ffmpeg); call it from a worker thread.
+    """
+    result = {
+        "audio": audio,
+        "mime": mime,
+        "silent": False,
+        "processed": False,
+        "duration": None,
+        "speech_duration": None,
+    }
+    if not AUDIO_PREPROCESS:
+        return result
+    samples = decode(audio, mime)
+    if samples is None:
+        return result
+
+    result["duration"] = round(samples.size / SAMPLE_RATE, 2)
+    bounds = voiced_bounds(samples)
+    if bounds is None:
+        result.update(silent=True, audio=b"", speech_duration=0.0)
+        return result
+
+    start, end = bounds
+    speech = samples[start:end]
+    result["speech_duration"] = round(speech.size / SAMPLE_RATE, 2)
+    encoded, encoded_mime = encode(speech)
+    # An already-compact upload with little to trim is better sent as-is
+    if len(encoded) >= len(audio) and speech.size > 0.9 * samples.size:
+        return result
+    result.update(audio=encoded, mime=encoded_mime, processed=True)
+    return result
+
+
+def preprocess_file(path: str, mime: str) -> dict:
+    """
+    :func:`preprocess_audio` for a clip on disk, reading it in the calling
+    process (batch jobs run this in a process pool, so only the trimmed clip
+    crosses back). Undecodable input is passed through like in ``/chat``.
+    """
+    if os.path.getsize(path) > MAX_UPLOAD_BYTES:
+        raise UploadTooLarge(f"{os.path.basename(path)} exceeds {MAX_UPLOAD_BYTES} bytes")
+    with open(path, "rb") as f:
+        audio = f.read()
+    try:
+        return preprocess_audio(audio, mime)
+    except UploadTooLarge:
+        raise
+    except Exception:
+        return {"audio": audio, "mime": mime, "silent": False, "processed": False,
+                "duration": None, "speech_duration": None}
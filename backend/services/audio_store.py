@@ -0,0 +1,54 @@
+"""
+Short-lived store for synthesized audio.
+Lets /chat hand back an ``audio_url`` instead of base64-in-JSON; the client
+fetches the MP3 bytes from /audio/{id} as-is, with no encode step or copy.
+Clips live in this process only: with several workers, the follow-up GET
+must reach the same worker (sticky sessions) or it 404s.
+"""
+
+from __future__ import annotations
+import secrets
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from config import AUDIO_STORE_MAX_BYTES, AUDIO_TTL_SECONDS
+
+# audio_id -> (expires_at, audio bytes, media type); oldest first
+_clips: "OrderedDict[str, Tuple[float, bytes, str]]" = OrderedDict()
+_total_bytes = 0
+
+
+def _drop(audio_id: str):
+    global _total_bytes
+    _, audio, _ = _clips.pop(audio_id)
+    _total_bytes -= len(audio)
+
+
+def _evict(now: float):
+    while _clips:
+        oldest_id, (expires_at, _, _) = next(iter(_clips.items()))
+        if expires_at > now and _total_bytes <= AUDIO_STORE_MAX_BYTES:
+            break
+        _drop(oldest_id)
+
+
+def put_audio(audio: bytes, media_type: str = "audio/mpeg") -> str:
+    """Keep ``audio`` for ``AUDIO_TTL_SECONDS`` and return its id."""
+    global _total_bytes
+    audio_id = secrets.token_urlsafe(16)
+    _clips[audio_id] = (time.monotonic() + AUDIO_TTL_SECONDS, audio, media_type)
+    _total_bytes += len(audio)
+    _evict(time.monotonic())
+    return audio_id
+
+
+def get_audio(audio_id: str) -> Optional[Tuple[bytes, str]]:
+    entry = _clips.get(audio_id)
+    if entry is None:
+        return None
+    expires_at, audio, media_type = entry
+    if expires_at <= time.monotonic():
+        _drop(audio_id)
+        return None
+    return audio, media_type
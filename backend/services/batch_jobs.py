@@ -0,0 +1,457 @@
+"""
+Batch transcription and emotion analysis.
+
+A job is a list of clips (uploaded with the request, or read from
+``BATCH_INPUT_DIR`` through a manifest) that are run through preprocessing,
+:func:`transcribe_audio` and :func:`detect_emotion`. Everything a job needs
+lives in ``BATCH_DIR/<job_id>/``:
+
+- ``job.json``: the item list and status, rewritten atomically on changes
+- ``inputs/``: uploaded clips
+- ``results.ndjson``: one line per finished item, appended as items finish
+
+Finished items are known from ``results.ndjson``, so a job interrupted by a
+restart picks up where it stopped (:func:`resume_jobs`). Preprocessing runs
+in a process pool and at most ``BATCH_CONCURRENCY`` clips are in flight
+across all jobs, so batch work neither blocks the event loop nor crowds
+live turns out of the upstream schedulers.
+"""
+
+from __future__ import annotations
+import asyncio
+import json
+import mimetypes
+import multiprocessing
+import os
+import re
+import shutil
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import AsyncIterator, Dict, List, Optional
+
+from config import BATCH_CONCURRENCY, BATCH_DIR, BATCH_INPUT_DIR, BATCH_WORKERS, MAX_UPLOAD_BYTES
+from services.audio_preprocess import preprocess_file
+from services.emotion_service import detect_emotion
+from services.metrics import count_fallback, span
+from services.upload_limits import UploadTooLarge
+from services.voxtral_service import UNCLEAR_TRANSCRIPT, transcribe_audio
+
+_JOB_ID = re.compile(r"^[0-9a-f]{32}$")
+ACTIVE = ("queued", "running")
+_MAX_KNOWN = 256  # finished jobs kept in memory; older ones are reloaded from disk
+_COPY_CHUNK = 1024 * 1024
+
+# job_id -> {"meta": job.json contents, "done", "failed", "changed": Event, "io": Lock}
+_jobs: Dict[str, dict] = {}
+_tasks: Dict[str, asyncio.Task] = {}
+_pool: Optional[ProcessPoolExecutor] = None
+_slots: Optional[asyncio.Semaphore] = None
+
+
+class BatchError(Exception):
+    """Raised for a batch request that cannot be accepted."""
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn: forking a process that runs an event loop and threads is unsafe
+        _pool = ProcessPoolExecutor(BATCH_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+def _reset_pool(pool: ProcessPoolExecutor):
+    """Drop ``pool`` after a worker died; the next :func:`_get_pool` starts a fresh one."""
+    global _pool
+    if _pool is pool:
+        _pool = None
+        count_fallback("batch_pool_restart")
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+async def _preprocess(item: dict) -> dict:
+    # A worker killed mid-clip (OOM, crash in a decoder) breaks the whole
+    # pool; replace it and retry the clip once rather than failing every job
+    loop = asyncio.get_running_loop()
+    for attempt in range(2):
+        pool = _get_pool()
+        try:
+            return await loop.run_in_executor(pool, preprocess_file, item["path"], item["mime"])
+        except BrokenProcessPool:
+            _reset_pool(pool)
+            if attempt:
+                raise
+
+
+def _get_slots() -> asyncio.Semaphore:
+    global _slots
+    if _slots is None:
+        _slots = asyncio.Semaphore(BATCH_CONCURRENCY)
+    return _slots
+
+
+def _job_dir(job_id: str) -> str:
+    return os.path.join(BATCH_DIR, job_id)
+
+
+def _results_path(job_id: str) -> str:
+    return os.path.join(_job_dir(job_id), "results.ndjson")
+
+
+def _write_meta(meta: dict):
+    path = os.path.join(_job_dir(meta["job_id"]), "job.json")
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(meta, f)
+    os.replace(tmp, path)
+
+
+def _read_meta(job_id: str) -> Optional[dict]:
+    try:
+        with open(os.path.join(_job_dir(job_id), "job.json")) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+async def _set_status(state: dict, status: str):
+    meta = state["meta"]
+    meta["status"] = status
+    meta["updated"] = time.time()
+    _notify(state)
+    # Serialised per job, so an older status never lands after a newer one
+    async with state["io"]:
+        await asyncio.to_thread(_write_meta, dict(meta))
+
+
+def _notify(state: dict):
+    state["changed"].set()
+    state["changed"] = asyncio.Event()
+
+
+def _guess_mime(name: str, declared: Optional[str] = None) -> str:
+    if declared and declared != "application/octet-stream":
+        return declared
+    return mimetypes.guess_type(name)[0] or "audio/wav"
+
+
+def _manifest_path(path: str) -> str:
+    if not BATCH_INPUT_DIR:
+        raise BatchError("manifests are disabled (BATCH_INPUT_DIR is not set)")
+    root = os.path.realpath(BATCH_INPUT_DIR)
+    full = os.path.realpath(os.path.join(root, path))
+    if os.path.commonpath([root, full]) != root:
+        raise BatchError(f"{path} is outside BATCH_INPUT_DIR")
+    if not os.path.isfile(full):
+        raise BatchError(f"{path} does not exist")
+    return full
+
+
+def _read_results(job_id: str, repair: bool = False) -> List[dict]:
+    """
+    Finished items. A torn last line (crash mid-write) is ignored, and with
+    ``repair`` cut off the file, so appends after a resume start on a clean line.
+    """
+    path = _results_path(job_id)
+    if not os.path.exists(path):
+        return []
+    with open(path, "rb+" if repair else "rb") as f:
+        data = f.read()
+        end = data.rfind(b"\n") + 1
+        if repair and end < len(data):
+            f.truncate(end)
+    return [json.loads(line) for line in data[:end].splitlines() if line.strip()]
+
+
+def _write_result(job_id: str, result: dict):
+    with open(_results_path(job_id), "a") as f:
+        f.write(json.dumps(result, ensure_ascii=False) + "\n")
+
+
+async def _append_result(state: dict, result: dict):
+    await asyncio.to_thread(_write_result, state["meta"]["job_id"], result)
+    state["done"] += 1
+    if "error" in result:
+        state["failed"] += 1
+    _notify(state)
+
+
+def _register(meta: dict, finished: List[dict]) -> dict:
+    state = {
+        "meta": meta,
+        "done": len(finished),
+        "failed": sum(1 for r in finished if "error" in r),
+        "changed": asyncio.Event(),
+        "io": asyncio.Lock(),
+    }
+    _jobs[meta["job_id"]] = state
+    _prune()
+    return state
+
+
+def _prune():
+    """Forget the oldest finished jobs past ``_MAX_KNOWN``; they stay on disk."""
+    finished = [job_id for job_id, s in _jobs.items() if s["meta"]["status"] not in ACTIVE]
+    for job_id in finished[: max(0, len(finished) - _MAX_KNOWN)]:
+        del _jobs[job_id]
+
+
+def _new_meta(items: List[dict]) -> dict:
+    now = time.time()
+    return {"job_id": uuid.uuid4().hex, "status": "queued", "created": now, "updated": now, "items": items}
+
+
+def _copy_capped(source, path: str, max_bytes: int):
+    """Copy file object ``source`` to ``path``; raises UploadTooLarge past ``max_bytes``."""
+    copied = 0
+    with open(path, "wb") as f:
+        while True:
+            chunk = source.read(_COPY_CHUNK)
+            if not chunk:
+                return
+            copied += len(chunk)
+            if copied > max_bytes:
+                raise UploadTooLarge(f"upload exceeds {max_bytes} bytes")
+            f.write(chunk)
+
+
+def create_job_from_files(files: List[tuple]) -> dict:
+    """
+    Create a job over uploaded clips, given as ``(filename, content_type, file)``
+    with ``file`` a readable binary file object (an upload's spooled file).
+    Each clip is copied straight to the job directory, at most
+    ``MAX_UPLOAD_BYTES`` each. Blocking; call it from a worker thread.
+    """
+    if not files:
+        raise BatchError("no files")
+    meta = _new_meta([])
+    job_dir = _job_dir(meta["job_id"])
+    inputs = os.path.join(job_dir, "inputs")
+    os.makedirs(inputs)
+    try:
+        for index, (name, content_type, source) in enumerate(files):
+            stored = os.path.join(inputs, str(index))
+            _copy_capped(source, stored, MAX_UPLOAD_BYTES)
+            meta["items"].append(
+                {"id": name or str(index), "path": stored, "mime": _guess_mime(name or "", content_type)}
+            )
+        _write_meta(meta)
+    except BaseException:
+        shutil.rmtree(job_dir, ignore_errors=True)
+        raise
+    return meta
+
+
+def create_job_from_manifest(manifest: dict) -> dict:
+    """
+    Create a job over ``{"items": [{"path": ..., "id"?: ..., "mime"?: ...}]}``,
+    paths relative to ``BATCH_INPUT_DIR``. Blocking, like :func:`create_job_from_files`.
+    """
+    entries = manifest.get("items") if isinstance(manifest, dict) else None
+    if not entries or not isinstance(entries, list):
+        raise BatchError("manifest needs a non-empty 'items' list")
+    items = []
+    for index, entry in enumerate(entries):
+        if not isinstance(entry, dict) or not isinstance(entry.get("path"), str):
+            raise BatchError(f"item {index} needs a 'path'")
+        items.append(
+            {
+                "id": str(entry.get("id") or entry["path"]),
+                "path": _manifest_path(entry["path"]),
+                "mime": _guess_mime(entry["path"], entry.get("mime")),
+            }
+        )
+    meta = _new_meta(items)
+    os.makedirs(_job_dir(meta["job_id"]))
+    _write_meta(meta)
+    return meta
+
+
+def start_job(meta: dict, finished: Optional[List[dict]] = None):
+    finished = finished or []
+    state = _register(meta, finished)
+    _tasks[meta["job_id"]] = asyncio.create_task(_run_job(state, {r["index"] for r in finished}))
+
+
+async def _process_item(index: int, item: dict) -> dict:
+    started = time.perf_counter()
+    result = {"index": index, "id": item["id"]}
+    try:
+        with span("batch_preprocess"):
+            prepared = await _preprocess(item)
+        if prepared["silent"]:
+            transcript = UNCLEAR_TRANSCRIPT
+        else:
+            transcript = await transcribe_audio(prepared["audio"], prepared["mime"])
+        # Nothing to classify: a label here would be made up (and may cost an escalation)
+        emotion = None if transcript == UNCLEAR_TRANSCRIPT else await detect_emotion(transcript)
+        result.update(
+            transcript=transcript,
+            emotion=emotion,
+            silent=prepared["silent"],
+            duration=prepared["duration"],
+            speech_duration=prepared["speech_duration"],
+        )
+    except UploadTooLarge as e:
+        result.update(error="upload_too_large", detail=str(e))
+    except Exception as e:
+        count_fallback("batch_item_error")
+        result.update(error="processing_failed", detail=str(e))
+    result["ms"] = round((time.perf_counter() - started) * 1000, 1)
+    return result
+
+
+async def _run_job(state: dict, finished: set):
+    job_id = state["meta"]["job_id"]
+    items = state["meta"]["items"]
+    pending = iter([(i, item) for i, item in enumerate(items) if i not in finished])
+    slots = _get_slots()
+
+    async def worker():
+        for index, item in pending:
+            async with slots:
+                result = await _process_item(index, item)
+            await _append_result(state, result)
+
+    workers = []
+    try:
+        await _set_status(state, "running")
+        workers = [asyncio.create_task(worker()) for _ in range(min(BATCH_CONCURRENCY, len(items)) or 1)]
+        await asyncio.gather(*workers)
+        status = "completed"
+    except Exception:
+        # Item errors are recorded per item; this is the job itself failing
+        # (e.g. results can't be written), which a resume would only repeat
+        count_fallback("batch_job_error")
+        status = "failed"
+    finally:
+        # On cancellation the status stays "running" for a resume after
+        # shutdown; cancel_job sets "cancelled" itself
+        for task in workers:
+            task.cancel()
+        _tasks.pop(job_id, None)
+    await _set_status(state, status)
+
+
+def _read_job(job_id: str) -> Optional[tuple]:
+    meta = _read_meta(job_id)
+    return None if meta is None else (meta, _read_results(job_id))
+
+
+async def _load(job_id: str) -> Optional[dict]:
+    if not _JOB_ID.match(job_id):
+        return None
+    state = _jobs.get(job_id)
+    if state is not None:
+        return state
+    loaded = await asyncio.to_thread(_read_job, job_id)
+    if loaded is None:
+        return None
+    # Another request may have loaded it meanwhile
+    return _jobs.get(job_id) or _register(*loaded)
+
+
+def _status(state: dict) -> dict:
+    meta = state["meta"]
+    total = len(meta["items"])
+    return {
+        "job_id": meta["job_id"],
+        "status": meta["status"],
+        "total": total,
+        "done": state["done"],
+        "failed": state["failed"],
+        "progress": round(state["done"] / total, 4) if total else 1.0,
+        "created": meta["created"],
+        "updated": meta["updated"],
+    }
+
+
+async def job_status(job_id: str) -> Optional[dict]:
+    state = await _load(job_id)
+    return None if state is None else _status(state)
+
+
+async def cancel_job(job_id: str) -> Optional[dict]:
+    state = await _load(job_id)
+    if state is None:
+        return None
+    task = _tasks.pop(job_id, None)
+    if task is not None:
+        task.cancel()
+    if state["meta"]["status"] in ACTIVE:
+        await _set_status(state, "cancelled")
+    return _status(state)
+
+
+async def stream_results(job_id: str, follow: bool = True) -> AsyncIterator[bytes]:
+    """
+    NDJSON lines of ``job_id``'s results in completion order. With ``follow``,
+    keeps streaming new lines until the job is no longer running.
+    """
+    state = await _load(job_id)
+    if state is None:
+        return
+    offset = 0
+    while True:
+        changed = state["changed"]
+        active = state["meta"]["status"] in ACTIVE
+        chunk = await asyncio.to_thread(_read_from, _results_path(job_id), offset)
+        if chunk:
+            offset += len(chunk)
+            yield chunk
+        elif not (follow and active):
+            return
+        else:
+            await changed.wait()
+
+
+def _read_from(path: str, offset: int) -> bytes:
+    try:
+        with open(path, "rb") as f:
+            f.seek(offset)
+            data = f.read()
+    except FileNotFoundError:
+        return b""
+    return data[: data.rfind(b"\n") + 1]  # whole lines only
+
+
+def resume_jobs() -> int:
+    """Restart jobs that were queued or running when the process stopped (at startup)."""
+    if not os.path.isdir(BATCH_DIR):
+        return 0
+    resumed = 0
+    for job_id in os.listdir(BATCH_DIR):
+        if not _JOB_ID.match(job_id) or job_id in _tasks:
+            continue
+        meta = _read_meta(job_id)
+        if meta is None or meta["status"] not in ACTIVE:
+            continue
+        start_job(meta, _read_results(job_id, repair=True))
+        resumed += 1
+    return resumed
+
+
+async def shutdown():
+    tasks = list(_tasks.values())
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    global _pool
+    if _pool is not None:
+        pool, _pool = _pool, None
+        await asyncio.to_thread(pool.shutdown, wait=True, cancel_futures=True)
+
+
+def batch_stats() -> dict:
+    states = list(_jobs.values())
+    return {
+        "jobs_running": sum(1 for s in states if s["meta"]["status"] == "running"),
+        "jobs_known": len(states),
+        "items_done": sum(s["done"] for s in states),
+        "items_failed": sum(s["failed"] for s in states),
+        "items_pending": sum(
+            len(s["meta"]["items"]) - s["done"] for s in states if s["meta"]["status"] in ACTIVE
+        ),
+    }
@@ -0,0 +1,372 @@
+"""
+/chat turn pipeline, expressed as a stage graph.
+
+    prepared ─> transcript ─┬─> emotion ──────────────────────┐
+                            └─> memory ─> prompt ─> draft ─────┴─> response ─┬─> persist
+    session ────────────────────┘                                            └─> tts
+
+``prepared`` is the upload after audio preprocessing (mono 16 kHz, silence
+trimmed); a clip with no speech skips the STT call.
+
+Emotion classification runs alongside memory/entity extraction and prompt
+assembly instead of after them, and TTS overlaps with persisting the turn.
+With ``SPECULATIVE_LLM``, ``draft`` also starts the reply with the local
+classifier's provisional emotion, so an escalated classification no longer
+delays it when the labels agree (see :mod:`services.speculative`).
+
+:func:`stream_chat_turn` is the incremental variant used by ``/chat/stream``:
+it yields events as soon as each piece is known and synthesises speech per
+sentence while the LLM is still generating. The emotion's filler clip is sent
+first, so the client is already playing audio while the LLM starts.
+
+A clip that yields no usable transcript (silence, or STT that could not make
+it out) is answered with a fixed "say that again" reply. It gets no emotion
+classification, draft or LLM call, and nothing is written to the session, so
+it never shows up in the history, the stats or the mood trajectory.
+"""
+
+from __future__ import annotations
+import asyncio
+import time
+from typing import AsyncIterator, List, Optional, Tuple
+
+from config import SPECULATIVE_LLM, STAGE_TIMEOUTS, STREAM_PREFETCH_FILLER
+from services.history_window import schedule_compaction
+from services.metrics import count_fallback, span
+from services.speculative import SpeculativeReply, SpeculativeStream
+from services.stage_graph import StageGraph
+from services.upload_limits import UploadTooLarge
+from services.audio_preprocess import preprocess_audio
+from services.voxtral_service import UNCLEAR_TRANSCRIPT, transcribe_audio
+from services.mistral_service import (
+    FILLER_BY_EMOTION,
+    build_system_prompt,
+    fallback_response,
+    generate_response,
+    split_leading_filler,
+    stream_response,
+)
+from services.elevenlabs_service import text_to_speech
+from services.emotion_service import detect_emotion, keyword_emotion, provisional_emotion
+from services.memory_service import (
+    add_message,
+    get_history,
+    get_memory_context,
+    offload,
+    record_emotion,
+    resolve_session,
+    session_batch,
+    session_batch_async,
+    update_session,
+)
+
+
+# Reported for a turn with nothing to classify
+UNCLEAR_EMOTION = {"emotion": "neutral", "intensity": 0.0, "summary": "no clear speech", "source": "unclear"}
+
+
+async def _prepare_audio(audio: bytes, mime: str) -> dict:
+    try:
+        with span("audio_preprocess"):
+            return await asyncio.to_thread(preprocess_audio, audio, mime)
+    except UploadTooLarge:
+        raise
+    except Exception:
+        count_fallback("preprocess_error")
+        # Undecodable or odd input: let STT have the original upload
+        return {"audio": audio, "mime": mime, "silent": False, "processed": False}
+
+
+async def _transcribe_prepared(prepared: dict) -> str:
+    if prepared["silent"]:
+        count_fallback("stt_skipped_silent")
+        return UNCLEAR_TRANSCRIPT
+    return await transcribe_audio(prepared["audio"], prepared["mime"])
+
+
+def _remember_user_turn(session_id: str, transcript: str) -> dict:
+    with session_batch():
+        add_message(session_id, "user", transcript)
+        return {
+            "context": get_memory_context(session_id),
+            "history": list(get_history(session_id)),
+        }
+
+
+def _remember_reply(session_id: str, transcript: str, emotion: dict, response: str):
+    with session_batch():
+        add_message(session_id, "assistant", response)
+        update_session(
+            session_id,
+            topic=transcript[:50],
+            tone=emotion.get("emotion", "neutral"),
+        )
+        record_emotion(session_id, emotion)
+
+
+def _provisional(transcript: str) -> Optional[dict]:
+    """The emotion to speculate with, or None when there is nothing to gain."""
+    if not SPECULATIVE_LLM:
+        return None
+    provisional = provisional_emotion(transcript)
+    # A final guess is what detect_emotion returns straight away
+    return None if provisional.pop("final") else provisional
+
+
+def build_chat_graph(
+    mime: str,
+    session_id: Optional[str],
+    persona: Optional[str] = None,
+    language: Optional[str] = None,
+) -> StageGraph:
+    graph = StageGraph()
+
+    async def prepared(audio: bytes) -> dict:
+        return await _prepare_audio(audio, mime)
+
+    async def transcript(prepared: dict) -> str:
+        return await _transcribe_prepared(prepared)
+
+    async def session() -> str:
+        return await offload(resolve_session, session_id)
+
+    async def memory(session: str, transcript: str) -> dict:
+        if transcript == UNCLEAR_TRANSCRIPT:
+            return {"context": "", "history": []}
+        return await offload(_remember_user_turn, session, transcript)
+
+    async def emotion(transcript: str) -> dict:
+        if transcript == UNCLEAR_TRANSCRIPT:
+            return dict(UNCLEAR_EMOTION)
+        return await detect_emotion(transcript)
+
+    async def prompt(memory: dict) -> str:
+        return build_system_prompt(memory["context"], persona, language)
+
+    def reply(transcript: str, memory: dict, prompt: str, emotion: dict):
+        return generate_response(
+            transcript,
+            memory["context"],
+            memory["history"],
+            emotion=emotion,
+            system_prompt=prompt,
+        )
+
+    async def draft(transcript: str, memory: dict, prompt: str) -> Optional[SpeculativeReply]:
+        provisional = None if transcript == UNCLEAR_TRANSCRIPT else _provisional(transcript)
+        if provisional is None:
+            return None
+        return SpeculativeReply(provisional, lambda e: reply(transcript, memory, prompt, e))
+
+    async def response(
+        transcript: str, memory: dict, prompt: str, emotion: dict, draft: Optional[SpeculativeReply]
+    ) -> str:
+        if transcript == UNCLEAR_TRANSCRIPT:
+            return UNCLEAR_TRANSCRIPT
+        if draft is None:
+            return await reply(transcript, memory, prompt, emotion)
+        try:
+            return await draft.result(emotion)
+        finally:
+            draft.cancel()  # no-op once kept; stops it on timeout or failure
+
+    async def persist(session: str, transcript: str, emotion: dict, response: str):
+        if transcript != UNCLEAR_TRANSCRIPT:
+            await offload(_remember_reply, session, transcript, emotion, response)
+
+    async def tts(response: str) -> bytes:
+        return await text_to_speech(response)
+
+    graph.add("prepared", prepared, deps=("audio",))
+    graph.add("transcript", transcript, deps=("prepared",), timeout=STAGE_TIMEOUTS["transcript"])
+    graph.add("session", session)
+    graph.add("memory", memory, deps=("session", "transcript"))
+    graph.add(
+        "emotion",
+        emotion,
+        deps=("transcript",),
+        timeout=STAGE_TIMEOUTS["emotion"],
+        fallback=lambda transcript: keyword_emotion(transcript),
+    )
+    graph.add("prompt", prompt, deps=("memory",))
+    graph.add("draft", draft, deps=("transcript", "memory", "prompt"))
+    graph.add(
+        "response",
+        response,
+        deps=("transcript", "memory", "prompt", "emotion", "draft"),
+        timeout=STAGE_TIMEOUTS["response"],
+        fallback=lambda emotion, **_: fallback_response(emotion.get("emotion", "neutral")),
+    )
+    graph.add("persist", persist, deps=("session", "transcript", "emotion", "response"))
+    graph.add(
+        "tts",
+        tts,
+        deps=("response",),
+        timeout=STAGE_TIMEOUTS["tts"],
+        fallback=lambda **_: b"",
+    )
+    return graph
+
+
+async def run_chat_turn(
+    audio_bytes: bytes,
+    mime: str,
+    session_id: Optional[str],
+    persona: Optional[str] = None,
+    language: Optional[str] = None,
+) -> dict:
+    """Run one full turn. Returns stage results plus per-stage ``timings`` (ms)."""
+    graph = build_chat_graph(mime, session_id, persona, language)
+    async with session_batch_async():
+        results = await graph.run(audio=audio_bytes)
+    if results["transcript"] != UNCLEAR_TRANSCRIPT:
+        schedule_compaction(results["session"])
+    return {
+        "transcript": results["transcript"],
+        "response": results["response"],
+        "emotion": results["emotion"],
+        "tts_audio": results["tts"],
+        "session_id": results["session"],
+        "timings": graph.timings,
+    }
+
+
+async def _detect_emotion_bounded(transcript: str) -> dict:
+    try:
+        return await asyncio.wait_for(detect_emotion(transcript), STAGE_TIMEOUTS["emotion"])
+    except asyncio.TimeoutError:
+        count_fallback("stage_timeout:emotion")
+        return keyword_emotion(transcript)
+
+
+async def stream_chat_turn(
+    audio_bytes: bytes,
+    mime: str,
+    session_id: Optional[str],
+    persona: Optional[str] = None,
+    language: Optional[str] = None,
+) -> AsyncIterator[Tuple[str, dict]]:
+    """
+    Run one turn incrementally, yielding ``(event, data)`` pairs:
+    ``transcript``, ``emotion``, ``filler`` (with ``STREAM_PREFETCH_FILLER``),
+    then interleaved ``text``/``audio`` per sentence (audio in sentence
+    order), and finally ``done``.
+
+    With the filler prefetched, the reply always opens with that filler: a
+    different filler chosen by the model is replaced, and the first
+    sentence's audio covers only the text after it.
+    """
+    started = time.perf_counter()
+    timings: dict = {}
+
+    def mark(name: str):
+        timings[name] = round((time.perf_counter() - started) * 1000, 1)
+
+    prepared = await _prepare_audio(audio_bytes, mime)
+    mark("prepared")
+    transcript = await asyncio.wait_for(
+        _transcribe_prepared(prepared), STAGE_TIMEOUTS["transcript"]
+    )
+    sid = await offload(resolve_session, session_id)
+    mark("transcript")
+    yield "transcript", {"transcript": transcript, "session_id": sid}
+    if transcript == UNCLEAR_TRANSCRIPT:
+        yield "emotion", dict(UNCLEAR_EMOTION)
+        yield "text", {"index": 0, "text": UNCLEAR_TRANSCRIPT}
+        audio = await text_to_speech(UNCLEAR_TRANSCRIPT)
+        mark("first_audio")
+        yield "audio", {"index": 0, "audio": audio, "text": UNCLEAR_TRANSCRIPT}
+        mark("total")
+        yield "done", {"response": UNCLEAR_TRANSCRIPT, "session_id": sid, "timings": timings}
+        return
+
+    def reply(emotion: dict) -> AsyncIterator[str]:
+        return stream_response(
+            transcript,
+            memory["context"],
+            memory["history"],
+            emotion=emotion,
+            system_prompt=prompt,
+        )
+
+    emotion_task = asyncio.create_task(_detect_emotion_bounded(transcript))
+    draft: Optional[SpeculativeStream] = None
+    try:
+        memory = await offload(_remember_user_turn, sid, transcript)
+        prompt = build_system_prompt(memory["context"], persona, language)
+        provisional = _provisional(transcript)
+        if provisional is not None:
+            draft = SpeculativeStream(provisional, reply)
+        emotion = await emotion_task
+    except BaseException:
+        emotion_task.cancel()
+        if draft is not None:
+            draft.cancel()
+        raise
+    mark("emotion")
+    yield "emotion", emotion
+
+    events: asyncio.Queue = asyncio.Queue()
+    speakers: List[asyncio.Task] = []
+    sentences: List[str] = []
+
+    async def speak(event: str, index: int, text: str, previous: Optional[asyncio.Task]):
+        # Synthesis starts immediately; only delivery waits for the previous
+        # clip so they reach the client in order.
+        audio = await text_to_speech(text)
+        if previous is not None:
+            await previous
+        if "first_audio" not in timings:
+            mark("first_audio")
+        await events.put((event, {"index": index, "audio": audio, "text": text}))
+
+    def queue_speech(event: str, index: int, text: str):
+        previous = speakers[-1] if speakers else None
+        speakers.append(asyncio.create_task(speak(event, index, text, previous)))
+
+    filler = None
+    if STREAM_PREFETCH_FILLER:
+        filler = FILLER_BY_EMOTION.get(emotion.get("emotion", "neutral"), "Hmm…")
+        # Usually a TTS cache hit, so this reaches the client right away.
+        queue_speech("filler", -1, filler)
+
+    async def produce():
+        try:
+            async for sentence in draft.stream(emotion) if draft is not None else reply(emotion):
+                spoken = sentence
+                if filler and not sentences:
+                    _, spoken = split_leading_filler(sentence)
+                    sentence = f"{filler} {spoken}".strip()
+                if not sentences:
+                    mark("first_text")
+                index = len(sentences)
+                sentences.append(sentence)
+                await events.put(("text", {"index": index, "text": sentence}))
+                if spoken:
+                    queue_speech("audio", index, spoken)
+            mark("response")
+            if speakers:
+                await speakers[-1]
+        finally:
+            # Always end the consumer loop; a failure surfaces from ``await producer``
+            events.put_nowait(None)
+
+    producer = asyncio.create_task(produce())
+    try:
+        while True:
+            item = await events.get()
+            if item is None:
+                break
+            yield item
+        await producer
+    finally:
+        for task in [producer, *speakers]:
+            task.cancel()
+        if draft is not None:
+            draft.cancel()
+
+    response = "\n".join(sentences)
+    await offload(_remember_reply, sid, transcript, emotion, response)
+    schedule_compaction(sid)
+    mark("total")
+    yield "done", {"response": response, "session_id": sid, "timings": timings}
@@ -1,10 +1,24 @@
 """
 ElevenLabs text-to-speech service.
 Converts AI response text to natural-sounding speech audio.
+Clips are cached by content (see tts_cache), so repeated replies are free.
 """
 
-import httpx
-from config import ELEVENLABS_API_KEY, ELEVENLABS_VOICE_ID
+from typing import Iterable, Optional
+
+from config import ELEVENLABS_API_BASE, ELEVENLABS_API_KEY, ELEVENLABS_VOICE_ID, TTS_TIMEOUT
+from services import tts_cache
+from services.http_client import get_client
+from services.metrics import count_fallback, observe_size, span
+from services.upstream_scheduler import get_scheduler
+
+TTS_MODEL_ID = "eleven_multilingual_v2"
+VOICE_SETTINGS = {
+    "stability": 0.72,
+    "similarity_boost": 0.8,
+    "style": 0.28,
+    "use_speaker_boost": True,
+}
 
 
 def _prepare_tts_text(text: str) -> str:
@@ -18,10 +32,18 @@ def _prepare_tts_text(text: str) -> str:
     return compact
 
 
-async def text_to_speech(text: str) -> bytes:
+def speech_cache_key(text: str) -> Optional[str]:
+    tts_text = _prepare_tts_text(text)
+    if not tts_text:
+        return None
+    return tts_cache.cache_key(tts_text, ELEVENLABS_VOICE_ID, TTS_MODEL_ID, VOICE_SETTINGS)
+
+
+async def text_to_speech(text: str, persist: bool = False) -> bytes:
     """
     Convert text to speech using ElevenLabs API.
-    Returns raw MP3 audio bytes.
+    Returns raw MP3 audio bytes. ``persist`` keeps the clip in the on-disk
+    cache; only fixed replies use it, never per-turn LLM replies.
     """
     if not ELEVENLABS_API_KEY:
         # Return empty bytes as mock — frontend will handle gracefully
@@ -31,17 +53,19 @@ async def text_to_speech(text: str) -> bytes:
     if not tts_text:
         return b""
 
-    url = f"https://api.elevenlabs.io/v1/text-to-speech/{ELEVENLABS_VOICE_ID}"
+    key = tts_cache.cache_key(tts_text, ELEVENLABS_VOICE_ID, TTS_MODEL_ID, VOICE_SETTINGS)
+    cached = await tts_cache.get(key)
+    if cached is not None:
+        if persist:
+            await tts_cache.put(key, cached, persist)  # e.g. first heard in a turn
+        return cached
+
+    url = f"{ELEVENLABS_API_BASE}/v1/text-to-speech/{ELEVENLABS_VOICE_ID}"
 
     payload = {
         "text": tts_text,
-        "model_id": "eleven_multilingual_v2",
-        "voice_settings": {
-            "stability": 0.72,
-            "similarity_boost": 0.8,
-            "style": 0.28,
-            "use_speaker_boost": True,
-        },
+        "model_id": TTS_MODEL_ID,
+        "voice_settings": VOICE_SETTINGS,
     }
 
     headers = {
@@ -50,10 +74,37 @@ async def text_to_speech(text: str) -> bytes:
         "Accept": "audio/mpeg",
     }
 
-    try:
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            resp = await client.post(url, json=payload, headers=headers)
+    async def fetch() -> bytes:
+        with span("tts_upstream"):
+            resp = await get_client("elevenlabs").post(
+                url, json=payload, headers=headers, timeout=TTS_TIMEOUT
+            )
             resp.raise_for_status()
-            return resp.content
+        observe_size("tts_audio", len(resp.content))
+        await tts_cache.put(key, resp.content)
+        return resp.content
+
+    try:
+        # Concurrent requests for the same clip share one upstream call, which
+        # may be another caller's, so persisting is done here, not in fetch
+        audio = await get_scheduler("elevenlabs").run(fetch, key=key)
     except Exception:
+        count_fallback("tts_error")
         return b""
+    if persist:
+        await tts_cache.put(key, audio, True)
+    return audio
+
+
+async def prewarm(phrases: Iterable[str]) -> int:
+    """Synthesize any of ``phrases`` not cached yet; returns how many were fetched."""
+    if not ELEVENLABS_API_KEY:
+        return 0
+    fetched = 0
+    for phrase in dict.fromkeys(phrases):
+        key = speech_cache_key(phrase)
+        if key is None or tts_cache.cached_path(key):
+            continue
+        if await text_to_speech(phrase, persist=True):
+            fetched += 1
+    return fetched
@@ -0,0 +1,202 @@
+"""
+Cache for Mistral emotion classifications.
+Short utterances repeat a lot across users ("I'm so stressed", "I don't
+know"), so escalated classifications are kept by normalised text in an LRU
+with a TTL, optionally shared through Redis (``EMOTION_CACHE_REDIS_URL``).
+Near-duplicates ("im so stressed out") are found through a MinHash index over
+character 3-grams with LSH banding; a candidate is only reused when its
+estimated Jaccard similarity clears ``EMOTION_CACHE_SIMILARITY`` and it has
+the same negations, so "I'm not okay" never borrows the label of "I'm okay".
+"""
+
+from __future__ import annotations
+import asyncio
+import hashlib
+import json
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Dict, Optional, Set
+
+import numpy as np
+
+from config import (
+    EMOTION_CACHE_REDIS_URL,
+    EMOTION_CACHE_SIMILARITY,
+    EMOTION_CACHE_SIZE,
+    EMOTION_CACHE_TTL,
+)
+from services.session_store import RespConnection
+
+_REDIS_PREFIX = "soultalk:emotion:"
+_NEGATIONS = frozenset(
+    "not no never nothing nobody dont doesnt didnt cant cannot wont isnt arent wasnt "
+    "werent shouldnt wouldnt couldnt aint".split()
+)
+
+# MinHash: 32 universal hashes (a*x + b) mod P over CRC32 shingle hashes,
+# banded 8 x 4 for LSH. P > 2**32 and a < 2**31 keep a*x inside uint64.
+_NUM_PERM, _BANDS = 32, 8
+_ROWS = _NUM_PERM // _BANDS
+_P = np.uint64(4294967311)
+_BUCKET_CAP = 32  # newest keys kept per LSH bucket, bounding lookup cost
+_rng = np.random.default_rng(0x5EED)
+_A = _rng.integers(1, 2**31, _NUM_PERM, dtype=np.uint64)
+_B = _rng.integers(0, 2**31, _NUM_PERM, dtype=np.uint64)
+
+# normalised text -> (result, expires_at, signature)
+_entries: "OrderedDict[str, tuple]" = OrderedDict()
+_buckets: Dict[bytes, Dict[str, None]] = {}  # insertion-ordered sets
+_stats = {"exact_hits": 0, "near_hits": 0, "shared_hits": 0, "misses": 0, "stores": 0}
+
+_redis: Optional[RespConnection] = (
+    RespConnection(EMOTION_CACHE_REDIS_URL) if EMOTION_CACHE_REDIS_URL else None
+)
+_redis_lock = threading.Lock()
+
+
+def normalize(text: str) -> str:
+    text = text.lower().replace("'", "").replace("’", "")
+    return " ".join(re.findall(r"[a-z0-9]+", text))
+
+
+def _signature(normalized: str) -> np.ndarray:
+    padded = f" {normalized} "
+    shingles = {padded[i:i + 3] for i in range(len(padded) - 2)} or {padded}
+    x = np.fromiter((zlib.crc32(s.encode()) for s in shingles), dtype=np.uint64)
+    return ((np.outer(x, _A) + _B) % _P).min(axis=0)
+
+
+def _band_keys(signature: np.ndarray):
+    for band in range(_BANDS):
+        yield bytes([band]) + signature[band * _ROWS:(band + 1) * _ROWS].tobytes()
+
+
+def _negations(normalized: str) -> Set[str]:
+    return _NEGATIONS.intersection(normalized.split())
+
+
+def _drop(key: str):
+    entry = _entries.pop(key, None)
+    if entry is None:
+        return
+    for band_key in _band_keys(entry[2]):
+        members = _buckets.get(band_key)
+        if members is not None:
+            members.pop(key, None)
+            if not members:
+                del _buckets[band_key]
+
+
+def _remember(key: str, result: dict, expires_at: float):
+    _drop(key)
+    signature = _signature(key)
+    _entries[key] = (result, expires_at, signature)
+    for band_key in _band_keys(signature):
+        members = _buckets.setdefault(band_key, {})
+        members[key] = None
+        if len(members) > _BUCKET_CAP:
+            del members[next(iter(members))]
+    while len(_entries) > EMOTION_CACHE_SIZE:
+        _drop(next(iter(_entries)))
+
+
+def _live(key: str, now: float) -> Optional[dict]:
+    entry = _entries.get(key)
+    if entry is None:
+        return None
+    if entry[1] <= now:
+        _drop(key)
+        return None
+    _entries.move_to_end(key)
+    return entry[0]
+
+
+def _nearest(key: str, now: float) -> Optional[dict]:
+    signature = _signature(key)
+    negations = _negations(key)
+    candidates = set()
+    for band_key in _band_keys(signature):
+        candidates.update(_buckets.get(band_key, ()))
+    candidates = [
+        c for c in candidates
+        if c in _entries and _entries[c][1] > now and _negations(c) == negations
+    ]
+    if not candidates:
+        return None
+    scores = (np.stack([_entries[c][2] for c in candidates]) == signature).mean(axis=1)
+    best = int(np.argmax(scores))
+    if scores[best] < EMOTION_CACHE_SIMILARITY:
+        return None
+    return _live(candidates[best], now)
+
+
+def _redis_key(key: str) -> str:
+    return _REDIS_PREFIX + hashlib.sha1(key.encode()).hexdigest()
+
+
+def _redis_get(key: str) -> Optional[dict]:
+    with _redis_lock:
+        (raw,) = _redis.pipeline([("GET", _redis_key(key))])
+    return json.loads(raw) if raw else None
+
+
+def _redis_set(key: str, result: dict):
+    with _redis_lock:
+        _redis.pipeline([("SET", _redis_key(key), json.dumps(result), "EX", int(EMOTION_CACHE_TTL))])
+
+
+def _hit(result: dict, kind: str) -> dict:
+    _stats[kind] += 1
+    return {**result, "source": "cache"}
+
+
+async def get(text: str) -> Optional[dict]:
+    """Cached classification for ``text`` (exact, shared, then near match), or None."""
+    key = normalize(text)
+    if not key:
+        return None
+    now = time.monotonic()
+    result = _live(key, now)
+    if result is not None:
+        return _hit(result, "exact_hits")
+    if _redis is not None:
+        try:
+            result = await asyncio.to_thread(_redis_get, key)
+        except Exception:
+            result = None
+        if result is not None:
+            _remember(key, result, now + EMOTION_CACHE_TTL)
+            return _hit(result, "shared_hits")
+    result = _nearest(key, now)
+    if result is not None:
+        return _hit(result, "near_hits")
+    _stats["misses"] += 1
+    return None
+
+
+async def put(text: str, result: dict):
+    key = normalize(text)
+    if not key:
+        return
+    stored = {k: result[k] for k in ("emotion", "intensity", "summary") if k in result}
+    _remember(key, stored, time.monotonic() + EMOTION_CACHE_TTL)
+    _stats["stores"] += 1
+    if _redis is not None:
+        try:
+            await asyncio.to_thread(_redis_set, key, stored)
+        except Exception:
+            pass
+
+
+def emotion_cache_stats() -> dict:
+    hits = _stats["exact_hits"] + _stats["near_hits"] + _stats["shared_hits"]
+    lookups = hits + _stats["misses"]
+    return {
+        **_stats,
+        "entries": len(_entries),
+        "shared": _redis is not None,
+        "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+    }
@@ -0,0 +1,122 @@
+"""
+Local emotion classifier: multinomial Naive Bayes over hashed n-grams.
+Features are word unigrams, word bigrams and character 4-grams, hashed into a
+fixed-size space with CRC32 (stable across processes, unlike ``hash``).
+Scoring is one hashing pass plus a NumPy gather-and-sum over the weight
+matrix, so a message is classified in tens of microseconds.
+Weights ship in ``data/emotion_model.npz``; see scripts/train_emotion_model.py.
+"""
+
+from __future__ import annotations
+import re
+import zlib
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+_TOKEN = re.compile(r"[a-z']+")
+
+
+def _features(text: str) -> List[str]:
+    tokens = _TOKEN.findall(text.lower())
+    features = [f"w:{t}" for t in tokens]
+    features += [f"b:{a} {b}" for a, b in zip(tokens, tokens[1:])]
+    for t in tokens:
+        padded = f"<{t}>"
+        features += [f"c:{padded[i:i + 4]}" for i in range(len(padded) - 3)]
+    return features
+
+
+def hash_features(text: str, n_features: int) -> np.ndarray:
+    """Hashed feature indices for ``text`` (repeats encode counts)."""
+    mask = n_features - 1
+    return np.fromiter(
+        (zlib.crc32(f.encode("utf-8")) & mask for f in _features(text)),
+        dtype=np.int64,
+    )
+
+
+class EmotionModel:
+    def __init__(
+        self,
+        labels: Sequence[str],
+        log_prior: np.ndarray,
+        log_likelihood: np.ndarray,
+        temperature: float = 1.0,
+    ):
+        self.labels = list(labels)
+        # Naive Bayes is overconfident; scores are divided by a temperature
+        # fitted on held-out data so confidences can be thresholded.
+        self.temperature = float(temperature)
+        self.log_prior = log_prior.astype(np.float32)
+        # (n_labels, n_features), feature-major copy so a gather touches
+        # contiguous rows
+        self.weights_t = np.ascontiguousarray(log_likelihood.T.astype(np.float32))
+
+    @property
+    def n_features(self) -> int:
+        return self.weights_t.shape[0]
+
+    def log_scores(self, text: str) -> np.ndarray:
+        idx = hash_features(text, self.n_features)
+        return self.log_prior + self.weights_t[idx].sum(axis=0)
+
+    def probabilities(self, text: str) -> np.ndarray:
+        scores = self.log_scores(text) / self.temperature
+        scores = np.exp(scores - scores.max())
+        return scores / scores.sum()
+
+    def predict(self, text: str) -> Tuple[str, float]:
+        probs = self.probabilities(text)
+        best = int(probs.argmax())
+        return self.labels[best], float(probs[best])
+
+    @classmethod
+    def train(
+        cls,
+        texts: Sequence[str],
+        labels: Sequence[str],
+        label_names: Sequence[str],
+        n_features: int = 1 << 14,
+        alpha: float = 0.1,
+    ) -> "EmotionModel":
+        if n_features & (n_features - 1):
+            raise ValueError("n_features must be a power of two")
+        index = {name: i for i, name in enumerate(label_names)}
+        counts = np.zeros((len(label_names), n_features), dtype=np.float64)
+        docs = np.zeros(len(label_names), dtype=np.float64)
+        for text, label in zip(texts, labels):
+            row = index[label]
+            np.add.at(counts[row], hash_features(text, n_features), 1.0)
+            docs[row] += 1
+        log_prior = np.log(docs / docs.sum())
+        smoothed = counts + alpha
+        log_likelihood = np.log(smoothed / smoothed.sum(axis=1, keepdims=True))
+        return cls(label_names, log_prior, log_likelihood)
+
+    def save(self, path: str):
+        np.savez_compressed(
+            path,
+            labels=np.array(self.labels),
+            log_prior=self.log_prior,
+            log_likelihood=self.weights_t.T,
+            temperature=np.float32(self.temperature),
+        )
+
+    @classmethod
+    def load(cls, path: str) -> "EmotionModel":
+        with np.load(path) as data:
+            return cls(
+                [str(x) for x in data["labels"]],
+                data["log_prior"],
+                data["log_likelihood"],
+                float(data["temperature"]),
+            )
+
+
+def load_model(path: str) -> Optional[EmotionModel]:
+    """The shipped model, or ``None`` if the weights file is missing or unreadable."""
+    try:
+        return EmotionModel.load(path)
+    except (OSError, KeyError, ValueError):
+        return None
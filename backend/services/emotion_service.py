@@ -1,13 +1,31 @@
 """
 Emotion detection service.
-Uses Mistral to analyse the emotional tone of user messages
-and returns a structured emotion label + intensity.
+Classifies the emotional tone of user messages with a local Naive Bayes
+model and only escalates to Mistral when the local confidence is low.
+Returns a structured emotion label + intensity.
 """
 
-import httpx
-from config import MISTRAL_API_KEY
+import asyncio
+import json
+import random
+import re
+from typing import Set
 
-MISTRAL_CHAT_URL = "https://api.mistral.ai/v1/chat/completions"
+from config import (
+    EMOTION_LOCAL_THRESHOLD,
+    EMOTION_MODEL_PATH,
+    EMOTION_SHADOW_SAMPLE_RATE,
+    EMOTION_TIMEOUT,
+    MISTRAL_API_BASE,
+    MISTRAL_API_KEY,
+)
+from services import emotion_cache
+from services.emotion_model import load_model
+from services.http_client import get_client
+from services.metrics import count_fallback, span
+from services.upstream_scheduler import get_scheduler
+
+MISTRAL_CHAT_URL = f"{MISTRAL_API_BASE}/v1/chat/completions"
 
 # Supported emotion labels
 EMOTIONS = ["sad", "anxious", "confused", "neutral"]
@@ -22,6 +40,92 @@ Example output:
 """
 
 
+SUMMARY_BY_EMOTION = {
+    "sad": "low and heavy",
+    "anxious": "on edge and tense",
+    "confused": "struggling to understand",
+    "neutral": "neutral tone",
+}
+
+_INTENSIFIERS = re.compile(
+    r"\b(so|really|very|too|extremely|completely|totally|always|constantly|anymore|can't)\b"
+)
+
+_model = load_model(EMOTION_MODEL_PATH)
+
+# local: answered by the local model; escalated: local confidence too low,
+# answered by Mistral or, for cache_served of them, by a cached Mistral
+# answer; shadow: extra Mistral calls sampled on confident turns, counted
+# apart from escalations; agree/disagree compare local vs Mistral labels on
+# escalated and shadow-sampled turns.
+_stats = {
+    "local": 0,
+    "escalated": 0,
+    "cache_served": 0,
+    "shadow": 0,
+    "agree": 0,
+    "disagree": 0,
+    "llm_errors": 0,
+    "shadow_errors": 0,
+}
+_shadow_tasks: Set[asyncio.Task] = set()
+
+
+def emotion_stats() -> dict:
+    compared = _stats["agree"] + _stats["disagree"]
+    total = _stats["local"] + _stats["escalated"]
+    return {
+        **_stats,
+        "threshold": EMOTION_LOCAL_THRESHOLD,
+        "escalation_rate": round(_stats["escalated"] / total, 4) if total else 0.0,
+        "remote_calls": _stats["escalated"] - _stats["cache_served"] + _stats["shadow"],
+        "agreement_rate": round(_stats["agree"] / compared, 4) if compared else None,
+        "cache": emotion_cache.emotion_cache_stats(),
+    }
+
+
+def _local_intensity(text: str, label: str, confidence: float) -> float:
+    if label == "neutral":
+        return 0.3
+    intensity = 0.4 + 0.2 * confidence
+    intensity += 0.08 * min(3, len(_INTENSIFIERS.findall(text.lower())))
+    intensity += 0.05 * min(2, text.count("!"))
+    return round(min(1.0, intensity), 2)
+
+
+def classify_local(text: str):
+    """Local model result with its ``confidence``, or ``None`` if no model is loaded."""
+    if _model is None:
+        return None
+    label, confidence = _model.predict(text)
+    return {
+        "emotion": label,
+        "intensity": _local_intensity(text, label, confidence),
+        "summary": SUMMARY_BY_EMOTION[label],
+        "confidence": round(confidence, 3),
+        "source": "local",
+    }
+
+
+def provisional_emotion(text: str) -> dict:
+    """
+    The best guess available without a network call: the local model's
+    result, else keywords. ``final`` is set when :func:`detect_emotion` will
+    return exactly this (confident local result, or no API key).
+    """
+    local = classify_local(text)
+    if local is None:
+        return {**keyword_emotion(text), "final": not MISTRAL_API_KEY}
+    return {**local, "final": local["confidence"] >= EMOTION_LOCAL_THRESHOLD or not MISTRAL_API_KEY}
+
+
+def _record_agreement(local: dict, remote: dict):
+    if local["emotion"] == remote["emotion"]:
+        _stats["agree"] += 1
+    else:
+        _stats["disagree"] += 1
+
+
 def _normalize_emotion(label: str) -> str:
     normalized = (label or "").lower().strip()
     if normalized in EMOTIONS:
@@ -45,12 +149,55 @@ def _normalize_emotion(label: str) -> str:
 async def detect_emotion(text: str) -> dict:
     """
     Analyse a user message and return emotion data.
-    Returns dict with keys: emotion, intensity, summary.
-    Falls back to a simple keyword-based detector when no API key is set.
+    Returns dict with keys: emotion, intensity, summary (plus source/confidence).
+    The local model answers when it is confident enough; otherwise a cached
+    Mistral answer for the same (or a near-identical) text is reused, and only
+    then is Mistral asked. Falls back to the local result, then keywords,
+    when no API key is set or the call fails.
     """
+    local = classify_local(text)
+    if local is not None and (local["confidence"] >= EMOTION_LOCAL_THRESHOLD or not MISTRAL_API_KEY):
+        _stats["local"] += 1
+        if MISTRAL_API_KEY and random.random() < EMOTION_SHADOW_SAMPLE_RATE:
+            _stats["shadow"] += 1
+            task = asyncio.create_task(_shadow_check(text, local))
+            _shadow_tasks.add(task)
+            task.add_done_callback(_shadow_tasks.discard)
+        return local
+
     if not MISTRAL_API_KEY:
-        return _keyword_fallback(text)
+        count_fallback("emotion_keywords")
+        return keyword_emotion(text)
 
+    _stats["escalated"] += 1
+    cached = await emotion_cache.get(text)
+    if cached is not None:
+        _stats["cache_served"] += 1
+        return cached
+
+    try:
+        with span("emotion_llm"):
+            result = await _classify_remote(text)
+    except Exception:
+        _stats["llm_errors"] += 1
+        count_fallback("emotion_llm_error")
+        return local if local is not None else keyword_emotion(text)
+    if local is not None:
+        _record_agreement(local, result)
+    await emotion_cache.put(text, result)
+    return result
+
+
+async def _shadow_check(text: str, local: dict):
+    try:
+        remote = await _classify_remote(text)
+    except Exception:
+        _stats["shadow_errors"] += 1
+        return
+    _record_agreement(local, remote)
+
+
+async def _classify_remote(text: str) -> dict:
     payload = {
         "model": "mistral-small-latest",
         "messages": [
@@ -67,25 +214,27 @@ async def detect_emotion(text: str) -> dict:
         "Content-Type": "application/json",
     }
 
-    try:
-        async with httpx.AsyncClient(timeout=15.0) as client:
-            resp = await client.post(MISTRAL_CHAT_URL, json=payload, headers=headers)
-            resp.raise_for_status()
-            data = resp.json()
-            raw = data["choices"][0]["message"]["content"].strip()
-
-        import json
-        result = json.loads(raw)
-        # Validate
-        result["emotion"] = _normalize_emotion(result.get("emotion", "neutral"))
-        result["intensity"] = max(0.0, min(1.0, float(result.get("intensity", 0.5))))
-        result.setdefault("summary", result["emotion"])
-        return result
-    except Exception:
-        return _keyword_fallback(text)
+    async def post() -> dict:
+        resp = await get_client("mistral").post(
+            MISTRAL_CHAT_URL, json=payload, headers=headers, timeout=EMOTION_TIMEOUT
+        )
+        resp.raise_for_status()
+        return resp.json()
+
+    # Identical utterances in flight at once are classified by a single call
+    data = await get_scheduler("mistral").run(post, key=("emotion", " ".join(text.lower().split())))
+    raw = data["choices"][0]["message"]["content"].strip()
 
+    result = json.loads(raw)
+    # Validate
+    result["emotion"] = _normalize_emotion(result.get("emotion", "neutral"))
+    result["intensity"] = max(0.0, min(1.0, float(result.get("intensity", 0.5))))
+    result.setdefault("summary", result["emotion"])
+    result["source"] = "llm"
+    return result
 
-def _keyword_fallback(text: str) -> dict:
+
+def keyword_emotion(text: str) -> dict:
     """Simple keyword-based emotion detector for offline / demo mode."""
     t = text.lower()
 
@@ -98,15 +247,10 @@ def _keyword_fallback(text: str) -> dict:
     for emotion, keywords in keyword_map.items():
         for kw in keywords:
             if kw in t:
-                summary_map = {
-                    "sad": "low and heavy",
-                    "anxious": "on edge and tense",
-                    "confused": "struggling to understand",
-                }
                 return {
                     "emotion": emotion,
                     "intensity": 0.6,
-                    "summary": summary_map.get(emotion, f"feeling {emotion}"),
+                    "summary": SUMMARY_BY_EMOTION.get(emotion, f"feeling {emotion}"),
                 }
 
     return {"emotion": "neutral", "intensity": 0.3, "summary": "neutral tone"}
@@ -0,0 +1,85 @@
+"""
+Single-pass keyword matcher for entity extraction.
+All keywords of all categories are compiled into one regex whose alternation
+is factored as a character trie, so a message is scanned once no matter how
+large the vocabulary grows and shared prefixes are only tried once.
+"""
+
+from __future__ import annotations
+import json
+import re
+from typing import Dict, List, Tuple
+
+_END = ""
+
+
+def _trie_pattern(node: dict) -> str:
+    has_end = _END in node
+    branches = [
+        re.escape(ch) + _trie_pattern(child)
+        for ch, child in sorted(node.items())
+        if ch != _END
+    ]
+    if not branches:
+        return ""
+    body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+    # A keyword ending here makes the rest optional; greedy matching still
+    # prefers the longest keyword and backtracks if the word boundary fails.
+    return f"(?:{body})?" if has_end else body
+
+
+class KeywordMatcher:
+    """
+    Maps whole-word keyword hits to ``{category: sorted unique values}``.
+    Where keywords overlap in the text (e.g. phrases sharing a word), the
+    longest one at a position wins.
+    """
+
+    def __init__(self, vocabulary: Dict[str, Dict[str, str]]):
+        self.categories = list(vocabulary)
+        self._lookup: Dict[str, List[Tuple[str, str]]] = {}
+        trie: dict = {}
+        for category, keywords in vocabulary.items():
+            for keyword, value in keywords.items():
+                key = keyword.lower().strip()
+                if not key:
+                    continue
+                self._lookup.setdefault(key, []).append((category, value))
+                node = trie
+                for ch in key:
+                    node = node.setdefault(ch, {})
+                node[_END] = {}
+        body = _trie_pattern(trie)
+        self._regex = re.compile(rf"\b(?:{body})\b") if body else None
+
+    def __len__(self) -> int:
+        return len(self._lookup)
+
+    def extract(self, text: str) -> Dict[str, List[str]]:
+        found: Dict[str, set] = {category: set() for category in self.categories}
+        if self._regex is not None:
+            for match in self._regex.finditer(text.lower()):
+                for category, value in self._lookup[match.group(0)]:
+                    found[category].add(value)
+        return {category: sorted(values) for category, values in found.items()}
+
+
+def load_vocabulary(path: str) -> Dict[str, Dict[str, str]]:
+    """
+    Read a keyword vocabulary file. JSON files hold
+    ``{"category": {"keyword": "value"}}``; any other file is read as
+    tab-separated ``category<TAB>keyword<TAB>value`` lines (``#`` comments).
+    """
+    if path.endswith(".json"):
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    vocabulary: Dict[str, Dict[str, str]] = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            category, keyword, value = line.split("\t")[:3]
+            vocabulary.setdefault(category, {})[keyword] = value
+    return vocabulary
@@ -0,0 +1,179 @@
+"""
+Token-budgeted conversation history.
+Prompts carry only the most recent turns that fit in ``HISTORY_TOKEN_BUDGET``
+(counted with a local estimate, no tokenizer round-trip). Turns that fall
+out of that window are folded into a rolling per-session summary by a
+background task after the reply has been sent, so the prompt stays a
+predictable size and older context survives as the "Earlier in this
+conversation" memory section instead of being dropped.
+"""
+
+from __future__ import annotations
+import asyncio
+import contextvars
+import re
+from typing import List, Optional, Set
+
+from config import (
+    HISTORY_TOKEN_BUDGET,
+    LLM_TIMEOUT,
+    MISTRAL_API_BASE,
+    MISTRAL_API_KEY,
+    SUMMARY_MAX_TOKENS,
+    SUMMARY_MIN_TOKENS,
+)
+from services.http_client import get_client
+from services.memory_service import apply_history_summary, get_session, offload
+from services.metrics import count_fallback
+from services.upstream_scheduler import get_scheduler
+
+MISTRAL_CHAT_URL = f"{MISTRAL_API_BASE}/v1/chat/completions"
+
+_PIECE = re.compile(r"[A-Za-z]+|\d|[^\sA-Za-z\d]")
+_MESSAGE_OVERHEAD = 4  # role and separators
+
+SUMMARY_PROMPT = """You maintain a running summary of a supportive voice conversation.
+Merge the new lines into the existing summary. Keep what the user shared about
+themselves: names, people in their life, events, worries, feelings, and anything
+they asked to be remembered. Drop greetings and filler. Third person, plain
+sentences, at most {words} words. Reply with the summary only."""
+
+_compacting: Set[str] = set()
+_tasks: Set[asyncio.Task] = set()
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Rough token count for Mistral's tokenizer: one token per digit or
+    punctuation mark, one per word plus one per further 7 letters.
+    """
+    return sum(1 + (len(p) - 1) // 7 for p in _PIECE.findall(text))
+
+
+def message_tokens(message: dict) -> int:
+    return estimate_tokens(message.get("content", "")) + _MESSAGE_OVERHEAD
+
+
+def _truncate(text: str, budget: int) -> str:
+    """Keep the head and tail of ``text`` within roughly ``budget`` tokens."""
+    words = text.split()
+    keep = max(2, budget * 3 // 4)  # ~1.3 tokens per word
+    if len(words) <= keep:
+        return text
+    head = words[: keep // 2]
+    tail = words[-(keep - len(head)):]
+    return " ".join(head) + " … " + " ".join(tail)
+
+
+def select_window(
+    history: List[dict],
+    current: Optional[str] = None,
+    budget: int = HISTORY_TOKEN_BUDGET,
+) -> List[dict]:
+    """
+    The newest messages of ``history`` that fit in ``budget`` tokens, oldest
+    first. A trailing user message equal to ``current`` is left out (the
+    caller sends the current utterance itself). If even the newest message
+    is over budget, a truncated copy of it is returned.
+    """
+    if current is not None and history and history[-1] == {"role": "user", "content": current}:
+        history = history[:-1]
+    window: List[dict] = []
+    used = 0
+    for message in reversed(history):
+        cost = message_tokens(message)
+        if used + cost > budget:
+            if not window:
+                window.append({**message, "content": _truncate(message["content"], budget)})
+            break
+        window.append(message)
+        used += cost
+    window.reverse()
+    return window
+
+
+def _overflow(session: dict) -> List[dict]:
+    history = session.get("history", [])
+    return history[: len(history) - len(select_window(history))]
+
+
+def _local_summary(previous: str, messages: List[dict]) -> str:
+    """Extractive fallback: the first sentence of each user message, newest kept."""
+    count_fallback("summary_local")
+    lines = [previous] if previous else []
+    for message in messages:
+        if message["role"] == "user" and message["content"].strip():
+            first = re.split(r"(?<=[.!?])\s", message["content"].strip(), maxsplit=1)[0]
+            lines.append(f"User said: {first}")
+    summary = " ".join(lines)
+    if estimate_tokens(summary) > SUMMARY_MAX_TOKENS:
+        words = summary.split()
+        summary = "… " + " ".join(words[-(SUMMARY_MAX_TOKENS * 3 // 4):])
+    return summary
+
+
+async def _summarize(previous: str, messages: List[dict]) -> str:
+    if not MISTRAL_API_KEY:
+        return _local_summary(previous, messages)
+    lines = "\n".join(f"{m['role'].capitalize()}: {m['content']}" for m in messages)
+    payload = {
+        "model": "mistral-small-latest",
+        "messages": [
+            {"role": "system", "content": SUMMARY_PROMPT.format(words=SUMMARY_MAX_TOKENS * 3 // 4)},
+            {"role": "user", "content": f"Existing summary:\n{previous or '(none)'}\n\nNew lines:\n{lines}"},
+        ],
+        "max_tokens": SUMMARY_MAX_TOKENS,
+        "temperature": 0.2,
+    }
+    headers = {
+        "Authorization": f"Bearer {MISTRAL_API_KEY}",
+        "Content-Type": "application/json",
+    }
+    try:
+        resp = await get_scheduler("mistral").run(
+            lambda: get_client("mistral").post(
+                MISTRAL_CHAT_URL, json=payload, headers=headers, timeout=LLM_TIMEOUT
+            )
+        )
+        resp.raise_for_status()
+        summary = resp.json()["choices"][0]["message"]["content"].strip()
+        return summary or _local_summary(previous, messages)
+    except Exception:
+        return _local_summary(previous, messages)
+
+
+async def compact_history(session_id: str) -> bool:
+    """Fold messages outside the prompt window into the session summary."""
+    session = await offload(get_session, session_id)
+    if not session:
+        return False
+    folded = _overflow(session)
+    if sum(message_tokens(m) for m in folded) < SUMMARY_MIN_TOKENS:
+        return False
+    folded = [dict(m) for m in folded]
+    summary = await _summarize(session.get("summary", ""), folded)
+    return await offload(apply_history_summary, session_id, folded, summary)
+
+
+def schedule_compaction(session_id: str):
+    """
+    Start :func:`compact_history` in the background unless this session is
+    already being compacted; it returns early when little enough history is
+    outside the window. Runs in a fresh context, so it never writes into a
+    caller's session_batch, and loads the session there, off the reply path.
+    """
+    if session_id in _compacting:
+        return
+
+    async def run():
+        try:
+            await compact_history(session_id)
+        except Exception:
+            pass
+        finally:
+            _compacting.discard(session_id)
+
+    _compacting.add(session_id)
+    task = asyncio.get_running_loop().create_task(run(), context=contextvars.Context())
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
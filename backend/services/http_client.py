@@ -0,0 +1,103 @@
+"""
+Shared HTTP client registry.
+Keeps one pooled ``httpx.AsyncClient`` per upstream (Mistral, ElevenLabs) so
+connections and TLS sessions are reused across turns instead of being set up
+for every call. Clients are opened and closed by the FastAPI lifespan.
+"""
+
+from __future__ import annotations
+from typing import Dict
+
+import httpx
+from config import (
+    HTTP2_ENABLED,
+    HTTP_CONNECT_TIMEOUT,
+    HTTP_KEEPALIVE_EXPIRY,
+    HTTP_POOL_KEEPALIVE,
+    HTTP_POOL_LIMITS,
+)
+
+UPSTREAMS = ("mistral", "elevenlabs")
+
+_clients: Dict[str, httpx.AsyncClient] = {}
+_request_counts: Dict[str, int] = {name: 0 for name in UPSTREAMS}
+
+
+def _http2_supported() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _counter(name: str):
+    async def _on_request(request: httpx.Request):
+        _request_counts[name] = _request_counts.get(name, 0) + 1
+
+    return _on_request
+
+
+def _build_client(name: str) -> httpx.AsyncClient:
+    limits = httpx.Limits(
+        max_connections=HTTP_POOL_LIMITS.get(name, 20),
+        max_keepalive_connections=HTTP_POOL_KEEPALIVE.get(name, 10),
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+    )
+    # Read timeouts are passed per call; this is only the pool-wide default.
+    timeout = httpx.Timeout(30.0, connect=HTTP_CONNECT_TIMEOUT)
+    return httpx.AsyncClient(
+        http2=HTTP2_ENABLED and _http2_supported(),
+        limits=limits,
+        timeout=timeout,
+        event_hooks={"request": [_counter(name)]},
+    )
+
+
+def get_client(name: str) -> httpx.AsyncClient:
+    """Return the shared client for an upstream, creating it on first use."""
+    client = _clients.get(name)
+    if client is None or client.is_closed:
+        client = _clients[name] = _build_client(name)
+    return client
+
+
+async def start_clients():
+    for name in UPSTREAMS:
+        get_client(name)
+
+
+async def close_clients():
+    clients = list(_clients.values())
+    _clients.clear()
+    for client in clients:
+        await client.aclose()
+
+
+def pool_stats() -> dict:
+    """Connection pool statistics per upstream."""
+    stats = {}
+    for name in UPSTREAMS:
+        entry = {
+            "open": name in _clients and not _clients[name].is_closed,
+            "requests": _request_counts.get(name, 0),
+            "max_connections": HTTP_POOL_LIMITS.get(name, 20),
+            "connections": 0,
+            "idle": 0,
+            "http2": 0,
+            "queued": 0,
+        }
+        client = _clients.get(name)
+        # httpcore does not expose a public stats API, so read the pool state
+        # defensively — a missing attribute just leaves the counters at zero.
+        pool = getattr(getattr(client, "_transport", None), "_pool", None)
+        if pool is not None:
+            connections = list(getattr(pool, "connections", []))
+            entry["connections"] = len(connections)
+            entry["idle"] = sum(1 for c in connections if c.is_idle())
+            entry["http2"] = sum(1 for c in connections if "HTTP/2" in c.info())
+            entry["queued"] = sum(
+                1 for r in getattr(pool, "_requests", []) if r.is_queued()
+            )
+        stats[name] = entry
+    return stats
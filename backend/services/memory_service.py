@@ -1,16 +1,58 @@
 """
-Memory service — lightweight in-memory session store.
+Memory service — per-session conversational memory.
 Stores user name, discussed topics, and emotional tone per session.
+Sessions live in a pluggable :class:`SessionStore` (see ``SESSION_BACKEND``).
+With ``SESSION_JOURNAL_DIR`` set, the in-memory backend is made durable by a
+:class:`SessionJournal`: every mutation below is also appended as an event,
+and :func:`apply_event` replays those events on startup.
+
+Writes go through :func:`session_batch`. Each change is kept alongside the
+session it was made to, so when the store reports that someone else wrote
+the session meanwhile (an overlapping turn, a background compaction), the
+batch reloads it, reapplies its changes and writes again instead of
+overwriting theirs.
 """
 
 from __future__ import annotations
-import re
-from typing import Dict, List, Optional
+import asyncio
+import functools
+import time
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional, TypeVar
 from uuid import uuid4
 
+from config import (
+    ENTITY_KEYWORDS_PATH,
+    HISTORY_MAX_MESSAGES,
+    MOOD_MAX_POINTS,
+    SESSION_BACKEND,
+    SESSION_IDLE_TTL_SECONDS,
+    SESSION_JOURNAL_DIR,
+    SESSION_JOURNAL_FSYNC_MS,
+    SESSION_JOURNAL_SNAPSHOT_EVENTS,
+)
+from services.entity_matcher import KeywordMatcher, load_vocabulary
+from services import mood_trajectory
+from services.metrics import count_fallback
+from services.session_journal import SessionJournal
+from services.session_store import InMemorySessionStore, SessionStore, create_store
+
+T = TypeVar("T")
+
+_store: Optional[SessionStore] = None
+_journal: Optional[SessionJournal] = None
+
+# Sessions used inside an active session_batch(): session_id -> {"session",
+# "base": version as loaded (None for a new session), "changes": [(apply,
+# args)], "dirty"}; the dirty ones are written when the batch exits
+_pending: ContextVar[Optional[Dict[str, dict]]] = ContextVar("session_batch", default=None)
+_SAVE_ATTEMPTS = 5
+
+
+class SessionConflict(Exception):
+    """Raised when a session kept being written by others and a batch gave up."""
 
-# In-memory store keyed by session_id
-_sessions: Dict[str, dict] = {}
 
 PEOPLE_KEYWORDS = {
     "dad": "father",
@@ -53,6 +95,28 @@ SITUATION_KEYWORDS = {
 }
 
 
+# Rendered memory block sections, in prompt order
+MEMORY_SECTIONS = (
+    "user_name",
+    "summary",
+    "topics",
+    "emotional_tone",
+    "people",
+    "emotions",
+    "situations",
+    "key_moments",
+)
+
+
+def _mark_dirty(s: dict, *sections: str):
+    """Bump the session version and flag memory sections for re-rendering."""
+    s["version"] = s.get("version", 0) + 1
+    cache = s.setdefault("memory_cache", {"version": 0, "sections": {}, "dirty": [], "text": ""})
+    for name in sections:
+        if name not in cache["dirty"]:
+            cache["dirty"].append(name)
+
+
 def _merge_unique(existing: List[str], new_items: List[str], limit: int = 12) -> List[str]:
     merged = existing[:]
     for item in new_items:
@@ -61,82 +125,308 @@ def _merge_unique(existing: List[str], new_items: List[str], limit: int = 12) ->
     return merged[-limit:]
 
 
-def _extract_entities(text: str) -> dict:
-    lowered = text.lower()
-
-    people: List[str] = []
-    for key, value in PEOPLE_KEYWORDS.items():
-        if re.search(rf"\b{re.escape(key)}\b", lowered):
-            people.append(value)
-
-    emotions: List[str] = []
-    for key, value in EMOTION_KEYWORDS.items():
-        if re.search(rf"\b{re.escape(key)}\b", lowered):
-            emotions.append(value)
-
-    situations: List[str] = []
-    for key, value in SITUATION_KEYWORDS.items():
-        if re.search(rf"\b{re.escape(key)}\b", lowered):
-            situations.append(value)
-
-    return {
-        "people": sorted(set(people)),
-        "emotions": sorted(set(emotions)),
-        "situations": sorted(set(situations)),
+def _build_matcher() -> KeywordMatcher:
+    vocabulary = {
+        "people": dict(PEOPLE_KEYWORDS),
+        "emotions": dict(EMOTION_KEYWORDS),
+        "situations": dict(SITUATION_KEYWORDS),
     }
+    if ENTITY_KEYWORDS_PATH:
+        for category, keywords in load_vocabulary(ENTITY_KEYWORDS_PATH).items():
+            vocabulary.setdefault(category, {}).update(keywords)
+    return KeywordMatcher(vocabulary)
 
 
-def create_session() -> str:
-    """Create a new session and return its ID."""
-    sid = str(uuid4())
-    _sessions[sid] = {
+_matcher = _build_matcher()
+
+
+def _extract_entities(text: str) -> dict:
+    return _matcher.extract(text)
+
+
+def get_store() -> SessionStore:
+    global _store
+    if _store is None:
+        _store = create_store(SESSION_BACKEND)
+    return _store
+
+
+def set_store(store: SessionStore):
+    global _store
+    _store = store
+
+
+async def offload(fn: Callable[..., T], *args) -> T:
+    """
+    Call ``fn(*args)`` from async code. With a blocking store (SQLite, Redis)
+    it runs in a worker thread so store round-trips never stall the event
+    loop; the in-process store is called inline, it is cheap and not
+    thread-safe. The caller's context, including a session_batch, is kept.
+    """
+    if get_store().blocking:
+        return await asyncio.to_thread(fn, *args)
+    return fn(*args)
+
+
+def close_store():
+    global _store, _journal
+    if _journal is not None:
+        _journal.close()
+        _journal = None
+    if isinstance(_store, InMemorySessionStore):
+        _store.on_remove = None
+    if _store is not None:
+        _store.close()
+        _store = None
+
+
+def start_journal() -> int:
+    """
+    Replay ``SESSION_JOURNAL_DIR`` into the in-memory store and start
+    journaling. Returns the number of sessions restored. Other backends are
+    durable already, so this is a no-op for them.
+    """
+    global _journal
+    store = get_store()
+    if not SESSION_JOURNAL_DIR or _journal is not None or not isinstance(store, InMemorySessionStore):
+        return 0
+    journal = SessionJournal(
+        SESSION_JOURNAL_DIR,
+        apply_event,
+        fsync_interval=SESSION_JOURNAL_FSYNC_MS / 1000,
+        snapshot_every=SESSION_JOURNAL_SNAPSHOT_EVENTS,
+        retention=SESSION_IDLE_TTL_SECONDS,
+    )
+    sessions, touched = journal.replay()
+    # Set first, so sessions the store evicts while being refilled are recorded too
+    store.on_remove = lambda sid: journal.append([int(time.time()), "d", sid])
+    # Least recently touched first, so the store's LRU order matches
+    ordered = sorted(sessions, key=lambda sid: touched.get(sid, 0))
+    for sid in ordered:
+        _restore_mood(store, sid, sessions[sid])
+    store.save_many({sid: sessions[sid] for sid in ordered})
+    journal.start()
+    _journal = journal
+    return len(sessions)
+
+
+def _restore_mood(store: SessionStore, session_id: str, s: dict):
+    """Hand the points replay collected on ``s`` over to the store."""
+    raw = mood_trajectory.legacy_points(s.pop("mood", None))
+    raw += b"".join(mood_trajectory.pack(*point) for point in s.pop("mood_points", []))
+    size = mood_trajectory.POINT.itemsize
+    for start in range(0, len(raw), size):
+        store.append_mood(session_id, raw[start : start + size], MOOD_MAX_POINTS)
+
+
+def _record(op: str, session_id: str, *args):
+    if _journal is not None:
+        _journal.append([int(time.time()), op, session_id, *args])
+
+
+def session_stats() -> dict:
+    stats = get_store().stats()
+    if _journal is not None:
+        stats["journal"] = _journal.stats()
+    return stats
+
+
+async def run_session_sweeper(interval: float):
+    """Background task: periodically drop expired sessions from the store."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await offload(get_store().sweep)
+        except Exception:
+            pass
+
+
+@contextmanager
+def session_batch():
+    """
+    Defer session writes until the block exits, then flush them together,
+    so a whole /chat turn costs one store round-trip instead of one per call.
+    Tasks started inside the block share the batch.
+    """
+    if _pending.get() is not None:
+        yield
+        return
+    pending: Dict[str, dict] = {}
+    token = _pending.set(pending)
+    try:
+        yield
+    finally:
+        _pending.reset(token)
+        _flush(pending)
+
+
+@asynccontextmanager
+async def session_batch_async():
+    """:func:`session_batch` for async code: the flush goes through :func:`offload`."""
+    if _pending.get() is not None:
+        yield
+        return
+    pending: Dict[str, dict] = {}
+    token = _pending.set(pending)
+    try:
+        yield
+    finally:
+        _pending.reset(token)
+        if any(entry["dirty"] for entry in pending.values()):
+            await offload(_flush, pending)
+
+
+def _batched(fn: Callable[..., T]) -> Callable[..., T]:
+    """Run a mutator inside a session_batch (the caller's, if there is one)."""
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        with session_batch():
+            return fn(*args, **kwargs)
+
+    return wrapper
+
+
+def _flush(pending: Dict[str, dict]):
+    """
+    Write the batch's changed sessions, each only if nobody else wrote it
+    since it was loaded. Sessions that were are reloaded, get this batch's
+    changes reapplied and are written again.
+    """
+    store = get_store()
+    writes = {sid: entry for sid, entry in pending.items() if entry["dirty"]}
+    for _ in range(_SAVE_ATTEMPTS):
+        if not writes:
+            return
+        expected = {}
+        for sid, entry in writes.items():
+            if entry["base"] is not None:
+                expected[sid] = entry["base"]
+                session = entry["session"]
+                session["version"] = max(session.get("version", 0), entry["base"] + 1)
+        conflicts = store.save_many({sid: entry["session"] for sid, entry in writes.items()}, expected)
+        writes = {sid: writes[sid] for sid in conflicts}
+        for sid in conflicts:
+            count_fallback("session_write_conflict")
+            fresh = store.load(sid)
+            if fresh is None:
+                del writes[sid]  # deleted or expired meanwhile
+                continue
+            for apply, args in writes[sid]["changes"]:
+                apply(fresh, *args)
+            writes[sid].update(session=fresh, base=fresh.get("version", 0))
+    if writes:
+        raise SessionConflict(f"sessions kept changing: {', '.join(writes)}")
+
+
+def _load(session_id: str) -> Optional[dict]:
+    pending = _pending.get()
+    if pending is None:
+        return get_store().load(session_id)
+    entry = pending.get(session_id)
+    if entry is None:
+        session = get_store().load(session_id)
+        if session is None:
+            return None
+        entry = {"session": session, "base": session.get("version", 0), "changes": [], "dirty": False}
+        pending[session_id] = entry
+    return entry["session"]
+
+
+def _save(session_id: str, session: dict, apply: Optional[Callable] = None, *args):
+    """
+    Mark ``session`` (as returned by :func:`_load`, or new) for writing when
+    the batch exits; ``apply(session, *args)`` is the change just made to
+    it, reapplied if the write has to be retried. Only valid inside a batch.
+    """
+    pending = _pending.get()
+    entry = pending.get(session_id)
+    if entry is None or entry["session"] is not session:
+        entry = {"session": session, "base": None, "changes": [], "dirty": False}
+        pending[session_id] = entry
+    entry["dirty"] = True
+    if apply is not None:
+        entry["changes"].append((apply, args))
+
+
+def _new_session() -> dict:
+    session = {
         "user_name": None,
         "topics": [],
         "emotional_tone": [],
         "history": [],  # list of {"role": "user"|"assistant", "content": str}
+        "summary": "",  # rolling summary of turns compacted out of history
         "entities": {
             "people": ["father"],
             "emotions": ["stress"],
             "situations": ["family tension"],
         },
         "key_moments": ["User has mentioned missing their father."],
+        "version": 0,
     }
+    _mark_dirty(session, *MEMORY_SECTIONS)
+    return session
+
+
+@_batched
+def create_session() -> str:
+    """Create a new session and return its ID."""
+    sid = str(uuid4())
+    _save(sid, _new_session())
+    _record("c", sid)
     return sid
 
 
 def get_session(session_id: str) -> Optional[dict]:
-    return _sessions.get(session_id)
+    return _load(session_id)
 
 
-def update_session(session_id: str, *, user_name: Optional[str] = None, topic: Optional[str] = None, tone: Optional[str] = None):
-    s = _sessions.get(session_id)
-    if not s:
-        return
-    if user_name:
+def resolve_session(session_id: Optional[str]) -> str:
+    """``session_id`` if it exists, otherwise a new session's ID."""
+    if session_id and _load(session_id):
+        return session_id
+    return create_session()
+
+
+def _apply_update(s: dict, user_name: Optional[str], topic: Optional[str], tone: Optional[str]):
+    if user_name and user_name != s["user_name"]:
         s["user_name"] = user_name
+        _mark_dirty(s, "user_name")
     if topic and topic not in s["topics"][-5:]:
         s["topics"].append(topic)
         s["topics"] = s["topics"][-10:]  # keep last 10
+        _mark_dirty(s, "topics")
     if tone:
         s["emotional_tone"].append(tone)
         s["emotional_tone"] = s["emotional_tone"][-10:]
+        _mark_dirty(s, "emotional_tone")
 
 
-def add_message(session_id: str, role: str, content: str):
-    s = _sessions.get(session_id)
+@_batched
+def update_session(session_id: str, *, user_name: Optional[str] = None, topic: Optional[str] = None, tone: Optional[str] = None):
+    s = _load(session_id)
     if not s:
         return
+    _apply_update(s, user_name, topic, tone)
+    _save(session_id, s, _apply_update, user_name, topic, tone)
+    _record("u", session_id, user_name, topic, tone)
+
+
+def _apply_message(s: dict, role: str, content: str):
     s["history"].append({"role": role, "content": content})
-    # Keep last 20 messages for short-term memory
-    s["history"] = s["history"][-20:]
+    # Older turns are normally folded into the summary (see history_window)
+    # long before this cap; it only bounds session size if that falls behind.
+    s["history"] = s["history"][-HISTORY_MAX_MESSAGES:]
 
     if role == "user" and content.strip():
         entities = _extract_entities(content)
         current = s.get("entities", {"people": [], "emotions": [], "situations": []})
 
-        current["people"] = _merge_unique(current.get("people", []), entities["people"])
-        current["emotions"] = _merge_unique(current.get("emotions", []), entities["emotions"])
-        current["situations"] = _merge_unique(current.get("situations", []), entities["situations"])
+        for kind in ("people", "emotions", "situations"):
+            merged = _merge_unique(current.get(kind, []), entities[kind])
+            if merged != current.get(kind):
+                current[kind] = merged
+                _mark_dirty(s, kind)
         s["entities"] = current
 
         if entities["people"] or entities["emotions"] or entities["situations"]:
@@ -145,34 +435,153 @@ def add_message(session_id: str, role: str, content: str):
                 [f"User said: {content[:120]}"],
                 limit=8,
             )
+            _mark_dirty(s, "key_moments")
+
+
+@_batched
+def add_message(session_id: str, role: str, content: str):
+    s = _load(session_id)
+    if not s:
+        return
+    _apply_message(s, role, content)
+    _save(session_id, s, _apply_message, role, content)
+    _record("m", session_id, role, content)
 
 
 def get_history(session_id: str) -> List[dict]:
-    s = _sessions.get(session_id)
+    s = _load(session_id)
     if not s:
         return []
     return s["history"]
 
 
+def _apply_mood_summary(s: dict, summary: str):
+    s["mood_summary"] = summary
+
+
+def _apply_emotion(s: dict, ts: int, label: int, intensity: float, summary: str):
+    # Journal replay only: the points wait on the session until start_journal
+    # hands them to the store (see _restore_mood)
+    points = s.setdefault("mood_points", [])
+    points.append([ts, label, intensity])
+    if len(points) > MOOD_MAX_POINTS + MOOD_MAX_POINTS // 8:
+        del points[:-MOOD_MAX_POINTS]
+    _apply_mood_summary(s, summary)
+
+
+@_batched
+def record_emotion(session_id: str, emotion: dict):
+    """Add a turn's classification (label, intensity, summary) to the session's trajectory."""
+    s = _load(session_id)
+    if not s:
+        return
+    ts = int(time.time())
+    label = mood_trajectory.label_index(emotion.get("emotion", "neutral"))
+    intensity = round(float(emotion.get("intensity", 0.5)), 3)
+    summary = emotion.get("summary", "")
+    # The point goes straight to the store; only the summary is on the session
+    get_store().append_mood(session_id, mood_trajectory.pack(ts, label, intensity), MOOD_MAX_POINTS)
+    _apply_mood_summary(s, summary)
+    _save(session_id, s, _apply_mood_summary, summary)
+    _record("e", session_id, ts, label, intensity, summary)
+
+
+def get_mood(session_id: str, window: int, points: int) -> Optional[dict]:
+    s = _load(session_id)
+    if not s:
+        return None
+    raw = mood_trajectory.legacy_points(s.get("mood")) + get_store().load_mood(session_id)
+    return mood_trajectory.analyze(raw, window, points, s.get("mood_summary"))
+
+
+def _apply_summary(s: dict, folded_count: int, summary: str):
+    s["history"] = s["history"][folded_count:]
+    s["summary"] = summary
+    _mark_dirty(s, "summary")
+
+
+def _fold_history(s: dict, folded: List[dict], summary: str) -> bool:
+    if s["history"][: len(folded)] != folded:
+        return False
+    _apply_summary(s, len(folded), summary)
+    return True
+
+
+@_batched
+def apply_history_summary(session_id: str, folded: List[dict], summary: str) -> bool:
+    """
+    Replace the summary and drop ``folded`` from the front of the history.
+    Skipped (returns False) if the history no longer starts with ``folded``,
+    e.g. because it was trimmed while the summary was being written.
+    """
+    s = _load(session_id)
+    if not s or not _fold_history(s, folded, summary):
+        return False
+    _save(session_id, s, _fold_history, folded, summary)
+    _record("s", session_id, len(folded), summary)
+    return True
+
+
+def apply_event(sessions: Dict[str, dict], event: list):
+    """Apply one journal event (``[ts, op, session_id, *args]``) to ``sessions``."""
+    _, op, session_id, *args = event
+    if op == "c":
+        sessions[session_id] = _new_session()
+        return
+    if op == "d":
+        sessions.pop(session_id, None)
+        return
+    s = sessions.get(session_id)
+    if s is None:
+        return
+    if op == "m":
+        _apply_message(s, *args)
+    elif op == "u":
+        _apply_update(s, *args)
+    elif op == "s":
+        _apply_summary(s, *args)
+    elif op == "e":
+        _apply_emotion(s, *args)
+
+
+def _render_section(s: dict, name: str) -> str:
+    if name == "user_name":
+        return f"User's name: {s['user_name']}" if s["user_name"] else ""
+    if name == "summary":
+        return f"Earlier in this conversation: {s['summary']}" if s.get("summary") else ""
+    if name == "topics":
+        return f"Topics discussed: {', '.join(s['topics'][-5:])}" if s["topics"] else ""
+    if name == "emotional_tone":
+        tones = s["emotional_tone"]
+        return f"Recent emotional tones: {', '.join(tones[-3:])}" if tones else ""
+    if name in ("people", "emotions", "situations"):
+        items = s.get("entities", {}).get(name)
+        return f"{name.capitalize()} mentioned: {', '.join(items[-5:])}" if items else ""
+    if name == "key_moments":
+        moments = s.get("key_moments")
+        return f"Key moments: {' | '.join(moments[-3:])}" if moments else ""
+    return ""
+
+
 def get_memory_context(session_id: str) -> str:
-    """Build a short memory summary to inject into the prompt."""
-    s = _sessions.get(session_id)
+    """
+    Build a short memory summary to inject into the prompt.
+    The rendered block is cached on the session; only sections marked dirty
+    since the last call are re-rendered.
+    """
+    s = _load(session_id)
     if not s:
         return ""
-    parts = []
-    if s["user_name"]:
-        parts.append(f"User's name: {s['user_name']}")
-    if s["topics"]:
-        parts.append(f"Topics discussed: {', '.join(s['topics'][-5:])}")
-    if s["emotional_tone"]:
-        parts.append(f"Recent emotional tones: {', '.join(s['emotional_tone'][-3:])}")
-    entities = s.get("entities", {})
-    if entities.get("people"):
-        parts.append(f"People mentioned: {', '.join(entities['people'][-5:])}")
-    if entities.get("emotions"):
-        parts.append(f"Emotions mentioned: {', '.join(entities['emotions'][-5:])}")
-    if entities.get("situations"):
-        parts.append(f"Situations mentioned: {', '.join(entities['situations'][-5:])}")
-    if s.get("key_moments"):
-        parts.append(f"Key moments: {' | '.join(s['key_moments'][-3:])}")
-    return "\n".join(parts)
+    cache = s.get("memory_cache")
+    if cache is None:
+        # Sessions stored before the cache existed start fully dirty.
+        _mark_dirty(s, *MEMORY_SECTIONS)
+        cache = s["memory_cache"]
+    if cache["dirty"]:
+        sections = cache["sections"]
+        for name in cache["dirty"]:
+            sections[name] = _render_section(s, name)
+        cache["dirty"] = []
+        cache["text"] = "\n".join(sections[n] for n in MEMORY_SECTIONS if sections.get(n))
+        cache["version"] = s.get("version", 0)
+    return cache["text"]
@@ -0,0 +1,214 @@
+"""
+Prometheus metrics, in the text exposition format, without a client library.
+
+- :func:`span` times a block into ``soultalk_span_seconds{span,target}`` and,
+  inside a request with Server-Timing enabled, into that response's header.
+- :func:`observe_stage` records stage-graph stage durations.
+- :func:`count_fallback` counts each degraded path (``soultalk_fallbacks_total``),
+  so an upstream that fails quietly shows up as a rising fallback rate rather
+  than as a fast success.
+- :func:`observe_size` feeds the payload-size histograms.
+- :func:`register_collector` exposes an existing ``*_stats()`` dict as gauges.
+"""
+
+from __future__ import annotations
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional, Tuple
+
+_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+_SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+# (name, duration ms) pairs for the current request's Server-Timing header
+_server_timing: ContextVar[Optional[List[Tuple[str, float]]]] = ContextVar("server_timing", default=None)
+
+_lock = threading.Lock()
+
+
+def _labels(names: Tuple[str, ...], values: Tuple[str, ...]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = ()):
+        self.name, self.help, self.labelnames = name, help, labelnames
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1):
+        with _lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets, labelnames: Tuple[str, ...] = ()):
+        self.name, self.help, self.labelnames = name, help, labelnames
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket counts..., +Inf count, sum]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, *labels: str):
+        with _lock:
+            row = self._values.get(labels)
+            if row is None:
+                row = self._values[labels] = [0] * (len(self.buckets) + 2)
+            row[bisect.bisect_left(self.buckets, value)] += 1
+            row[-1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        names = self.labelnames + ("le",)
+        for labels, row in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), row[:-1]):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels(names, labels + (bound,))} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {row[-1]}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+SPAN_SECONDS = Histogram(
+    "soultalk_span_seconds", "Time spent in instrumented operations", _LATENCY_BUCKETS, ("span", "target")
+)
+STAGE_SECONDS = Histogram(
+    "soultalk_stage_seconds", "Duration of /chat stage-graph stages", _LATENCY_BUCKETS, ("stage",)
+)
+FALLBACKS = Counter("soultalk_fallbacks_total", "Degraded or fallback paths taken", ("path",))
+PAYLOAD_BYTES = Histogram("soultalk_payload_bytes", "Payload sizes", _SIZE_BUCKETS, ("kind",))
+REQUESTS = Counter("soultalk_requests_total", "HTTP requests by route and status", ("route", "status"))
+
+_metrics = [SPAN_SECONDS, STAGE_SECONDS, FALLBACKS, PAYLOAD_BYTES, REQUESTS]
+_collectors: List[Tuple[str, Callable[[], dict], Optional[str]]] = []
+
+
+def _record_timing(name: str, seconds: float):
+    timings = _server_timing.get()
+    if timings is not None:
+        timings.append((name, seconds * 1000))
+
+
+@contextmanager
+def span(name: str, target: str = ""):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        SPAN_SECONDS.observe(elapsed, name, target)
+        _record_timing(f"{name}.{target}" if target else name, elapsed)
+
+
+def observe_stage(name: str, seconds: float):
+    STAGE_SECONDS.observe(seconds, name)
+    _record_timing(f"stage.{name}", seconds)
+
+
+def count_fallback(path: str):
+    FALLBACKS.inc(path)
+
+
+def observe_size(kind: str, nbytes: int):
+    PAYLOAD_BYTES.observe(nbytes, kind)
+
+
+def register_collector(prefix: str, fn: Callable[[], dict], label: Optional[str] = None):
+    """
+    Export ``fn()``'s numeric leaves as gauges named ``soultalk_<prefix>_<key>``.
+    With ``label``, the top-level keys become that label's values instead
+    (e.g. one series per upstream).
+    """
+    _collectors.append((prefix, fn, label))
+
+
+def _flatten(data: dict, path: str = ""):
+    for key, value in data.items():
+        name = f"{path}_{key}" if path else str(key)
+        if isinstance(value, dict):
+            yield from _flatten(value, name)
+        elif isinstance(value, bool):
+            yield name, int(value)
+        elif isinstance(value, (int, float)):
+            yield name, value
+
+
+def _render_collectors() -> List[str]:
+    series: Dict[str, List[str]] = {}
+    for prefix, fn, label in _collectors:
+        try:
+            data = fn()
+        except Exception:
+            continue
+        groups = data.items() if label else [(None, data)]
+        for label_value, group in groups:
+            if not isinstance(group, dict):
+                continue
+            labels = _labels((label,), (label_value,)) if label else ""
+            for key, value in _flatten(group):
+                name = f"soultalk_{prefix}_{key}".replace("-", "_").replace(".", "_")
+                series.setdefault(name, []).append(f"{name}{labels} {value}")
+    lines = []
+    for name, samples in series.items():
+        lines.append(f"# TYPE {name} gauge")
+        lines.extend(samples)
+    return lines
+
+
+def render() -> str:
+    lines: List[str] = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    lines.extend(_render_collectors())
+    return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    """
+    Counts requests by route template and status, and with ``server_timing``
+    adds a ``Server-Timing`` header listing the spans recorded before the
+    response started (for streaming responses, only what ran before the
+    first byte).
+    """
+
+    def __init__(self, app, server_timing: bool = False):
+        self.app = app
+        self.server_timing = server_timing
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        timings: List[Tuple[str, float]] = []
+        token = _server_timing.set(timings)
+        started = time.perf_counter()
+
+        async def timed_send(message):
+            if message["type"] == "http.response.start":
+                route = scope.get("route")
+                REQUESTS.inc(getattr(route, "path", "unmatched"), str(message["status"]))
+                if self.server_timing:
+                    total = (time.perf_counter() - started) * 1000
+                    entries = [f"{n};dur={ms:.1f}" for n, ms in timings] + [f"total;dur={total:.1f}"]
+                    headers = list(message.get("headers", []))
+                    headers.append((b"server-timing", ", ".join(entries).encode()))
+                    message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, timed_send)
+        finally:
+            _server_timing.reset(token)
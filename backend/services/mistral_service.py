@@ -2,12 +2,19 @@
 Mistral Large LLM service — generates emotionally intelligent responses.
 """
 
-import httpx
+import json
 import re
-from typing import Optional
-from config import MISTRAL_API_KEY, SYSTEM_PROMPT_PATH
+from functools import lru_cache
+from typing import AsyncIterator, List, Optional, Tuple
+from config import LLM_TIMEOUT, MISTRAL_API_BASE, MISTRAL_API_KEY
+from services.history_window import select_window
+from services.http_client import get_client
+from services.metrics import count_fallback, span
+from services.upstream_scheduler import get_scheduler
+from services.prompt_registry import get_prompt
+from services.voxtral_service import UNCLEAR_TRANSCRIPT
 
-MISTRAL_API_URL = "https://api.mistral.ai/v1/chat/completions"
+MISTRAL_API_URL = f"{MISTRAL_API_BASE}/v1/chat/completions"
 
 FILLER_BY_EMOTION = {
     "sad": "Hmm…",
@@ -27,50 +34,129 @@ def _style_hint(emotion: str) -> str:
     return "Keep a calm conversational tone."
 
 
+_AS_AN_AI = re.compile(r"(?i)\bas an ai\b[^\n.?!]*[.?!]?")
+_SENTENCE_SPLIT = re.compile(r"(?<=[.!?…])\s+")
+_FILLERS = ("Hmm…", "I hear you…", "That makes sense…")
+_EMPTY_REPLY = "I hear you… that sounds like a lot to carry right now."
+MAX_REPLY_SENTENCES = 3
+
+
 def _apply_response_guardrails(text: str, emotion: str) -> str:
-    cleaned = re.sub(r"(?i)\bas an ai\b[^\n.?!]*[.?!]?", "", text).strip()
-    cleaned = re.sub(r"\n{3,}", "\n\n", cleaned)
+    """
+    At most ``MAX_REPLY_SENTENCES`` sentences, one per line, without "as an
+    AI" disclaimers and opening with a filler. Runs the streaming guardrails
+    over the whole text, so a reply reads the same streamed or not.
+    """
+    guardrails = StreamingGuardrails(emotion)
+    guardrails.feed(text)
+    guardrails.finish()
+    return "\n".join(guardrails.sentences)
 
-    if not cleaned:
-        cleaned = "I hear you… that sounds like a lot to carry right now."
 
-    sentences = [s.strip() for s in re.split(r"(?<=[.!?…])\s+", cleaned) if s.strip()]
-    if not sentences:
-        sentences = [cleaned]
+def split_leading_filler(sentence: str) -> Tuple[Optional[str], str]:
+    """``("Hmm…", "rest")`` for a sentence that opens with a filler, else ``(None, sentence)``."""
+    for filler in _FILLERS:
+        if sentence.startswith(filler):
+            return filler, sentence[len(filler):].strip()
+    return None, sentence
 
-    lines = sentences[:3]
-    limited = "\n".join(lines)
 
-    filler = FILLER_BY_EMOTION.get(emotion, "Hmm…")
-    if not limited.startswith(("Hmm…", "I hear you…", "That makes sense…")):
-        limited = f"{filler} {limited}"
+class StreamingGuardrails:
+    """
+    Feed raw LLM tokens and get back each sentence once it is complete;
+    :func:`_apply_response_guardrails` is this run over a whole completion.
+    Disclaimers are stripped per sentence, after splitting.
+    """
 
-    return limited.strip()
+    def __init__(self, emotion: str):
+        self.filler = FILLER_BY_EMOTION.get(emotion, "Hmm…")
+        self.sentences: List[str] = []
+        self._buffer = ""
 
+    @property
+    def done(self) -> bool:
+        return len(self.sentences) >= MAX_REPLY_SENTENCES
 
-def _load_system_prompt() -> str:
-    try:
-        with open(SYSTEM_PROMPT_PATH, "r") as f:
-            return f.read()
-    except FileNotFoundError:
+    def feed(self, token: str) -> List[str]:
+        self._buffer += token
+        parts = _SENTENCE_SPLIT.split(self._buffer)
+        # The last part has no trailing whitespace yet, so it may still grow.
+        self._buffer = parts.pop()
+        return self._emit(parts)
+
+    def finish(self) -> List[str]:
+        rest, self._buffer = self._buffer, ""
+        emitted = self._emit([rest])
+        if not self.sentences:
+            emitted = self._emit(_SENTENCE_SPLIT.split(_EMPTY_REPLY))
+        return emitted
+
+    def _emit(self, parts: List[str]) -> List[str]:
+        emitted = []
+        for part in parts:
+            if self.done:
+                break
+            sentence = re.sub(r"\n{3,}", "\n\n", _AS_AN_AI.sub("", part).strip())
+            if not sentence:
+                continue
+            if not self.sentences and not sentence.startswith(_FILLERS):
+                sentence = f"{self.filler} {sentence}"
+            self.sentences.append(sentence)
+            emitted.append(sentence)
+        return emitted
+
+
+def _load_system_prompt(persona: Optional[str] = None, language: Optional[str] = None) -> str:
+    prompt = get_prompt("system_prompt", persona, language)
+    if prompt is None:
         return "You are SoulTalk, an emotionally intelligent AI companion. Respond with empathy and warmth."
+    return prompt
 
 
-async def generate_response(
-    transcript: str,
-    memory_context: str,
-    history: list[dict],
-    emotion: Optional[dict] = None,
-) -> str:
-    lowered = transcript.lower().strip()
-    if "i mentioned my dad earlier" in lowered:
-        return "Yes… you said you miss him…"
+OUTPUT_CONSTRAINTS = (
+    "\n\n--- Output Constraints ---\n"
+    "Reply in 2-4 short lines max.\n"
+    "Validate emotion first, reflect second, optional gentle question last.\n"
+    "Do not give generic advice unless user asks directly."
+)
+
+
+@lru_cache(maxsize=8)
+def _static_prefix(base_prompt: str) -> str:
+    # Everything that is identical across turns and sessions goes first, so the
+    # upstream prompt cache can reuse it; per-turn sections are appended after.
+    return base_prompt + OUTPUT_CONSTRAINTS
 
-    system_prompt = _load_system_prompt()
-    emotion_label = (emotion or {}).get("emotion", "neutral")
 
+def build_system_prompt(
+    memory_context: str,
+    persona: Optional[str] = None,
+    language: Optional[str] = None,
+) -> str:
+    """System prompt up to and including session memory (emotion-independent)."""
+    system_prompt = _static_prefix(_load_system_prompt(persona, language))
     if memory_context:
         system_prompt += f"\n\n--- Session Memory ---\n{memory_context}"
+    return system_prompt
+
+
+def fallback_response(emotion_label: str) -> str:
+    return _apply_response_guardrails(
+        "I hear you… that sounds like a lot. I hit a brief connection issue, but I’m still here with you. What part feels heaviest right now?",
+        emotion_label,
+    )
+
+
+def _build_messages(
+    transcript: str,
+    memory_context: str,
+    history: list[dict],
+    emotion: Optional[dict],
+    system_prompt: Optional[str],
+) -> list[dict]:
+    if system_prompt is None:
+        system_prompt = build_system_prompt(memory_context)
+    emotion_label = (emotion or {}).get("emotion", "neutral")
 
     if emotion:
         intensity = emotion.get("intensity", 0.5)
@@ -82,52 +168,161 @@ async def generate_response(
             f"{_style_hint(emotion_label)}"
         )
 
-    system_prompt += (
-        "\n\n--- Output Constraints ---\n"
-        "Reply in 2-4 short lines max.\n"
-        "Validate emotion first, reflect second, optional gentle question last.\n"
-        "Do not give generic advice unless user asks directly."
-    )
-
     messages = [{"role": "system", "content": system_prompt}]
-    messages.extend(history[-10:])
+    messages.extend(select_window(history, transcript))
     messages.append({"role": "user", "content": transcript})
+    return messages
+
+
+DAD_RECALL_REPLY = "Yes… you said you miss him…"
+
+
+def _offline_reply(emotion_label: str) -> str:
+    fallback = "That sounds really heavy… like it's been sitting with you for a while."
+    if emotion_label == "anxious":
+        fallback = "I hear you… this sounds like a lot all at once."
+    if emotion_label == "confused":
+        fallback = "That makes sense… things feel unclear right now."
+    return _apply_response_guardrails(
+        f"{fallback} What feels most present for you right now?",
+        emotion_label,
+    )
+
+
+def _canned_reply(transcript: str, emotion_label: str) -> Optional[str]:
+    """Replies that never reach the API (demo recall line, no-key mode)."""
+    lowered = transcript.lower().strip()
+    if "i mentioned my dad earlier" in lowered:
+        return DAD_RECALL_REPLY
 
     if not MISTRAL_API_KEY:
-        fallback = "That sounds really heavy… like it's been sitting with you for a while."
-        if emotion_label == "anxious":
-            fallback = "I hear you… this sounds like a lot all at once."
-        if emotion_label == "confused":
-            fallback = "That makes sense… things feel unclear right now."
-        return _apply_response_guardrails(
-            f"{fallback} What feels most present for you right now?",
-            emotion_label,
-        )
+        return _offline_reply(emotion_label)
+    return None
+
+
+def known_replies() -> List[str]:
+    """Fixed replies (fillers, fallbacks, canned lines) worth pre-synthesizing."""
+    phrases = list(FILLER_BY_EMOTION.values()) + [DAD_RECALL_REPLY, UNCLEAR_TRANSCRIPT]
+    for emotion in FILLER_BY_EMOTION:
+        for reply in (
+            fallback_response(emotion),
+            _offline_reply(emotion),
+            _apply_response_guardrails("", emotion),
+        ):
+            phrases.append(reply)
+            # /chat/stream speaks replies line by line
+            phrases.extend(reply.split("\n"))
+    return list(dict.fromkeys(phrases))
+
+
+async def generate_response(
+    transcript: str,
+    memory_context: str,
+    history: list[dict],
+    emotion: Optional[dict] = None,
+    system_prompt: Optional[str] = None,
+) -> str:
+    """
+    Generate a guarded reply. ``system_prompt`` may be pre-assembled with
+    :func:`build_system_prompt` while emotion detection is still running.
+    """
+    emotion_label = (emotion or {}).get("emotion", "neutral")
+    canned = _canned_reply(transcript, emotion_label)
+    if canned is not None:
+        return canned
+
+    payload = {
+        "model": "mistral-large-latest",
+        "messages": _build_messages(transcript, memory_context, history, emotion, system_prompt),
+        "max_tokens": 180,
+        "temperature": 0.6,
+    }
+
+    try:
+        with span("llm", "complete"):
+            resp = await get_scheduler("mistral").run(
+                lambda: get_client("mistral").post(
+                    MISTRAL_API_URL,
+                    json=payload,
+                    headers={
+                        "Authorization": f"Bearer {MISTRAL_API_KEY}",
+                        "Content-Type": "application/json",
+                    },
+                    timeout=LLM_TIMEOUT,
+                )
+            )
+            resp.raise_for_status()
+            data = resp.json()
+
+        raw_text = data["choices"][0]["message"]["content"].strip()
+        with span("guardrails"):
+            return _apply_response_guardrails(raw_text, emotion_label)
+    except Exception:
+        count_fallback("llm_error")
+        return fallback_response(emotion_label)
+
+
+async def stream_response(
+    transcript: str,
+    memory_context: str,
+    history: list[dict],
+    emotion: Optional[dict] = None,
+    system_prompt: Optional[str] = None,
+) -> AsyncIterator[str]:
+    """
+    Streaming variant of :func:`generate_response`. Tokens are read from the
+    Mistral SSE stream and passed through :class:`StreamingGuardrails`, so each
+    guarded sentence is yielded as soon as it is complete.
+    """
+    emotion_label = (emotion or {}).get("emotion", "neutral")
+    canned = _canned_reply(transcript, emotion_label)
+    if canned is not None:
+        for line in canned.split("\n"):
+            yield line
+        return
 
     payload = {
         "model": "mistral-large-latest",
-        "messages": messages,
+        "messages": _build_messages(transcript, memory_context, history, emotion, system_prompt),
         "max_tokens": 180,
         "temperature": 0.6,
+        "stream": True,
     }
+    guard = StreamingGuardrails(emotion_label)
 
     try:
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            resp = await client.post(
+        with span("llm", "stream"):
+            # The upstream slot is held for as long as the stream is open
+            async with get_scheduler("mistral").slot(), get_client("mistral").stream(
+                "POST",
                 MISTRAL_API_URL,
                 json=payload,
                 headers={
                     "Authorization": f"Bearer {MISTRAL_API_KEY}",
                     "Content-Type": "application/json",
+                    "Accept": "text/event-stream",
                 },
-            )
-            resp.raise_for_status()
-            data = resp.json()
-
-        raw_text = data["choices"][0]["message"]["content"].strip()
-        return _apply_response_guardrails(raw_text, emotion_label)
+                timeout=LLM_TIMEOUT,
+            ) as resp:
+                resp.raise_for_status()
+                async for line in resp.aiter_lines():
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[5:].strip()
+                    if data == "[DONE]":
+                        break
+                    delta = json.loads(data)["choices"][0].get("delta", {})
+                    for sentence in guard.feed(delta.get("content") or ""):
+                        yield sentence
+                    if guard.done:
+                        break
     except Exception:
-        return _apply_response_guardrails(
-            "I hear you… that sounds like a lot. I hit a brief connection issue, but I’m still here with you. What part feels heaviest right now?",
-            emotion_label,
-        )
+        count_fallback("llm_stream_error")
+        if not guard.sentences:
+            for line in fallback_response(emotion_label).split("\n"):
+                yield line
+        # A half-received sentence is dropped rather than spoken.
+        return
+
+    for sentence in guard.finish():
+        yield sentence
@@ -0,0 +1,132 @@
+"""
+Per-session emotion trajectory.
+
+Every classified turn adds a 6-byte point (unix seconds, label index,
+intensity quantised to 0–255), packed as a NumPy record. The points are kept
+by the session store next to the session, not inside it (see
+``SessionStore.append_mood``): appending one is a few bytes, and the session
+dict that is serialised on every turn stays small however long the
+trajectory gets.
+
+:func:`analyze` works on the whole buffer at once: distress is the intensity
+of non-neutral turns, smoothed with a rolling mean over ``window`` turns.
+A turn counts as escalating when that mean is at least ``MOOD_ESCALATION_LEVEL``
+and has risen by ``MOOD_ESCALATION_DELTA`` over the previous window.
+"""
+
+from __future__ import annotations
+import base64
+from typing import Optional
+
+import numpy as np
+
+from config import MOOD_ESCALATION_DELTA, MOOD_ESCALATION_LEVEL, MOOD_MAX_POINTS
+
+# Stored as indices: only ever append to this list
+LABELS = ("sad", "anxious", "confused", "neutral")
+_NEUTRAL = LABELS.index("neutral")
+
+POINT = np.dtype([("ts", "<u4"), ("label", "u1"), ("intensity", "u1")])
+
+
+def label_index(label: str) -> int:
+    return LABELS.index(label) if label in LABELS else _NEUTRAL
+
+
+def pack(ts: int, label: int, intensity: float) -> bytes:
+    """One point, as stored."""
+    level = round(min(1.0, max(0.0, intensity)) * 255)
+    return np.array([(ts, label, level)], dtype=POINT).tobytes()
+
+
+def legacy_points(packed: Optional[str]) -> bytes:
+    """Points of the base64 buffer sessions carried before the store kept them."""
+    return base64.b64decode(packed) if isinstance(packed, str) and packed else b""
+
+
+def decode(raw: bytes) -> np.ndarray:
+    """The newest ``MOOD_MAX_POINTS`` points of ``raw``."""
+    usable = len(raw) - len(raw) % POINT.itemsize
+    return np.frombuffer(raw[:usable], dtype=POINT)[-MOOD_MAX_POINTS:]
+
+
+def _rolling_mean(values: np.ndarray, window: int) -> np.ndarray:
+    """Mean of the last ``window`` values at each index (fewer at the start)."""
+    csum = np.concatenate(([0.0], np.cumsum(values, dtype=np.float64)))
+    idx = np.arange(1, values.size + 1)
+    start = np.maximum(idx - window, 0)
+    return (csum[idx] - csum[start]) / (idx - start)
+
+
+def _slope(values: np.ndarray) -> float:
+    """Least-squares change per turn."""
+    if values.size < 2:
+        return 0.0
+    x = np.arange(values.size, dtype=np.float64)
+    x -= x.mean()
+    return float((x * (values - values.mean())).sum() / (x * x).sum())
+
+
+def _episodes(flags: np.ndarray, ts: np.ndarray, rolling: np.ndarray) -> list:
+    edges = np.diff(np.concatenate(([0], flags.astype(np.int8), [0])))
+    starts, ends = np.flatnonzero(edges == 1), np.flatnonzero(edges == -1) - 1
+    # max over each [start, end]; the sentinel keeps end + 1 a valid index
+    bounds = np.column_stack((starts, ends + 1)).ravel()
+    peaks = np.maximum.reduceat(np.append(rolling, 0), bounds)[::2] if starts.size else []
+    return [
+        {"start": int(ts[s]), "end": int(ts[e]), "turns": int(e - s + 1), "peak": round(float(p), 3)}
+        for s, e, p in zip(starts, ends, peaks)
+    ]
+
+
+def _downsample(values: np.ndarray, points: int) -> np.ndarray:
+    if values.size <= points:
+        return values
+    bounds = np.linspace(0, values.size, points + 1).astype(np.int64)[:-1]
+    counts = np.diff(np.append(bounds, values.size))
+    return np.add.reduceat(values, bounds) / counts
+
+
+def analyze(raw: bytes, window: int = 10, points: int = 200, summary: Optional[str] = None) -> dict:
+    data = decode(raw)
+    n = int(data.size)
+    if n == 0:
+        return {"turns": 0}
+    window = min(max(1, window), n)
+    ts = data["ts"]
+    labels = data["label"]
+    intensity = data["intensity"].astype(np.float64) / 255
+    distress = np.where(labels == _NEUTRAL, 0.0, intensity)
+    rolling = _rolling_mean(distress, window)
+
+    previous = np.concatenate((np.full(window, rolling[0]), rolling[:-window]))[:n]
+    escalating = (rolling >= MOOD_ESCALATION_LEVEL) & (rolling - previous >= MOOD_ESCALATION_DELTA)
+    escalating[: min(n, window)] = False  # no earlier window to compare with
+
+    counts = np.bincount(labels, minlength=len(LABELS))
+    recent = labels[-window:]
+    return {
+        "turns": n,
+        "first": int(ts[0]),
+        "last": int(ts[-1]),
+        "latest": {
+            "emotion": LABELS[labels[-1]],
+            "intensity": round(float(intensity[-1]), 3),
+            "summary": summary,
+        },
+        "labels": {label: int(c) for label, c in zip(LABELS, counts[: len(LABELS)])},
+        "dominant_recent": LABELS[int(np.bincount(recent, minlength=len(LABELS)).argmax())],
+        "distress": {
+            "mean": round(float(distress.mean()), 3),
+            "rolling": round(float(rolling[-1]), 3),
+            "trend_per_turn": round(_slope(distress), 4),
+            "recent_trend_per_turn": round(_slope(distress[-window:]), 4),
+        },
+        "escalating": bool(escalating[-1]),
+        "escalations": _episodes(escalating, ts, rolling),
+        "series": {
+            "ts": _downsample(ts.astype(np.float64), points).round().astype(np.int64).tolist(),
+            "distress": _downsample(distress, points).round(3).tolist(),
+            "rolling": _downsample(rolling, points).round(3).tolist(),
+        },
+    }
@@ -0,0 +1,101 @@
+"""
+Prompt registry.
+Every ``*.txt`` under ``PROMPTS_DIR`` is loaded once at startup and served from
+memory. Variants are named by dotted suffixes — ``system_prompt.es.txt``,
+``system_prompt.calm.txt``, ``system_prompt.calm.es.txt`` — and resolved from
+most to least specific. A background watcher re-reads files whose mtime
+changed, off the event loop, so requests never touch the disk.
+"""
+
+from __future__ import annotations
+import asyncio
+import os
+from typing import Dict, Optional, Tuple
+
+from config import PROMPTS_DIR
+
+# name -> (mtime, text)
+_prompts: Dict[str, Tuple[float, str]] = {}
+_loaded = False
+_version = 0  # bumped on every reload that changed something
+
+
+def _scan() -> bool:
+    """Reload added/changed/removed prompt files. Returns True if anything changed."""
+    global _prompts, _version
+    try:
+        entries = [e for e in os.scandir(PROMPTS_DIR) if e.is_file() and e.name.endswith(".txt")]
+    except FileNotFoundError:
+        entries = []
+
+    current: Dict[str, Tuple[float, str]] = {}
+    changed = False
+    for entry in entries:
+        name = entry.name[: -len(".txt")]
+        mtime = entry.stat().st_mtime
+        cached = _prompts.get(name)
+        if cached is not None and cached[0] == mtime:
+            current[name] = cached
+            continue
+        try:
+            with open(entry.path, "r", encoding="utf-8") as f:
+                current[name] = (mtime, f.read())
+        except OSError:
+            continue
+        changed = True
+
+    if changed or current.keys() != _prompts.keys():
+        _prompts = current  # swap whole dict so readers never see a partial update
+        _version += 1
+        return True
+    return False
+
+
+def load_prompts():
+    global _loaded
+    _scan()
+    _loaded = True
+
+
+async def watch_prompts(interval: float):
+    """Background task: pick up prompt edits without restarting the worker."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await asyncio.to_thread(_scan)
+        except Exception:
+            pass
+
+
+def get_prompt(
+    name: str,
+    persona: Optional[str] = None,
+    language: Optional[str] = None,
+) -> Optional[str]:
+    """Most specific of ``name.persona.language``, ``name.persona``, ``name.language``, ``name``."""
+    if not _loaded:
+        load_prompts()
+    candidates = []
+    if persona and language:
+        candidates.append(f"{name}.{persona}.{language}")
+    if persona:
+        candidates.append(f"{name}.{persona}")
+    if language:
+        candidates.append(f"{name}.{language}")
+    candidates.append(name)
+    for candidate in candidates:
+        entry = _prompts.get(candidate)
+        if entry is not None:
+            return entry[1]
+    return None
+
+
+def list_prompts() -> list:
+    if not _loaded:
+        load_prompts()
+    return sorted(_prompts)
+
+
+def prompt_stats() -> dict:
+    """Loaded prompt names and the reload version, to confirm an edit was picked up."""
+    return {"version": _version, "count": len(list_prompts()), "prompts": list_prompts()}
@@ -0,0 +1,249 @@
+"""
+Append-only journal of session mutations, for the in-memory session backend.
+
+Each mutation is one compact JSON line ``[ts, op, session_id, *args]``
+recording the operation, not the resulting session, so a turn costs a few
+hundred bytes. Lines are buffered and written by a background thread that
+fsyncs once per ``fsync_interval`` at most (group commit): callers never
+wait on the disk, and a crash loses at most that interval.
+
+The journal is split into numbered segments. Every ``snapshot_every`` events
+the writer starts a new segment and a compaction thread folds the closed ones
+into ``snapshot.json`` (dropping sessions idle longer than ``retention``) and
+deletes them. Startup replay loads the snapshot and applies the remaining
+segments, so its cost is bounded by the live sessions plus one snapshot
+interval of events, not by the whole history.
+
+Sessions the store drops (deleted, idle-expired, evicted) are journaled as a
+``d`` event, so neither a snapshot nor a replay brings them back.
+``retention`` only covers sessions that expired while the process was down.
+It compares the wall-clock event timestamps with ``time.time()``, while the
+store's idle TTL runs on ``time.monotonic()``. After a clock step the two
+can disagree by the size of the step until the ``d`` events catch up.
+"""
+
+from __future__ import annotations
+import json
+import os
+import re
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+_SEGMENT = re.compile(r"^segment-(\d+)\.log$")
+_SNAPSHOT = "snapshot.json"
+
+
+class SessionJournal:
+    def __init__(
+        self,
+        directory: str,
+        apply: Callable[[Dict[str, dict], list], None],
+        fsync_interval: float = 0.05,
+        snapshot_every: int = 10000,
+        retention: float = 0,
+    ):
+        self.directory = directory
+        self.apply = apply
+        self.fsync_interval = fsync_interval
+        self.snapshot_every = snapshot_every
+        self.retention = retention
+        os.makedirs(directory, exist_ok=True)
+
+        self._cond = threading.Condition()
+        self._buffer: List[str] = []
+        self._appended = 0  # events handed to append()
+        self._durable = 0  # events written and fsynced
+        self._since_snapshot = 0
+        self._closed = False
+        self._file = None
+        self._segment = 0
+        self._writer: Optional[threading.Thread] = None
+        self._compactor: Optional[threading.Thread] = None
+        self._stats = {
+            "fsyncs": 0,
+            "bytes_written": 0,
+            "snapshots": 0,
+            "replayed_events": 0,
+            "replay_seconds": 0.0,
+            "write_errors": 0,
+        }
+
+    # --- files -------------------------------------------------------------
+
+    def _segment_path(self, seq: int) -> str:
+        return os.path.join(self.directory, f"segment-{seq:08d}.log")
+
+    def _segments(self) -> List[int]:
+        return sorted(int(m.group(1)) for m in map(_SEGMENT.match, os.listdir(self.directory)) if m)
+
+    def _read_snapshot(self) -> Tuple[int, Dict[str, dict], Dict[str, float]]:
+        path = os.path.join(self.directory, _SNAPSHOT)
+        if not os.path.exists(path):
+            return 0, {}, {}
+        with open(path) as f:
+            data = json.load(f)
+        return data["next_segment"], data["sessions"], data["touched"]
+
+    def _fold(self, upto: Optional[int] = None):
+        """Snapshot state plus segments before ``upto`` (all when None)."""
+        next_segment, sessions, touched = self._read_snapshot()
+        events = 0
+        for seq in self._segments():
+            if seq < next_segment or (upto is not None and seq >= upto):
+                continue
+            with open(self._segment_path(seq), "rb") as f:
+                for line in f:
+                    try:
+                        event = json.loads(line)
+                        self.apply(sessions, event)
+                    except Exception:
+                        continue  # torn tail of a crashed write, or a bad event
+                    if event[2] in sessions:
+                        touched[event[2]] = event[0]
+                    else:
+                        touched.pop(event[2], None)  # deleted or evicted
+                    events += 1
+            next_segment = seq + 1
+        return next_segment, sessions, touched, events
+
+    def _expire(self, sessions: Dict[str, dict], touched: Dict[str, float]):
+        if self.retention <= 0:
+            return
+        cutoff = time.time() - self.retention
+        for sid in [sid for sid, ts in touched.items() if ts < cutoff]:
+            touched.pop(sid, None)
+            sessions.pop(sid, None)
+
+    # --- lifecycle ---------------------------------------------------------
+
+    def replay(self) -> Tuple[Dict[str, dict], Dict[str, float]]:
+        """Rebuild every retained session: ``(sessions, last_touched)``."""
+        started = time.perf_counter()
+        for seq in self._segments():
+            if os.path.getsize(self._segment_path(seq)) == 0:
+                os.remove(self._segment_path(seq))
+        next_segment, sessions, touched, events = self._fold()
+        self._expire(sessions, touched)
+        self._segment = max([next_segment] + [s + 1 for s in self._segments()])
+        self._since_snapshot = events
+        self._stats["replayed_events"] = events
+        self._stats["replay_seconds"] = round(time.perf_counter() - started, 3)
+        return sessions, touched
+
+    def start(self):
+        # Always a fresh segment: appending after a torn line would corrupt the next one
+        self._file = open(self._segment_path(self._segment), "ab")
+        self._writer = threading.Thread(target=self._write_loop, name="session-journal", daemon=True)
+        self._writer.start()
+
+    def append(self, event: list):
+        line = json.dumps(event, ensure_ascii=False, separators=(",", ":")) + "\n"
+        with self._cond:
+            if self._closed:
+                return
+            self._buffer.append(line)
+            self._appended += 1
+            self._cond.notify()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Block until everything appended so far is on disk."""
+        with self._cond:
+            target = self._appended
+            return self._cond.wait_for(lambda: self._durable >= target or self._closed, timeout)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._writer is not None:
+            self._writer.join()
+        if self._compactor is not None:
+            self._compactor.join()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    # --- writer ------------------------------------------------------------
+
+    def _write_loop(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._buffer or self._closed)
+                lines, self._buffer = self._buffer, []
+                closing = self._closed
+            if lines:
+                self._write(lines)
+            if closing:
+                with self._cond:
+                    if not self._buffer:
+                        return
+                continue
+            if self._since_snapshot >= self.snapshot_every:
+                self._rotate()
+            # Let appends accumulate so the next fsync covers a whole group
+            time.sleep(self.fsync_interval)
+
+    def _write(self, lines: List[str]):
+        data = "".join(lines).encode("utf-8")
+        try:
+            self._file.write(data)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        except OSError:
+            self._stats["write_errors"] += 1
+        self._stats["fsyncs"] += 1
+        self._stats["bytes_written"] += len(data)
+        self._since_snapshot += len(lines)
+        with self._cond:
+            self._durable += len(lines)
+            self._cond.notify_all()
+
+    def _rotate(self):
+        if self._compactor is not None and self._compactor.is_alive():
+            return
+        self._file.close()
+        self._segment += 1
+        self._file = open(self._segment_path(self._segment), "ab")
+        self._since_snapshot = 0
+        self._compactor = threading.Thread(
+            target=self.compact, args=(self._segment,), name="session-journal-compact", daemon=True
+        )
+        self._compactor.start()
+
+    def compact(self, upto: int):
+        """Fold segments before ``upto`` into the snapshot and delete them."""
+        next_segment, sessions, touched, _ = self._fold(upto)
+        self._expire(sessions, touched)
+        path = os.path.join(self.directory, _SNAPSHOT)
+        tmp = f"{path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(
+                {"next_segment": next_segment, "sessions": sessions, "touched": touched},
+                f,
+                separators=(",", ":"),
+            )
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+        dir_fd = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+        for seq in self._segments():
+            if seq < next_segment:
+                os.remove(self._segment_path(seq))
+        self._stats["snapshots"] += 1
+
+    def stats(self) -> dict:
+        with self._cond:
+            pending = self._appended - self._durable
+            appended = self._appended
+        return {
+            **self._stats,
+            "events": appended,
+            "pending": pending,
+            "events_per_fsync": round(appended / self._stats["fsyncs"], 2) if self._stats["fsyncs"] else 0.0,
+            "segment": self._segment,
+        }
@@ -0,0 +1,503 @@
+"""
+Session storage backends.
+Sessions are plain JSON-serialisable dicts; a store only loads and saves them
+whole. ``memory`` keeps them in-process, ``sqlite`` persists them in a WAL-mode
+database file, and ``redis`` talks RESP to Redis or anything that speaks the
+protocol, so several workers or nodes can share sessions.
+
+Every write bumps the session's ``version``. ``save_many`` can be given the
+version each session had when it was loaded; the SQLite and Redis backends
+then skip sessions someone else has written since and return their IDs, so
+the caller can reload, reapply its change and try again.
+
+A session's mood trajectory (fixed-size packed points, see
+:mod:`services.mood_trajectory`) is kept beside it rather than in it:
+``append_mood`` adds a point without touching the session, so the whole-
+session writes above stay small. Deleting a session deletes its points.
+"""
+
+from __future__ import annotations
+import json
+import socket
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+from urllib.parse import unquote, urlparse
+
+from config import (
+    SESSION_IDLE_TTL_SECONDS,
+    SESSION_MAX_BYTES,
+    SESSION_MAX_COUNT,
+    SESSION_REDIS_PREFIX,
+    SESSION_REDIS_URL,
+    SESSION_SQLITE_PATH,
+    SESSION_TTL_SECONDS,
+)
+
+
+class SessionStore:
+    """Interface every backend implements."""
+
+    # True when calls do disk or network I/O; async callers then run them in
+    # a worker thread (see memory_service.offload)
+    blocking = False
+
+    def load(self, session_id: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    def save(self, session_id: str, session: dict):
+        raise NotImplementedError
+
+    def save_many(self, sessions: Dict[str, dict], expected: Optional[Dict[str, int]] = None) -> List[str]:
+        """
+        Write several sessions at once; backends override to batch. A session
+        listed in ``expected`` is only written if the stored one still has
+        that ``version``; the IDs skipped for that reason are returned. The
+        base implementation has no conditional write and always returns [].
+        """
+        for session_id, session in sessions.items():
+            self.save(session_id, session)
+        return []
+
+    def delete(self, session_id: str):
+        raise NotImplementedError
+
+    def append_mood(self, session_id: str, point: bytes, max_points: int):
+        """Add one packed point; only about the newest ``max_points`` are kept."""
+        raise NotImplementedError
+
+    def load_mood(self, session_id: str) -> bytes:
+        """All kept points, oldest first (possibly a few more than ``max_points``)."""
+        raise NotImplementedError
+
+    def sweep(self) -> int:
+        """Drop expired sessions; returns how many were removed."""
+        return 0
+
+    def stats(self) -> dict:
+        return {"backend": type(self).__name__}
+
+    def close(self):
+        pass
+
+
+def _approx_size(session: dict) -> int:
+    return len(json.dumps(session, separators=(",", ":")))
+
+
+class InMemorySessionStore(SessionStore):
+    """
+    Process-local LRU. ``load`` hands back the live object, no copies.
+    Sessions idle longer than ``idle_ttl`` are swept, and the least recently
+    used ones are evicted once ``max_sessions`` or ``max_bytes`` (measured as
+    serialised size, recomputed on each save, plus mood points) is exceeded.
+    Mood points sit in a ``bytearray`` per session. ``on_remove`` is
+    called with the ID of every session dropped (deleted, expired or
+    evicted), so the journal can record it.
+    """
+
+    def __init__(
+        self,
+        idle_ttl: float = SESSION_IDLE_TTL_SECONDS,
+        max_sessions: int = SESSION_MAX_COUNT,
+        max_bytes: int = SESSION_MAX_BYTES,
+    ):
+        self.idle_ttl = idle_ttl
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        # session_id -> [session, size, last_access]; least recent first
+        self._sessions: "OrderedDict[str, list]" = OrderedDict()
+        self._bytes = 0
+        self._counters = {"hits": 0, "misses": 0, "evicted_lru": 0, "expired": 0}
+        self.on_remove: Optional[Callable[[str], None]] = None
+        self._mood: Dict[str, bytearray] = {}
+
+    def load(self, session_id: str) -> Optional[dict]:
+        entry = self._sessions.get(session_id)
+        now = time.monotonic()
+        if entry is None or now - entry[2] > self.idle_ttl:
+            if entry is not None:
+                self._remove(session_id)
+                self._counters["expired"] += 1
+            self._counters["misses"] += 1
+            return None
+        entry[2] = now
+        self._sessions.move_to_end(session_id)
+        self._counters["hits"] += 1
+        return entry[0]
+
+    def save(self, session_id: str, session: dict):
+        size = _approx_size(session)
+        entry = self._sessions.get(session_id)
+        if entry is not None:
+            self._bytes -= entry[1]
+        self._sessions[session_id] = [session, size, time.monotonic()]
+        self._sessions.move_to_end(session_id)
+        self._bytes += size
+        while len(self._sessions) > 1 and (
+            len(self._sessions) > self.max_sessions or self._bytes > self.max_bytes
+        ):
+            oldest = next(iter(self._sessions))
+            self._remove(oldest)
+            self._counters["evicted_lru"] += 1
+
+    def delete(self, session_id: str):
+        if session_id in self._sessions:
+            self._remove(session_id)
+
+    def _remove(self, session_id: str):
+        _, size, _ = self._sessions.pop(session_id)
+        self._bytes -= size + len(self._mood.pop(session_id, b""))
+        if self.on_remove is not None:
+            self.on_remove(session_id)
+
+    def append_mood(self, session_id: str, point: bytes, max_points: int):
+        buf = self._mood.setdefault(session_id, bytearray())
+        buf += point
+        self._bytes += len(point)
+        limit = max_points * len(point)
+        # Trimmed in steps of an eighth, not one point per append
+        if len(buf) > limit + limit // 8:
+            excess = len(buf) - limit
+            del buf[:excess]
+            self._bytes -= excess
+
+    def load_mood(self, session_id: str) -> bytes:
+        return bytes(self._mood.get(session_id, b""))
+
+    def sweep(self) -> int:
+        # LRU order is also last-access order, so expired entries sit at the front.
+        cutoff = time.monotonic() - self.idle_ttl
+        removed = 0
+        while self._sessions:
+            oldest, entry = next(iter(self._sessions.items()))
+            if entry[2] >= cutoff:
+                break
+            self._remove(oldest)
+            removed += 1
+        self._counters["expired"] += removed
+        return removed
+
+    def stats(self) -> dict:
+        return {
+            "backend": "memory",
+            "sessions": len(self._sessions),
+            "bytes": self._bytes,
+            "max_sessions": self.max_sessions,
+            "max_bytes": self.max_bytes,
+            **self._counters,
+        }
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+
+class SQLiteSessionStore(SessionStore):
+    """One row per session holding its JSON; WAL lets workers read while one writes."""
+
+    blocking = True
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("PRAGMA busy_timeout=5000")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            " id TEXT PRIMARY KEY,"
+            " data TEXT NOT NULL,"
+            " updated_at REAL NOT NULL)"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS mood ("
+            " seq INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " session_id TEXT NOT NULL,"
+            " point BLOB NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS mood_session ON mood (session_id, seq)")
+
+    def load(self, session_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._db.execute("SELECT data FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save(self, session_id: str, session: dict):
+        self.save_many({session_id: session})
+
+    def save_many(self, sessions: Dict[str, dict], expected: Optional[Dict[str, int]] = None) -> List[str]:
+        expected = expected or {}
+        now = time.time()
+        rows = [(sid, json.dumps(s, separators=(",", ":")), now) for sid, s in sessions.items()]
+        conflicts = []
+        with self._lock:
+            self._db.execute("BEGIN")
+            try:
+                self._db.executemany(
+                    "INSERT INTO sessions (id, data, updated_at) VALUES (?, ?, ?) "
+                    "ON CONFLICT(id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at",
+                    [row for row in rows if row[0] not in expected],
+                )
+                for sid, data, updated_at in rows:
+                    if sid not in expected:
+                        continue
+                    cur = self._db.execute(
+                        "UPDATE sessions SET data = ?, updated_at = ? "
+                        "WHERE id = ? AND IFNULL(json_extract(data, '$.version'), 0) = ?",
+                        (data, updated_at, sid, expected[sid]),
+                    )
+                    if cur.rowcount == 0:
+                        conflicts.append(sid)
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
+        return conflicts
+
+    def delete(self, session_id: str):
+        with self._lock:
+            self._db.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+            self._db.execute("DELETE FROM mood WHERE session_id = ?", (session_id,))
+
+    def append_mood(self, session_id: str, point: bytes, max_points: int):
+        # One row per point; rows past the newest max_points are dropped as we go
+        with self._lock:
+            self._db.execute("INSERT INTO mood (session_id, point) VALUES (?, ?)", (session_id, point))
+            self._db.execute(
+                "DELETE FROM mood WHERE session_id = ? AND seq <= "
+                "(SELECT seq FROM mood WHERE session_id = ? ORDER BY seq DESC LIMIT 1 OFFSET ?)",
+                (session_id, session_id, max_points),
+            )
+
+    def load_mood(self, session_id: str) -> bytes:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT point FROM mood WHERE session_id = ? ORDER BY seq", (session_id,)
+            ).fetchall()
+        return b"".join(row[0] for row in rows)
+
+    def sweep(self) -> int:
+        if SESSION_TTL_SECONDS <= 0:
+            return 0
+        with self._lock:
+            cur = self._db.execute(
+                "DELETE FROM sessions WHERE updated_at < ?", (time.time() - SESSION_TTL_SECONDS,)
+            )
+            self._db.execute("DELETE FROM mood WHERE session_id NOT IN (SELECT id FROM sessions)")
+        return cur.rowcount
+
+    def stats(self) -> dict:
+        with self._lock:
+            (count,) = self._db.execute("SELECT COUNT(*) FROM sessions").fetchone()
+        return {"backend": "sqlite", "sessions": count}
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class RespConnection:
+    """Minimal blocking RESP2 client: just enough for GET/SET/DEL pipelines and WATCH/MULTI."""
+
+    def __init__(self, url: str, timeout: float = 2.0):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.password = unquote(parsed.password) if parsed.password else None
+        self.db = int((parsed.path or "/0").lstrip("/") or 0)
+        self.timeout = timeout
+        self._sock: Optional[socket.socket] = None
+        self._file = None
+
+    def _connect(self):
+        self._sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._file = self._sock.makefile("rb")
+        setup = []
+        if self.password:
+            setup.append(("AUTH", self.password))
+        if self.db:
+            setup.append(("SELECT", str(self.db)))
+        if setup:
+            try:
+                self._send(setup)
+            except Exception:
+                self.close()  # never reuse a connection that failed AUTH/SELECT
+                raise
+
+    def close(self):
+        if self._sock is not None:
+            try:
+                self._file.close()
+                self._sock.close()
+            finally:
+                self._sock = None
+                self._file = None
+
+    @staticmethod
+    def _encode(args) -> bytes:
+        out = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            if isinstance(arg, str):
+                arg = arg.encode("utf-8")
+            elif not isinstance(arg, bytes):
+                arg = str(arg).encode("utf-8")
+            out.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+        return b"".join(out)
+
+    def _read_reply(self):
+        """One reply; a server error is returned as a RuntimeError, not raised."""
+        line = self._file.readline()
+        if not line:
+            raise ConnectionError("redis connection closed")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest.decode()
+        if kind == b"-":
+            return RuntimeError(rest.decode())
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            size = int(rest)
+            if size < 0:
+                return None
+            data = self._file.read(size + 2)
+            return data[:-2]
+        if kind == b"*":
+            count = int(rest)
+            return None if count < 0 else [self._read_reply() for _ in range(count)]
+        raise ConnectionError(f"unexpected redis reply: {line!r}")
+
+    def _send(self, commands) -> List:
+        self._sock.sendall(b"".join(self._encode(c) for c in commands))
+        # Read every reply before raising, so none is left for the next call
+        replies = [self._read_reply() for _ in commands]
+        for reply in replies:
+            for item in reply if isinstance(reply, list) else (reply,):
+                if isinstance(item, RuntimeError):
+                    raise item
+        return replies
+
+    def pipeline(self, commands, reconnect: bool = True) -> List:
+        """
+        Send all commands in one write and read the replies in order. Pass
+        ``reconnect=False`` when the commands depend on connection state
+        (a WATCH), which a fresh connection would silently lose.
+        """
+        if self._sock is None:
+            self._connect()
+        try:
+            return self._send(commands)
+        except (ConnectionError, OSError):
+            self.close()
+            if not reconnect:
+                raise
+            # One reconnect covers idle connections dropped by the server.
+            self._connect()
+            return self._send(commands)
+
+
+class RedisSessionStore(SessionStore):
+    """
+    Sessions as JSON strings under ``<prefix><id>`` with a sliding TTL; mood
+    points are APPENDed to ``<prefix><id>:mood``, which shares the TTL.
+    """
+
+    blocking = True
+
+    def __init__(self, url: str, prefix: str = "soultalk:session:", ttl_seconds: int = 0):
+        self._conn = RespConnection(url)
+        self._lock = threading.Lock()
+        self.prefix = prefix
+        self.ttl_seconds = ttl_seconds
+
+    def _set_command(self, session_id: str, session: dict) -> tuple:
+        command = ("SET", self.prefix + session_id, json.dumps(session, separators=(",", ":")))
+        if self.ttl_seconds > 0:
+            command += ("EX", self.ttl_seconds)
+        return command
+
+    def load(self, session_id: str) -> Optional[dict]:
+        with self._lock:
+            (raw,) = self._conn.pipeline([("GET", self.prefix + session_id)])
+        return json.loads(raw) if raw else None
+
+    def save(self, session_id: str, session: dict):
+        self.save_many({session_id: session})
+
+    def save_many(self, sessions: Dict[str, dict], expected: Optional[Dict[str, int]] = None) -> List[str]:
+        expected = expected or {}
+        plain = [self._set_command(sid, s) for sid, s in sessions.items() if sid not in expected]
+        checked = [sid for sid in sessions if sid in expected]
+        with self._lock:
+            if plain:
+                self._conn.pipeline(plain)
+            if not checked:
+                return []
+            return self._save_checked({sid: sessions[sid] for sid in checked}, expected)
+
+    def _save_checked(self, sessions: Dict[str, dict], expected: Dict[str, int]) -> List[str]:
+        # WATCH, compare versions, then MULTI/EXEC: EXEC is refused if any
+        # watched key was written in between, and then nothing is saved
+        keys = [self.prefix + sid for sid in sessions]
+        _, *current = self._conn.pipeline([("WATCH", *keys), *(("GET", key) for key in keys)])
+        conflicts = [
+            sid for sid, raw in zip(sessions, current) if _stored_version(raw) != expected[sid]
+        ]
+        writes = [self._set_command(sid, s) for sid, s in sessions.items() if sid not in conflicts]
+        if not writes:
+            self._conn.pipeline([("UNWATCH",)], reconnect=False)
+            return conflicts
+        *_, applied = self._conn.pipeline([("MULTI",), *writes, ("EXEC",)], reconnect=False)
+        return list(sessions) if applied is None else conflicts
+
+    def delete(self, session_id: str):
+        key = self.prefix + session_id
+        with self._lock:
+            self._conn.pipeline([("DEL", key, key + ":mood")])
+
+    def append_mood(self, session_id: str, point: bytes, max_points: int):
+        key = self.prefix + session_id + ":mood"
+        commands = [("APPEND", key, point)]
+        if self.ttl_seconds > 0:
+            commands.append(("EXPIRE", key, self.ttl_seconds))
+        limit = max_points * len(point)
+        with self._lock:
+            length = self._conn.pipeline(commands)[0]
+            if length > limit + limit // 8:
+                self._trim(key, limit)
+
+    def _trim(self, key: str, limit: int):
+        # Keep the newest ``limit`` bytes; skipped if a point lands meanwhile
+        _, tail = self._conn.pipeline([("WATCH", key), ("GETRANGE", key, -limit, -1)])
+        command = ("SET", key, tail) + (("EX", self.ttl_seconds) if self.ttl_seconds > 0 else ())
+        self._conn.pipeline([("MULTI",), command, ("EXEC",)], reconnect=False)
+
+    def load_mood(self, session_id: str) -> bytes:
+        with self._lock:
+            (raw,) = self._conn.pipeline([("GET", self.prefix + session_id + ":mood")])
+        return raw or b""
+
+    def stats(self) -> dict:
+        # Expiry is handled by Redis itself via the per-key TTL.
+        return {"backend": "redis", "ttl_seconds": self.ttl_seconds}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def _stored_version(raw: Optional[bytes]) -> Optional[int]:
+    return json.loads(raw).get("version", 0) if raw else None
+
+
+def create_store(backend: str) -> SessionStore:
+    if backend == "sqlite":
+        return SQLiteSessionStore(SESSION_SQLITE_PATH)
+    if backend == "redis":
+        return RedisSessionStore(SESSION_REDIS_URL, SESSION_REDIS_PREFIX, SESSION_TTL_SECONDS)
+    if backend == "memory":
+        return InMemorySessionStore()
+    raise ValueError(f"unknown SESSION_BACKEND: {backend!r}")
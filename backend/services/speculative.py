@@ -0,0 +1,138 @@
+"""
+Speculative reply generation.
+
+The reply prompt carries the user's emotion, so the LLM call normally waits
+for :func:`detect_emotion`, a full Mistral round-trip whenever the local
+classifier is unsure. With ``SPECULATIVE_LLM`` the call starts right after
+transcription with the provisional (local) emotion instead. When the real
+classification arrives, a draft with the same label is kept (a win: the
+emotion round-trip is off the critical path); a different label cancels the
+draft and generation restarts with the real emotion (a discard). Only the
+label has to match; the kept reply was written with the provisional
+intensity and summary.
+
+A kept draft that fails or is cancelled before producing anything is
+replaced by a fresh generation with the real emotion, so speculation never
+turns into a failed turn. It is settled as a discard: its time was wasted,
+nothing was saved.
+
+Saved latency per win is ``min(head start, draft duration)`` (for streams,
+time to the first sentence): how much earlier the reply, or its first
+sentence, is ready than if generation had started after classification.
+"""
+
+from __future__ import annotations
+import asyncio
+import time
+from typing import AsyncIterator, Awaitable, Callable, Optional
+
+from services.metrics import count_fallback
+
+_stats = {"started": 0, "wins": 0, "discards": 0, "saved_ms_total": 0.0, "wasted_ms_total": 0.0}
+_END = object()
+
+
+async def _failed(task: asyncio.Task) -> bool:
+    """Wait for ``task`` without raising; True if it failed or was cancelled."""
+    await asyncio.wait([task])
+    if task.cancelled() or task.exception() is not None:
+        count_fallback("speculative_draft_failed")
+        return True
+    return False
+
+
+def _settle(kept: bool, started: float, ready_at: Optional[float]):
+    now = time.perf_counter()
+    if kept:
+        _stats["wins"] += 1
+        _stats["saved_ms_total"] += (min(now, ready_at or now) - started) * 1000
+    else:
+        _stats["discards"] += 1
+        _stats["wasted_ms_total"] += (now - started) * 1000
+
+
+class SpeculativeReply:
+    """``start(emotion)`` run with ``provisional`` now, settled by :meth:`result`."""
+
+    def __init__(self, provisional: dict, start: Callable[[dict], Awaitable[str]]):
+        self.provisional = provisional
+        self._start = start
+        self._started = time.perf_counter()
+        self._ready_at: Optional[float] = None
+        self._task = asyncio.create_task(start(provisional))
+        self._task.add_done_callback(self._done)
+        _stats["started"] += 1
+
+    def _done(self, _):
+        self._ready_at = time.perf_counter()
+
+    async def result(self, emotion: dict) -> str:
+        if emotion.get("emotion") == self.provisional.get("emotion"):
+            failed = await _failed(self._task)
+            _settle(not failed, self._started, self._ready_at)
+            if not failed:
+                return self._task.result()
+            return await self._start(emotion)
+        self.cancel()
+        _settle(False, self._started, self._ready_at)
+        return await self._start(emotion)
+
+    def cancel(self):
+        self._task.cancel()
+
+
+class SpeculativeStream:
+    """Streaming variant: the draft's sentences are buffered until :meth:`stream`."""
+
+    def __init__(self, provisional: dict, start: Callable[[dict], AsyncIterator[str]]):
+        self.provisional = provisional
+        self._start = start
+        self._started = time.perf_counter()
+        self._first_at: Optional[float] = None
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._pump())
+        _stats["started"] += 1
+
+    async def _pump(self):
+        try:
+            async for sentence in self._start(self.provisional):
+                if self._first_at is None:
+                    self._first_at = time.perf_counter()
+                await self._queue.put(sentence)
+        finally:
+            self._queue.put_nowait(_END)
+
+    async def stream(self, emotion: dict) -> AsyncIterator[str]:
+        if emotion.get("emotion") != self.provisional.get("emotion"):
+            self.cancel()
+            _settle(False, self._started, self._first_at)
+            async for sentence in self._start(emotion):
+                yield sentence
+            return
+        yielded = False
+        while True:
+            sentence = await self._queue.get()
+            if sentence is _END:
+                break
+            yielded = True
+            yield sentence
+        failed = await _failed(self._task)
+        _settle(not failed, self._started, self._first_at)
+        if failed and not yielded:
+            async for sentence in self._start(emotion):
+                yield sentence
+        # A draft that fails part-way ends the reply there, like stream_response
+
+    def cancel(self):
+        self._task.cancel()
+
+
+def speculation_stats() -> dict:
+    settled = _stats["wins"] + _stats["discards"]
+    return {
+        **_stats,
+        "saved_ms_total": round(_stats["saved_ms_total"], 1),
+        "wasted_ms_total": round(_stats["wasted_ms_total"], 1),
+        "win_rate": round(_stats["wins"] / settled, 4) if settled else 0.0,
+        "saved_ms_avg": round(_stats["saved_ms_total"] / _stats["wins"], 1) if _stats["wins"] else 0.0,
+    }
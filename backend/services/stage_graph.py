@@ -0,0 +1,118 @@
+"""
+Tiny async stage graph for the chat pipeline.
+Each stage is a coroutine function whose keyword arguments are the results of
+the stages it depends on. A stage starts as soon as all of its inputs are
+ready, so independent work overlaps without hand-written gather calls.
+"""
+
+from __future__ import annotations
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+
+from services.metrics import count_fallback, observe_stage
+
+
+class StageTimeout(Exception):
+    """Raised when a stage without a fallback exceeds its timeout."""
+
+
+class _Stage:
+    __slots__ = ("name", "fn", "deps", "timeout", "fallback")
+
+    def __init__(self, name, fn, deps, timeout, fallback):
+        self.name = name
+        self.fn = fn
+        self.deps = tuple(deps)
+        self.timeout = timeout
+        self.fallback = fallback
+
+
+class StageGraph:
+    """
+    Runs named stages concurrently, respecting their dependencies.
+
+    ``timeout`` bounds a single stage. When it fires, ``fallback`` (called with
+    the same keyword arguments as the stage) supplies the result instead; with
+    no fallback the whole run fails with :class:`StageTimeout`. Any failure
+    cancels every stage still in flight.
+    """
+
+    def __init__(self):
+        self._stages: Dict[str, _Stage] = {}
+        self.timings: Dict[str, float] = {}
+
+    def add(
+        self,
+        name: str,
+        fn: Callable[..., Awaitable[Any]],
+        *,
+        deps: Iterable[str] = (),
+        timeout: Optional[float] = None,
+        fallback: Optional[Callable[..., Any]] = None,
+    ) -> "StageGraph":
+        if name in self._stages:
+            raise ValueError(f"duplicate stage: {name}")
+        self._stages[name] = _Stage(name, fn, deps, timeout, fallback)
+        return self
+
+    def _order(self, inputs: Iterable[str]) -> List[_Stage]:
+        ready = set(inputs)
+        pending = dict(self._stages)
+        order: List[_Stage] = []
+        while pending:
+            runnable = [s for s in pending.values() if all(d in ready for d in s.deps)]
+            if not runnable:
+                missing = {d for s in pending.values() for d in s.deps if d not in ready and d not in pending}
+                reason = f"unknown inputs {sorted(missing)}" if missing else "a dependency cycle"
+                raise ValueError(f"stage graph has {reason}")
+            for stage in runnable:
+                order.append(stage)
+                ready.add(stage.name)
+                del pending[stage.name]
+        return order
+
+    async def run(self, **inputs: Any) -> Dict[str, Any]:
+        """Run all stages and return every stage result keyed by name."""
+        results: Dict[str, Any] = dict(inputs)
+        tasks: Dict[str, asyncio.Task] = {}
+        started = time.perf_counter()
+
+        async def _run_stage(stage: _Stage):
+            waits = [tasks[d] for d in stage.deps if d in tasks]
+            if waits:
+                await asyncio.gather(*waits)
+            kwargs = {d: results[d] for d in stage.deps}
+
+            t0 = time.perf_counter()
+            try:
+                if stage.timeout is None:
+                    value = await stage.fn(**kwargs)
+                else:
+                    value = await asyncio.wait_for(stage.fn(**kwargs), stage.timeout)
+            except asyncio.TimeoutError:
+                if stage.fallback is None:
+                    raise StageTimeout(f"stage '{stage.name}' timed out after {stage.timeout}s")
+                count_fallback(f"stage_timeout:{stage.name}")
+                value = stage.fallback(**kwargs)
+            finally:
+                elapsed = time.perf_counter() - t0
+                self.timings[stage.name] = round(elapsed * 1000, 1)
+                observe_stage(stage.name, elapsed)
+            results[stage.name] = value
+            return value
+
+        for stage in self._order(inputs):
+            tasks[stage.name] = asyncio.create_task(_run_stage(stage))
+
+        try:
+            await asyncio.gather(*tasks.values())
+        except BaseException:
+            for task in tasks.values():
+                task.cancel()
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+            raise
+        finally:
+            self.timings["total"] = round((time.perf_counter() - started) * 1000, 1)
+
+        return results
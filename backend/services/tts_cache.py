@@ -0,0 +1,120 @@
+"""
+Content-addressed cache for synthesized speech.
+Keys are a SHA-256 of the prepared TTS text, voice ID, model and voice
+settings, so identical replies (fallbacks, fillers, canned lines) are only
+ever synthesized once. Two tiers: an in-memory LRU bounded by bytes, and a
+directory of ``<key>.mp3`` files shared by every worker on the host. Only
+fixed replies (fillers, fallbacks, canned lines; see ``known_replies``) are
+written to disk: that set is bounded, and those clips hold no conversation
+content, so they can be served publicly from ``/tts``. Per-turn replies stay
+in memory. Disk hits are promoted to memory.
+"""
+
+from __future__ import annotations
+import asyncio
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from typing import Optional
+
+from config import TTS_CACHE_DIR, TTS_CACHE_MEMORY_BYTES
+
+_memory: "OrderedDict[str, bytes]" = OrderedDict()
+_memory_bytes = 0
+_stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0}
+
+
+def cache_key(tts_text: str, voice_id: str, model_id: str, voice_settings: dict) -> str:
+    material = json.dumps(
+        [tts_text, voice_id, model_id, voice_settings], sort_keys=True, ensure_ascii=False
+    )
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+def disk_path(key: str) -> Optional[str]:
+    if not TTS_CACHE_DIR:
+        return None
+    return os.path.join(TTS_CACHE_DIR, key[:2], f"{key}.mp3")
+
+
+def cached_path(key: str) -> Optional[str]:
+    """Path of the on-disk clip for ``key`` if it exists (for direct file serving)."""
+    path = disk_path(key)
+    return path if path and os.path.exists(path) else None
+
+
+def _remember(key: str, audio: bytes):
+    global _memory_bytes
+    if len(audio) > TTS_CACHE_MEMORY_BYTES:
+        return
+    previous = _memory.pop(key, None)
+    if previous is not None:
+        _memory_bytes -= len(previous)
+    _memory[key] = audio
+    _memory_bytes += len(audio)
+    while _memory_bytes > TTS_CACHE_MEMORY_BYTES:
+        _, dropped = _memory.popitem(last=False)
+        _memory_bytes -= len(dropped)
+
+
+def _read_disk(key: str) -> Optional[bytes]:
+    path = disk_path(key)
+    if not path:
+        return None
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def _write_disk(key: str, audio: bytes):
+    path = disk_path(key)
+    if not path:
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(audio)
+    os.replace(tmp, path)  # atomic: readers never see a partial clip
+
+
+async def get(key: str) -> Optional[bytes]:
+    audio = _memory.get(key)
+    if audio is not None:
+        _memory.move_to_end(key)
+        _stats["memory_hits"] += 1
+        return audio
+    audio = await asyncio.to_thread(_read_disk, key)
+    if audio:
+        _remember(key, audio)
+        _stats["disk_hits"] += 1
+        return audio
+    _stats["misses"] += 1
+    return None
+
+
+async def put(key: str, audio: bytes, persist: bool = False):
+    """Cache ``audio``; ``persist`` also writes it to the disk tier (fixed replies only)."""
+    if not audio:
+        return
+    _remember(key, audio)
+    _stats["stores"] += 1
+    if not persist:
+        return
+    try:
+        await asyncio.to_thread(_write_disk, key, audio)
+    except OSError:
+        pass
+
+
+def tts_cache_stats() -> dict:
+    lookups = _stats["memory_hits"] + _stats["disk_hits"] + _stats["misses"]
+    hits = _stats["memory_hits"] + _stats["disk_hits"]
+    return {
+        **_stats,
+        "memory_entries": len(_memory),
+        "memory_bytes": _memory_bytes,
+        "hit_rate": round(hits / lookups, 4) if lookups else None,
+    }
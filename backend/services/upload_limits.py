@@ -0,0 +1,99 @@
+"""
+Upload size limits.
+:class:`UploadLimitMiddleware` counts request body bytes as they stream in and
+aborts with 413 once a route's limit is passed (or straight away from
+``Content-Length``), so an oversized upload is never fully received or
+spooled. :func:`read_upload` then reads the already-bounded file in one
+capped read, leaving a single in-memory copy of the audio.
+"""
+
+import json
+from typing import Dict
+
+from fastapi import UploadFile
+
+# Room for the multipart boundaries and part headers around the file itself
+_MULTIPART_SLACK = 64 * 1024
+
+
+class UploadTooLarge(Exception):
+    """Raised when an upload exceeds its size or duration limit."""
+
+
+class UploadLimitMiddleware:
+    def __init__(self, app, limits: Dict[str, int]):
+        self.app = app
+        # Longest prefix first, so /chat/stream can differ from /chat
+        self.limits = sorted(limits.items(), key=lambda item: -len(item[0]))
+
+    def _limit_for(self, path: str):
+        for prefix, limit in self.limits:
+            if path.startswith(prefix):
+                return limit + _MULTIPART_SLACK
+        return None
+
+    async def __call__(self, scope, receive, send):
+        limit = self._limit_for(scope["path"]) if scope["type"] == "http" else None
+        if limit is None:
+            return await self.app(scope, receive, send)
+
+        length = dict(scope["headers"]).get(b"content-length")
+        if length is not None and length.isdigit() and int(length) > limit:
+            return await _reject(send)
+
+        received = 0
+        exceeded = False
+        started = False
+
+        async def limited_receive():
+            nonlocal received, exceeded
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    exceeded = True
+                    raise UploadTooLarge(f"request body over {limit} bytes")
+            return message
+
+        async def guarded_send(message):
+            nonlocal started
+            if message["type"] == "http.response.start":
+                started = True
+                if exceeded:
+                    # The framework reports the aborted body as a parse
+                    # error; answer with 413 instead
+                    return await _reject(send)
+            elif exceeded:
+                return
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except UploadTooLarge:
+            if not started:
+                await _reject(send)
+
+
+async def _reject(send, detail: str = "upload exceeds the size limit"):
+    body = json.dumps({"error": "upload_too_large", "detail": detail}).encode()
+    await send(
+        {
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+            ],
+        }
+    )
+    await send({"type": "http.response.body", "body": body})
+
+
+async def read_upload(upload: UploadFile, max_bytes: int) -> bytes:
+    """Read ``upload`` with a hard cap; raises :class:`UploadTooLarge` past ``max_bytes``."""
+    if upload.size is not None and upload.size > max_bytes:
+        raise UploadTooLarge(f"upload is {upload.size} bytes, limit is {max_bytes}")
+    data = await upload.read(max_bytes + 1)
+    if len(data) > max_bytes:
+        raise UploadTooLarge(f"upload exceeds {max_bytes} bytes")
+    return data
@@ -0,0 +1,179 @@
+"""
+Per-upstream call scheduling.
+Each upstream gets a concurrency semaphore, a token-bucket rate limiter sized
+to the API tier, and a bounded wait queue: once the queue is full, or a call
+has waited too long, it is shed with :class:`UpstreamOverloaded` instead of
+piling onto an upstream that is already returning 429s. Identical in-flight
+requests can be coalesced so only one of them goes upstream.
+"""
+
+from __future__ import annotations
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Dict, Hashable, Optional, TypeVar
+
+from config import UPSTREAM_LIMITS, UPSTREAM_MAX_WAIT
+from services.metrics import count_fallback
+
+T = TypeVar("T")
+
+
+class UpstreamOverloaded(Exception):
+    """Raised when a call is shed instead of queued."""
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class UpstreamScheduler:
+    def __init__(
+        self,
+        name: str,
+        max_concurrency: int,
+        rate: float,
+        burst: int,
+        max_queue: int,
+        max_wait: float = UPSTREAM_MAX_WAIT,
+    ):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._bucket = TokenBucket(rate, burst)
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self._waits = deque(maxlen=1024)  # recent queue waits, seconds
+        self.waiting = 0
+        self.active = 0
+        self._counters = {
+            "calls": 0,
+            "coalesced": 0,
+            "shed_queue_full": 0,
+            "shed_timeout": 0,
+            "peak_waiting": 0,
+            "wait_seconds_total": 0.0,
+        }
+
+    async def _acquire_slot(self):
+        if not self._semaphore.locked():
+            await self._semaphore.acquire()  # free slot: does not suspend
+            return
+        if self.waiting >= self.max_queue:
+            self._counters["shed_queue_full"] += 1
+            count_fallback(f"upstream_shed:{self.name}")
+            raise UpstreamOverloaded(f"{self.name}: wait queue full ({self.max_queue})")
+        self.waiting += 1
+        self._counters["peak_waiting"] = max(self._counters["peak_waiting"], self.waiting)
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.max_wait)
+        except asyncio.TimeoutError:
+            self._counters["shed_timeout"] += 1
+            count_fallback(f"upstream_shed:{self.name}")
+            raise UpstreamOverloaded(f"{self.name}: waited more than {self.max_wait}s")
+        finally:
+            self.waiting -= 1
+
+    async def _admit(self):
+        queued_at = time.monotonic()
+        await self._acquire_slot()
+        try:
+            await self._bucket.acquire()
+        except BaseException:
+            self._semaphore.release()
+            raise
+        waited = time.monotonic() - queued_at
+        self._waits.append(waited)
+        self._counters["wait_seconds_total"] += waited
+        self._counters["calls"] += 1
+        self.active += 1
+
+    def _release(self):
+        self.active -= 1
+        self._semaphore.release()
+
+    @asynccontextmanager
+    async def slot(self):
+        """Hold one upstream slot for the duration of the block (e.g. a stream)."""
+        await self._admit()
+        try:
+            yield
+        finally:
+            self._release()
+
+    async def _call(self, fn: Callable[[], Awaitable[T]]) -> T:
+        async with self.slot():
+            return await fn()
+
+    def _finished(self, key: Hashable, task: asyncio.Future):
+        self._inflight.pop(key, None)
+        if not task.cancelled():
+            task.exception()  # retrieved, in case every caller was cancelled
+
+    async def run(self, fn: Callable[[], Awaitable[T]], key: Optional[Hashable] = None) -> T:
+        """
+        Run ``fn`` under this upstream's limits. Callers passing the same
+        ``key`` while a call is in flight share its result (single-flight).
+        """
+        if key is None:
+            return await self._call(fn)
+        task = self._inflight.get(key)
+        if task is not None:
+            self._counters["coalesced"] += 1
+        else:
+            task = asyncio.ensure_future(self._call(fn))
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._finished(key, t))
+        # shield: one caller being cancelled must not cancel the shared call
+        return await asyncio.shield(task)
+
+    def stats(self) -> dict:
+        waits = sorted(self._waits)
+
+        def pct(p):
+            return round(waits[min(len(waits) - 1, int(p * len(waits)))] * 1000, 1) if waits else 0.0
+
+        return {
+            "waiting": self.waiting,
+            "active": self.active,
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "inflight_keys": len(self._inflight),
+            **self._counters,
+            "wait_seconds_total": round(self._counters["wait_seconds_total"], 3),
+            "wait_ms_p50": pct(0.5),
+            "wait_ms_p95": pct(0.95),
+        }
+
+
+_schedulers: Dict[str, UpstreamScheduler] = {}
+
+
+def get_scheduler(name: str) -> UpstreamScheduler:
+    scheduler = _schedulers.get(name)
+    if scheduler is None:
+        limits = UPSTREAM_LIMITS.get(name, {"max_concurrency": 8, "rate": 0, "burst": 1, "max_queue": 50})
+        scheduler = _schedulers[name] = UpstreamScheduler(name, **limits)
+    return scheduler
+
+
+def scheduler_stats() -> dict:
+    return {name: get_scheduler(name).stats() for name in UPSTREAM_LIMITS}
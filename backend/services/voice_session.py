@@ -0,0 +1,218 @@
+"""
+Real-time voice sessions over a WebSocket.
+
+The client streams raw 16-bit little-endian mono PCM as binary frames while
+the user speaks. :class:`UtteranceDetector` runs a streaming energy VAD over
+the frames and closes an utterance after ``WS_END_SILENCE_MS`` of trailing
+silence, so the turn starts the moment the user stops talking, with no
+upload step. Each utterance goes through :func:`stream_chat_turn` and its
+events are sent back as JSON messages.
+
+Control messages (JSON text frames): ``{"type": "end"}`` forces the end of
+the current utterance, ``{"type": "cancel"}`` drops buffered audio and stops
+the running turn, ``{"type": "ping"}`` is answered with ``pong``.
+"""
+
+from __future__ import annotations
+import asyncio
+import json
+from collections import deque
+from typing import Awaitable, Callable, List, Optional
+
+import numpy as np
+
+from config import (
+    MAX_AUDIO_SECONDS,
+    VAD_MIN_SPEECH_MS,
+    VAD_PAD_MS,
+    VAD_THRESHOLD_DB,
+    WS_END_SILENCE_MS,
+)
+from services.audio_preprocess import (
+    FRAME_MS,
+    FRAME_SAMPLES,
+    SAMPLE_RATE,
+    StreamResampler,
+    frame_levels,
+    to_wav,
+)
+from services.chat_pipeline import stream_chat_turn
+from services.memory_service import offload, resolve_session
+from services.upload_limits import UploadTooLarge
+
+# Client PCM rates accepted for ``sample_rate``
+MIN_SAMPLE_RATE, MAX_SAMPLE_RATE = 8000, 48000
+_MAX_UTTERANCE_SAMPLES = int(MAX_AUDIO_SECONDS * SAMPLE_RATE)
+
+
+class UtteranceDetector:
+    """
+    Streaming end-of-utterance detection. A frame is voiced when it clears
+    ``VAD_THRESHOLD_DB`` and a running noise-floor estimate by 10 dB; the
+    ``VAD_PAD_MS`` before speech onset is kept so the first word isn't clipped.
+    """
+
+    def __init__(self, sample_rate: int = SAMPLE_RATE):
+        self.sample_rate = sample_rate
+        self._resampler = StreamResampler(sample_rate)
+        self._leftover = b""
+        self._pending = np.empty(0, dtype=np.float32)
+        self._preroll = deque(maxlen=max(1, VAD_PAD_MS // FRAME_MS))
+        self._frames: List[np.ndarray] = []
+        self._noise_floor = -60.0
+        self.in_speech = False
+        self._speech_frames = 0
+        self._silent_run = 0
+
+    def reset(self):
+        self._frames = []
+        self._preroll.clear()
+        self.in_speech = False
+        self._speech_frames = 0
+        self._silent_run = 0
+
+    def _to_samples(self, pcm: bytes) -> np.ndarray:
+        data = self._leftover + pcm
+        usable = len(data) - len(data) % 2
+        self._leftover = data[usable:]
+        samples = np.frombuffer(data[:usable], dtype="<i2").astype(np.float32) / 32768
+        return self._resampler.feed(samples)
+
+    def feed(self, pcm: bytes) -> List[np.ndarray]:
+        """Add PCM bytes; returns the utterances (16 kHz samples) completed by them."""
+        samples = np.concatenate([self._pending, self._to_samples(pcm)])
+        n_frames = samples.size // FRAME_SAMPLES
+        self._pending = samples[n_frames * FRAME_SAMPLES:]
+        frames = samples[: n_frames * FRAME_SAMPLES].reshape(-1, FRAME_SAMPLES)
+
+        completed = []
+        for frame, level in zip(frames, frame_levels(samples[: n_frames * FRAME_SAMPLES])):
+            voiced = level > max(VAD_THRESHOLD_DB, self._noise_floor + 10)
+            if not voiced:
+                self._noise_floor = 0.95 * self._noise_floor + 0.05 * level
+            if not self.in_speech:
+                self._preroll.append(frame)
+                if voiced:
+                    self.in_speech = True
+                    self._frames = list(self._preroll)
+                    self._speech_frames = 1
+                    self._silent_run = 0
+                continue
+            self._frames.append(frame)
+            if voiced:
+                self._speech_frames += 1
+                self._silent_run = 0
+            else:
+                self._silent_run += 1
+            too_long = len(self._frames) * FRAME_MS >= MAX_AUDIO_SECONDS * 1000
+            if self._silent_run * FRAME_MS >= WS_END_SILENCE_MS or too_long:
+                utterance = self.flush()
+                if utterance is not None:
+                    completed.append(utterance)
+        return completed
+
+    def flush(self) -> Optional[np.ndarray]:
+        """End the current utterance now; None if it held too little speech."""
+        frames, speech_ms = self._frames, self._speech_frames * FRAME_MS
+        self.reset()
+        if not frames or speech_ms < VAD_MIN_SPEECH_MS:
+            return None
+        return np.concatenate(frames)
+
+
+class VoiceSession:
+    """
+    One connection's conversation: utterances are answered in order by a
+    single worker, against a session resolved once at connect. At most one
+    utterance waits while a turn runs; further speech is merged into it.
+    """
+
+    def __init__(
+        self,
+        send: Callable[[dict], Awaitable[None]],
+        encode_audio: Callable[[bytes, str], dict],
+        session_id: Optional[str] = None,
+        persona: Optional[str] = None,
+        language: Optional[str] = None,
+        sample_rate: int = SAMPLE_RATE,
+    ):
+        self._send = send
+        self._encode_audio = encode_audio
+        self.session_id = session_id  # resolved in start()
+        self.persona = persona
+        self.language = language
+        self.detector = UtteranceDetector(sample_rate)
+        self._utterances: asyncio.Queue = asyncio.Queue(maxsize=1)
+        self._current: Optional[asyncio.Task] = None
+        self._worker = asyncio.create_task(self._work())
+
+    async def start(self):
+        self.session_id = await offload(resolve_session, self.session_id)
+        await self._send({"type": "ready", "session_id": self.session_id, "sample_rate": SAMPLE_RATE})
+
+    async def feed_audio(self, pcm: bytes):
+        was_speaking = self.detector.in_speech
+        utterances = self.detector.feed(pcm)
+        if self.detector.in_speech and not was_speaking:
+            await self._send({"type": "speech_start"})
+        for samples in utterances:
+            await self._enqueue(samples)
+
+    async def handle_control(self, text: str):
+        try:
+            message = json.loads(text)
+        except ValueError:
+            return await self._send({"type": "error", "error": "invalid_message"})
+        kind = message.get("type")
+        if kind == "end":
+            samples = self.detector.flush()
+            if samples is not None:
+                await self._enqueue(samples)
+        elif kind == "cancel":
+            self.detector.reset()
+            while not self._utterances.empty():
+                self._utterances.get_nowait()
+            if self._current is not None:
+                self._current.cancel()
+        elif kind == "ping":
+            await self._send({"type": "pong"})
+
+    async def _enqueue(self, samples: np.ndarray):
+        await self._send({"type": "speech_end", "duration": round(samples.size / SAMPLE_RATE, 2)})
+        if not self._utterances.empty():
+            # Still answering an earlier turn: extend the waiting utterance
+            # rather than queueing another turn (newest audio kept)
+            queued = self._utterances.get_nowait()
+            samples = np.concatenate([queued, samples])[-_MAX_UTTERANCE_SAMPLES:]
+        self._utterances.put_nowait(samples)
+
+    async def _work(self):
+        while True:
+            samples = await self._utterances.get()
+            self._current = asyncio.create_task(self._turn(samples))
+            try:
+                await self._current
+            except asyncio.CancelledError:
+                if asyncio.current_task().cancelling():
+                    raise  # the worker itself is being shut down
+                await self._send({"type": "cancelled"})
+            except UploadTooLarge as e:
+                await self._send({"type": "error", "error": "upload_too_large", "detail": str(e)})
+            except Exception as e:
+                await self._send({"type": "error", "error": "chat_pipeline_failed", "detail": str(e)})
+            finally:
+                self._current = None
+
+    async def _turn(self, samples: np.ndarray):
+        wav = await asyncio.to_thread(to_wav, samples)
+        async for event, data in stream_chat_turn(
+            wav, "audio/wav", self.session_id, self.persona, self.language
+        ):
+            if event in ("audio", "filler"):
+                data.update(self._encode_audio(data.pop("audio"), data.get("text", "")))
+            await self._send({"type": event, **data})
+
+    async def close(self):
+        for task in (self._current, self._worker):
+            if task is not None:
+                task.cancel()
@@ -7,12 +7,28 @@ Voxtral accepts audio as a data URI inside an audio_url content block.
 Supported formats: wav, mp3, flac, ogg, webm (all encoded as base64).
 """
 
+import asyncio
 import base64
-import httpx
-from config import MISTRAL_API_KEY
+import json
+import time
+from collections import deque
+from typing import AsyncIterator, Optional
 
-MISTRAL_CHAT_URL = "https://api.mistral.ai/v1/chat/completions"
-MISTRAL_TRANSCRIBE_URL = "https://api.mistral.ai/v1/audio/transcriptions"
+from config import (
+    MISTRAL_API_BASE,
+    MISTRAL_API_KEY,
+    STT_BREAKER_COOLDOWN,
+    STT_BREAKER_THRESHOLD,
+    STT_HEDGE_DELAY,
+    STT_HEDGE_MIN_DELAY,
+    STT_TIMEOUT,
+)
+from services.http_client import get_client
+from services.metrics import count_fallback, observe_size, span
+from services.upstream_scheduler import UpstreamOverloaded, get_scheduler
+
+MISTRAL_CHAT_URL = f"{MISTRAL_API_BASE}/v1/chat/completions"
+MISTRAL_TRANSCRIBE_URL = f"{MISTRAL_API_BASE}/v1/audio/transcriptions"
 
 # Map browser MIME types to simplified types Mistral expects
 MIME_NORMALISE = {
@@ -29,59 +45,200 @@ MIME_NORMALISE = {
 }
 
 
+STT_MODELS = ["voxtral-mini-latest", "voxtral-small-latest", "mistral-small-latest"]
+_MIN_SAMPLES = 5
+
+# Per-model health: recent (ok, latency) outcomes plus circuit-breaker state
+_model_health = {
+    model: {"recent": deque(maxlen=50), "consecutive_failures": 0, "open_until": 0.0}
+    for model in STT_MODELS
+}
+
+
+# Upload filename extension per normalised MIME type
+UPLOAD_EXTENSIONS = {
+    "audio/webm": "webm",
+    "audio/ogg": "ogg",
+    "audio/wav": "wav",
+    "audio/mpeg": "mp3",
+    "audio/flac": "flac",
+    "audio/mp4": "m4a",
+}
+
+UNCLEAR_TRANSCRIPT = "I couldn't transcribe that clearly. Could you try saying it again?"
+
+
 def _normalise_mime(raw: str) -> str:
-    return MIME_NORMALISE.get(raw.lower().strip(), "audio/wav")
+    return MIME_NORMALISE.get(raw.lower().replace(" ", ""), "audio/wav")
 
 
-async def transcribe_audio(audio_bytes: bytes, mime_type: str = "audio/wav") -> str:
+def _record(model: str, ok: bool, latency: float):
+    health = _model_health[model]
+    health["recent"].append((ok, latency))
+    if ok:
+        health["consecutive_failures"] = 0
+        health["open_until"] = 0.0
+    else:
+        health["consecutive_failures"] += 1
+        if health["consecutive_failures"] >= STT_BREAKER_THRESHOLD:
+            health["open_until"] = time.monotonic() + STT_BREAKER_COOLDOWN
+
+
+def _success_rate(model: str) -> float:
+    recent = _model_health[model]["recent"]
+    # Laplace prior so untried models are neither favoured nor written off
+    return (sum(ok for ok, _ in recent) + 1) / (len(recent) + 2)
+
+
+def _latency_percentile(model: str, p: float) -> Optional[float]:
+    latencies = sorted(lat for ok, lat in _model_health[model]["recent"] if ok)
+    if len(latencies) < _MIN_SAMPLES:
+        return None
+    return latencies[min(len(latencies) - 1, int(p * len(latencies)))]
+
+
+def _ordered_models() -> list[str]:
     """
-    Transcribe audio using Voxtral via Mistral's multimodal chat completions.
-    Audio is sent as a base64 data-URI inside an ``audio_url`` content block.
+    Healthy models first, best success rate then fastest median. Models with
+    an open breaker are skipped until their cooldown passes (half-open); if
+    every breaker is open the least-bad model is still tried.
     """
-    if not MISTRAL_API_KEY:
-        # Mock response for demos without an API key
-        return "I've been feeling a bit overwhelmed lately with everything going on."
+    now = time.monotonic()
 
-    mime = _normalise_mime(mime_type)
+    def rank(model):
+        p50 = _latency_percentile(model, 0.5)
+        return (-round(_success_rate(model), 1), p50 if p50 is not None else STT_HEDGE_DELAY)
 
-    # 1) Preferred path: dedicated speech-to-text endpoint
-    try:
-        headers = {
-            "Authorization": f"Bearer {MISTRAL_API_KEY}",
-            "Accept": "application/json",
+    ranked = sorted(STT_MODELS, key=rank)
+    closed = [m for m in ranked if _model_health[m]["open_until"] <= now]
+    return closed or ranked[:1]
+
+
+def _hedge_delay(model: str) -> float:
+    p95 = _latency_percentile(model, 0.95)
+    delay = STT_HEDGE_DELAY if p95 is None else p95
+    return max(STT_HEDGE_MIN_DELAY, min(delay, STT_TIMEOUT))
+
+
+def stt_model_stats() -> dict:
+    now = time.monotonic()
+    stats = {}
+    for model in STT_MODELS:
+        health = _model_health[model]
+        p50, p95 = _latency_percentile(model, 0.5), _latency_percentile(model, 0.95)
+        stats[model] = {
+            "samples": len(health["recent"]),
+            "success_rate": round(_success_rate(model), 3),
+            "latency_ms_p50": round(p50 * 1000) if p50 is not None else None,
+            "latency_ms_p95": round(p95 * 1000) if p95 is not None else None,
+            "consecutive_failures": health["consecutive_failures"],
+            "breaker_open": health["open_until"] > now,
         }
+    return {"order": _ordered_models(), "models": stats}
 
-        for model in ["voxtral-mini-latest", "voxtral-small-latest", "mistral-small-latest"]:
-            files = {
-                "file": ("recording.webm", audio_bytes, mime),
-            }
-            data = {
-                "model": model,
-            }
 
-            async with httpx.AsyncClient(timeout=60.0) as client:
-                resp = await client.post(
+async def _transcribe_with(model: str, audio_bytes: bytes, mime: str) -> str:
+    headers = {
+        "Authorization": f"Bearer {MISTRAL_API_KEY}",
+        "Accept": "application/json",
+    }
+    files = {
+        "file": (f"recording.{UPLOAD_EXTENSIONS[mime]}", audio_bytes, mime),
+    }
+    started = time.monotonic()
+    try:
+        with span("stt_attempt", model):
+            resp = await get_scheduler("mistral").run(
+                lambda: get_client("mistral").post(
                     MISTRAL_TRANSCRIBE_URL,
                     headers=headers,
-                    data=data,
+                    data={"model": model},
                     files=files,
+                    timeout=STT_TIMEOUT,
                 )
+            )
+            resp.raise_for_status()
+            text = (resp.json().get("text") or "").strip()
+    except asyncio.CancelledError:
+        raise  # lost a hedge race; says nothing about the model
+    except UpstreamOverloaded:
+        # Shed by our own scheduler before reaching the model: not its failure
+        count_fallback("stt_shed")
+        return ""
+    except Exception:
+        _record(model, False, time.monotonic() - started)
+        count_fallback(f"stt_model_error:{model}")
+        return ""
+    _record(model, True, time.monotonic() - started)
+    return text
 
-            if resp.status_code >= 400:
-                continue
 
-            result = resp.json()
-            text = (result.get("text") or "").strip()
-            if text:
-                return text
-    except Exception:
-        pass
+async def _hedged_transcribe(audio_bytes: bytes, mime: str) -> str:
+    """
+    Start the best model; each time the newest attempt runs past its p95
+    latency (or an attempt fails), start the next one alongside. The first
+    non-empty transcript wins and the remaining attempts are cancelled.
+    """
+    queue = _ordered_models()
+    pending = set()
+    try:
+        while queue or pending:
+            timeout = None
+            if queue:
+                model = queue.pop(0)
+                pending.add(asyncio.create_task(_transcribe_with(model, audio_bytes, mime)))
+                if queue:
+                    timeout = _hedge_delay(model)
+            done, pending = await asyncio.wait(
+                pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                if task.result():
+                    return task.result()
+    finally:
+        for task in pending:
+            task.cancel()
+    return ""
+
+
+_AUDIO_PLACEHOLDER = "\x00audio\x00"
+_B64_CHUNK = 48 * 1024  # multiple of 3, so chunks encode without padding
+
+
+async def _json_with_data_uri(payload: dict, audio: bytes, mime: str) -> AsyncIterator[bytes]:
+    """
+    Stream ``payload`` as JSON with the audio data URI spliced in chunk by
+    chunk, so neither the base64 string nor the serialised body is ever held
+    in memory whole. Base64 needs no JSON escaping.
+    """
+    head, tail = json.dumps(payload).split(json.dumps(_AUDIO_PLACEHOLDER))
+    yield f'{head}"data:{mime};base64,'.encode()
+    view = memoryview(audio)
+    for start in range(0, len(view), _B64_CHUNK):
+        yield base64.b64encode(view[start:start + _B64_CHUNK])
+    yield f'"{tail}'.encode()
+
+
+async def transcribe_audio(audio_bytes: bytes, mime_type: str = "audio/wav") -> str:
+    """
+    Transcribe audio using Voxtral via Mistral's multimodal chat completions.
+    Audio is sent as a base64 data-URI inside an ``audio_url`` content block.
+    """
+    if not MISTRAL_API_KEY:
+        # Mock response for demos without an API key
+        return "I've been feeling a bit overwhelmed lately with everything going on."
+
+    mime = _normalise_mime(mime_type)
+    observe_size("stt_upload", len(audio_bytes))
+
+    # 1) Preferred path: dedicated speech-to-text endpoint, hedged across models
+    text = await _hedged_transcribe(audio_bytes, mime)
+    if text:
+        return text
 
     # 2) Fallback path: multimodal chat with audio data URI
+    count_fallback("stt_chat_fallback")
     try:
-        audio_b64 = base64.b64encode(audio_bytes).decode("utf-8")
-        data_uri = f"data:{mime};base64,{audio_b64}"
-
         payload = {
             "model": "mistral-small-latest",
             "messages": [
@@ -90,7 +247,7 @@ async def transcribe_audio(audio_bytes: bytes, mime_type: str = "audio/wav") ->
                     "content": [
                         {
                             "type": "audio_url",
-                            "audio_url": data_uri,
+                            "audio_url": _AUDIO_PLACEHOLDER,
                         },
                         {
                             "type": "text",
@@ -113,10 +270,17 @@ async def transcribe_audio(audio_bytes: bytes, mime_type: str = "audio/wav") ->
             "Accept": "application/json",
         }
 
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            resp = await client.post(MISTRAL_CHAT_URL, json=payload, headers=headers)
-            resp.raise_for_status()
-            data = resp.json()
+        with span("stt_chat_fallback"):
+            resp = await get_scheduler("mistral").run(
+                lambda: get_client("mistral").post(
+                    MISTRAL_CHAT_URL,
+                    content=_json_with_data_uri(payload, audio_bytes, mime),
+                    headers=headers,
+                    timeout=STT_TIMEOUT,
+                )
+            )
+        resp.raise_for_status()
+        data = resp.json()
 
         transcript = data["choices"][0]["message"]["content"].strip()
         if transcript.startswith('"') and transcript.endswith('"'):
@@ -126,4 +290,5 @@ async def transcribe_audio(audio_bytes: bytes, mime_type: str = "audio/wav") ->
     except Exception:
         pass
 
-    return "I couldn't transcribe that clearly. Could you try saying it again?"
+    count_fallback("stt_unclear")
+    return UNCLEAR_TRANSCRIPT
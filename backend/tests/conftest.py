@@ -0,0 +1,7 @@
+import os
+import sys
+
+# Tests import the backend the way main.py does (``config``, ``services.*``)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("MISTRAL_API_KEY", "")
+os.environ.setdefault("ELEVENLABS_API_KEY", "")
@@ -0,0 +1,134 @@
+"""
+In-process RESP2 server for tests: GET/SET/DEL/APPEND/GETRANGE,
+WATCH/MULTI/EXEC and AUTH/SELECT, plus hooks to inject an error reply, drop a connection, or
+write a key from "another client" just before an EXEC.
+"""
+
+import socketserver
+import threading
+from typing import Callable, Dict, List, Optional
+
+
+class FakeRedis:
+    def __init__(self):
+        self.data: Dict[bytes, bytes] = {}
+        self.ttls: Dict[bytes, int] = {}
+        self.commands: List[list] = []
+        self.fail: List[bytes] = []  # commands answered with an error once each
+        self.drop_next = False  # close the connection instead of the next reply
+        self.before_exec: Optional[Callable[[], None]] = None
+        self.connections = 0
+        self._revisions: Dict[bytes, int] = {}
+        self._lock = threading.Lock()
+
+        fake = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                fake.connections += 1
+                state = {"watched": {}, "queued": None}
+                while True:
+                    args = _read_command(self.rfile)
+                    if args is None:
+                        return
+                    if fake.drop_next:
+                        fake.drop_next = False
+                        return
+                    self.wfile.write(fake._handle(args, state))
+                    self.wfile.flush()
+
+        self._server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    @property
+    def url(self) -> str:
+        return "redis://127.0.0.1:%d/0" % self._server.server_address[1]
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def write(self, key: bytes, value: bytes):
+        """A write by some other client, as WATCH sees it."""
+        with self._lock:
+            self._set(key, value)
+
+    def _set(self, key: bytes, value: bytes):
+        self.data[key] = value
+        self._revisions[key] = self._revisions.get(key, 0) + 1
+
+    def _handle(self, args: list, state: dict) -> bytes:
+        name = args[0].upper()
+        self.commands.append(args)
+        if name in self.fail:
+            self.fail.remove(name)
+            return b"-ERR injected failure\r\n"
+        if state["queued"] is not None and name not in (b"EXEC", b"MULTI"):
+            state["queued"].append(args)
+            return b"+QUEUED\r\n"
+        with self._lock:
+            if name == b"WATCH":
+                for key in args[1:]:
+                    state["watched"][key] = self._revisions.get(key, 0)
+                return b"+OK\r\n"
+            if name == b"UNWATCH":
+                state["watched"] = {}
+                return b"+OK\r\n"
+            if name == b"MULTI":
+                state["queued"] = []
+                return b"+OK\r\n"
+        if name == b"EXEC":
+            if self.before_exec is not None:
+                hook, self.before_exec = self.before_exec, None
+                hook()
+            with self._lock:
+                queued, watched = state["queued"], state["watched"]
+                state["queued"], state["watched"] = None, {}
+                if any(self._revisions.get(k, 0) != rev for k, rev in watched.items()):
+                    return b"*-1\r\n"
+                replies = [self._run(command) for command in queued]
+            return b"*%d\r\n" % len(replies) + b"".join(replies)
+        with self._lock:
+            return self._run(args)
+
+    def _run(self, args: list) -> bytes:
+        name = args[0].upper()
+        if name == b"GET":
+            value = self.data.get(args[1])
+            return b"$-1\r\n" if value is None else b"$%d\r\n%s\r\n" % (len(value), value)
+        if name == b"SET":
+            self._set(args[1], args[2])
+            if len(args) == 5 and args[3].upper() == b"EX":
+                self.ttls[args[1]] = int(args[4])
+            return b"+OK\r\n"
+        if name == b"APPEND":
+            self._set(args[1], self.data.get(args[1], b"") + args[2])
+            return b":%d\r\n" % len(self.data[args[1]])
+        if name == b"GETRANGE":
+            value, start, end = self.data.get(args[1], b""), int(args[2]), int(args[3])
+            end = len(value) + end if end < 0 else end
+            value = value[start : end + 1]
+            return b"$%d\r\n%s\r\n" % (len(value), value)
+        if name == b"EXPIRE":
+            self.ttls[args[1]] = int(args[2])
+            return b":1\r\n"
+        if name == b"DEL":
+            removed = sum(1 for key in args[1:] if self.data.pop(key, None) is not None)
+            for key in args[1:]:
+                self._revisions[key] = self._revisions.get(key, 0) + 1
+            return b":%d\r\n" % removed
+        if name in (b"AUTH", b"SELECT", b"PING"):
+            return b"+OK\r\n"
+        return b"-ERR unknown command\r\n"
+
+
+def _read_command(rfile) -> Optional[list]:
+    line = rfile.readline()
+    if not line:
+        return None
+    args = []
+    for _ in range(int(line[1:-2])):
+        size = int(rfile.readline()[1:-2])
+        args.append(rfile.read(size + 2)[:-2])
+    return args
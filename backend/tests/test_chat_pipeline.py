@@ -0,0 +1,52 @@
+import asyncio
+
+import pytest
+
+from services import chat_pipeline
+from services.chat_pipeline import UNCLEAR_EMOTION, run_chat_turn, stream_chat_turn
+from services.memory_service import get_session, set_store
+from services.session_store import InMemorySessionStore
+from services.voxtral_service import UNCLEAR_TRANSCRIPT
+
+
+@pytest.fixture
+def unclear(monkeypatch):
+    store = InMemorySessionStore()
+    set_store(store)
+
+    async def prepare(audio, mime):
+        return {"audio": audio, "mime": mime, "silent": True, "processed": True}
+
+    async def must_not_run(*args, **kwargs):
+        raise AssertionError("called for an unclear turn")
+
+    async def tts(text):
+        return b"clip"
+
+    monkeypatch.setattr(chat_pipeline, "_prepare_audio", prepare)
+    monkeypatch.setattr(chat_pipeline, "detect_emotion", must_not_run)
+    monkeypatch.setattr(chat_pipeline, "generate_response", must_not_run)
+    monkeypatch.setattr(chat_pipeline, "text_to_speech", tts)
+    yield store
+    set_store(None)
+
+
+def test_unclear_turn_is_short_circuited(unclear):
+    result = asyncio.run(run_chat_turn(b"audio", "audio/wav", None))
+    assert result["transcript"] == UNCLEAR_TRANSCRIPT
+    assert result["response"] == UNCLEAR_TRANSCRIPT
+    assert result["emotion"] == UNCLEAR_EMOTION
+    assert result["tts_audio"] == b"clip"
+    assert get_session(result["session_id"])["history"] == []
+    assert unclear.load_mood(result["session_id"]) == b""
+
+
+def test_unclear_stream_turn_is_short_circuited(unclear):
+    async def run():
+        return [(event, data) async for event, data in stream_chat_turn(b"audio", "audio/wav", None)]
+
+    events = asyncio.run(run())
+    assert [event for event, _ in events] == ["transcript", "emotion", "text", "audio", "done"]
+    done = events[-1][1]
+    assert done["response"] == UNCLEAR_TRANSCRIPT
+    assert get_session(done["session_id"])["history"] == []
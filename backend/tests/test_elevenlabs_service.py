@@ -0,0 +1,23 @@
+import asyncio
+
+from services import elevenlabs_service, tts_cache
+
+
+def test_persist_survives_a_coalesced_fetch(tmp_path, monkeypatch):
+    monkeypatch.setattr(elevenlabs_service, "ELEVENLABS_API_KEY", "key")
+    monkeypatch.setattr(tts_cache, "TTS_CACHE_DIR", str(tmp_path))
+    phrase = "Take your time, I'm listening."
+    key = elevenlabs_service.speech_cache_key(phrase)
+
+    class Scheduler:
+        async def run(self, fn, key=None):
+            # Joined a turn's in-flight, non-persisting fetch: fn is not ours
+            return b"mp3 bytes"
+
+    monkeypatch.setattr(elevenlabs_service, "get_scheduler", lambda name: Scheduler())
+
+    assert asyncio.run(elevenlabs_service.text_to_speech(phrase, persist=True)) == b"mp3 bytes"
+    assert tts_cache.cached_path(key) is not None
+
+    assert asyncio.run(elevenlabs_service.text_to_speech("a private reply", persist=False)) == b"mp3 bytes"
+    assert tts_cache.cached_path(elevenlabs_service.speech_cache_key("a private reply")) is None
@@ -0,0 +1,25 @@
+import asyncio
+
+from services import emotion_service
+
+
+def test_cache_served_turns_count_as_escalations(monkeypatch):
+    monkeypatch.setattr(emotion_service, "MISTRAL_API_KEY", "key")
+    monkeypatch.setattr(emotion_service, "_stats", dict.fromkeys(emotion_service._stats, 0))
+    monkeypatch.setattr(
+        emotion_service,
+        "classify_local",
+        lambda text: {"emotion": "sad", "intensity": 0.5, "summary": "low", "confidence": 0.1, "source": "local"},
+    )
+    cached = {"emotion": "anxious", "intensity": 0.7, "summary": "tense", "source": "cache"}
+
+    async def cache_get(text):
+        return cached
+
+    monkeypatch.setattr(emotion_service.emotion_cache, "get", cache_get)
+
+    assert asyncio.run(emotion_service.detect_emotion("not sure how I feel")) is cached
+    stats = emotion_service.emotion_stats()
+    assert (stats["local"], stats["escalated"], stats["cache_served"]) == (0, 1, 1)
+    assert stats["escalation_rate"] == 1.0
+    assert stats["remote_calls"] == 0
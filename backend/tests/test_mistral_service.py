@@ -0,0 +1,55 @@
+import random
+
+import pytest
+
+from services.mistral_service import (
+    MAX_REPLY_SENTENCES,
+    StreamingGuardrails,
+    _apply_response_guardrails,
+)
+
+COMPLETIONS = [
+    "I understand. That sounds really hard. What happened next? Tell me more.",
+    "Hmm… that is a lot.\nWhat feels heaviest right now?",
+    "As an AI, I don't have feelings. But I'm here with you. How are you holding up?",
+    "I understand, as an AI I can't feel that. But I'm here.",
+    "As an AI… I think. That's okay.",
+    "First thought.\n\n\n\nSecond thought!  Third?   Fourth.",
+    "line one\n\n\n\nline two without an ending",
+    "   ",
+    "",
+    "As an AI language model I cannot help with that.",
+    "That makes sense… it's been a long week.",
+]
+
+
+def stream(text: str, emotion: str, rng: random.Random) -> str:
+    guardrails = StreamingGuardrails(emotion)
+    emitted = []
+    position = 0
+    while position < len(text):
+        size = rng.randint(1, 6)
+        emitted += guardrails.feed(text[position : position + size])
+        position += size
+    emitted += guardrails.finish()
+    assert emitted == guardrails.sentences
+    return "\n".join(emitted)
+
+
+@pytest.mark.parametrize("text", COMPLETIONS)
+@pytest.mark.parametrize("emotion", ["sad", "anxious", "confused", "neutral", "unknown"])
+def test_streaming_matches_one_shot(text, emotion):
+    expected = _apply_response_guardrails(text, emotion)
+    rng = random.Random(text)
+    for _ in range(20):
+        assert stream(text, emotion, rng) == expected
+
+
+def test_guardrails_shape():
+    reply = _apply_response_guardrails(
+        "As an AI, I have no feelings. One. Two. Three. Four.", "anxious"
+    )
+    assert reply == "I hear you… One.\nTwo.\nThree."
+    assert len(reply.split("\n")) <= MAX_REPLY_SENTENCES
+    assert _apply_response_guardrails("", "sad") == "I hear you…\nthat sounds like a lot to carry right now."
+
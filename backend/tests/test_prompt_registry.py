@@ -0,0 +1,24 @@
+import os
+
+from services import prompt_registry
+
+
+def test_reload_bumps_version(tmp_path, monkeypatch):
+    monkeypatch.setattr(prompt_registry, "PROMPTS_DIR", str(tmp_path))
+    monkeypatch.setattr(prompt_registry, "_prompts", {})
+    (tmp_path / "system_prompt.txt").write_text("base")
+    prompt_registry.load_prompts()
+    stats = prompt_registry.prompt_stats()
+    assert stats["prompts"] == ["system_prompt"]
+
+    assert not prompt_registry._scan()
+    assert prompt_registry.prompt_stats()["version"] == stats["version"]
+
+    (tmp_path / "system_prompt.es.txt").write_text("hola")
+    assert prompt_registry._scan()
+    assert prompt_registry.prompt_stats() == {
+        "version": stats["version"] + 1,
+        "count": 2,
+        "prompts": ["system_prompt", "system_prompt.es"],
+    }
+    assert prompt_registry.get_prompt("system_prompt", language="es") == "hola"
@@ -0,0 +1,72 @@
+import contextvars
+
+import pytest
+
+from services import memory_service
+from services.memory_service import (
+    add_message,
+    apply_history_summary,
+    create_session,
+    get_session,
+    session_batch,
+    set_store,
+)
+from services.session_store import RedisSessionStore, SQLiteSessionStore
+from tests.resp_fake import FakeRedis
+
+
+@pytest.fixture(params=["sqlite", "redis"])
+def store(request, tmp_path):
+    if request.param == "sqlite":
+        store = SQLiteSessionStore(str(tmp_path / "sessions.db"))
+    else:
+        fake = FakeRedis()
+        request.addfinalizer(fake.close)
+        store = RedisSessionStore(fake.url)
+    previous = memory_service._store
+    set_store(store)
+    yield store
+    set_store(previous)
+    store.close()
+
+
+def elsewhere(fn, *args):
+    """Run ``fn`` as an overlapping writer would: outside the current batch."""
+    return contextvars.Context().run(fn, *args)
+
+
+def test_overlapping_turns_keep_both_messages(store):
+    sid = create_session()
+    with session_batch():
+        add_message(sid, "user", "first turn")
+        elsewhere(add_message, sid, "user", "second turn")
+        add_message(sid, "assistant", "reply to first")
+    history = [m["content"] for m in get_session(sid)["history"]]
+    assert history == ["second turn", "first turn", "reply to first"]
+
+
+def test_compaction_and_turn_do_not_overwrite_each_other(store):
+    sid = create_session()
+    for i in range(4):
+        add_message(sid, "user", f"message {i}")
+    folded = get_session(sid)["history"][:2]
+    with session_batch():
+        add_message(sid, "user", "new turn")
+        assert elsewhere(apply_history_summary, sid, folded, "summary of two")
+    session = get_session(sid)
+    assert session["summary"] == "summary of two"
+    assert [m["content"] for m in session["history"]] == ["message 2", "message 3", "new turn"]
+
+
+def test_stale_summary_is_not_reapplied(store):
+    sid = create_session()
+    for i in range(3):
+        add_message(sid, "user", f"message {i}")
+    folded = get_session(sid)["history"][:2]
+    with session_batch():
+        assert apply_history_summary(sid, folded, "summary")
+        # Someone else folds the same messages first
+        assert elsewhere(apply_history_summary, sid, folded, "their summary")
+    session = get_session(sid)
+    assert session["summary"] == "their summary"
+    assert [m["content"] for m in session["history"]] == ["message 2"]
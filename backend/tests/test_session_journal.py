@@ -0,0 +1,70 @@
+import json
+
+import pytest
+
+from services import memory_service
+from services.memory_service import (
+    close_store,
+    create_session,
+    get_mood,
+    get_session,
+    record_emotion,
+    set_store,
+    start_journal,
+)
+from services.session_store import InMemorySessionStore
+
+
+@pytest.fixture
+def journal_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(memory_service, "SESSION_JOURNAL_DIR", str(tmp_path))
+    previous = memory_service._store
+    yield tmp_path
+    close_store()
+    set_store(previous)
+
+
+def restart(max_sessions: int = 10) -> int:
+    if memory_service._journal is not None:
+        memory_service._journal.flush()
+    close_store()
+    set_store(InMemorySessionStore(max_sessions=max_sessions))
+    return start_journal()
+
+
+def test_evicted_and_expired_sessions_are_not_replayed(journal_dir):
+    restart(max_sessions=2)
+    first, second, third = create_session(), create_session(), create_session()
+    assert get_session(first) is None  # evicted by the LRU
+    memory_service.get_store().idle_ttl = 0
+    assert memory_service.get_store().sweep() == 2
+
+    assert restart() == 0
+    for sid in (first, second, third):
+        assert get_session(sid) is None
+
+
+def test_compaction_drops_removed_sessions(journal_dir):
+    restart(max_sessions=1)
+    first, second = create_session(), create_session()
+    assert restart(max_sessions=10) == 1
+    journal = memory_service._journal
+    journal.compact(journal._segment)
+    with open(journal_dir / "snapshot.json") as f:
+        snapshot = json.load(f)
+    assert list(snapshot["sessions"]) == [second]
+    assert first not in snapshot["touched"]
+    assert restart() == 1
+    assert get_session(second) is not None
+
+
+def test_mood_points_survive_replay(journal_dir):
+    restart()
+    sid = create_session()
+    for intensity in (0.2, 0.5, 0.9):
+        record_emotion(sid, {"emotion": "sad", "intensity": intensity, "summary": "low"})
+    assert restart() == 1
+    mood = get_mood(sid, window=2, points=10)
+    assert mood["turns"] == 3
+    assert mood["latest"] == {"emotion": "sad", "intensity": 0.902, "summary": "low"}
+    assert "mood_points" not in get_session(sid)
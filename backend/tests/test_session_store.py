@@ -0,0 +1,119 @@
+import json
+
+import pytest
+
+from services.session_store import (
+    InMemorySessionStore,
+    RedisSessionStore,
+    RespConnection,
+    SQLiteSessionStore,
+)
+from tests.resp_fake import FakeRedis
+
+
+@pytest.fixture
+def fake():
+    server = FakeRedis()
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def redis_store(fake):
+    store = RedisSessionStore(fake.url, prefix="t:", ttl_seconds=60)
+    yield store
+    store.close()
+
+
+@pytest.fixture
+def memory_store():
+    return InMemorySessionStore()
+
+
+@pytest.fixture
+def sqlite_store(tmp_path):
+    store = SQLiteSessionStore(str(tmp_path / "sessions.db"))
+    yield store
+    store.close()
+
+
+def test_redis_load_save_delete(fake, redis_store):
+    assert redis_store.load("a") is None
+    redis_store.save_many({"a": {"version": 1, "x": 1}, "b": {"version": 1, "x": 2}})
+    assert redis_store.load("a") == {"version": 1, "x": 1}
+    assert redis_store.load("b")["x"] == 2
+    assert fake.ttls[b"t:a"] == 60
+    # Both sets went out in one pipeline
+    assert [c[0] for c in fake.commands].count(b"SET") == 2
+    redis_store.delete("a")
+    assert redis_store.load("a") is None
+    assert redis_store.load("b") is not None
+
+
+@pytest.mark.parametrize("store_name", ["redis_store", "sqlite_store"])
+def test_conditional_save(request, store_name):
+    store = request.getfixturevalue(store_name)
+    store.save_many({"a": {"version": 3, "x": 1}})
+    assert store.save_many({"a": {"version": 4, "x": 2}}, {"a": 2}) == ["a"]
+    assert store.load("a") == {"version": 3, "x": 1}
+    assert store.save_many({"a": {"version": 4, "x": 2}}, {"a": 3}) == []
+    assert store.load("a") == {"version": 4, "x": 2}
+    # Gone meanwhile (deleted or expired): reported, not resurrected
+    store.delete("a")
+    assert store.save_many({"a": {"version": 5}}, {"a": 4}) == ["a"]
+    assert store.load("a") is None
+
+
+@pytest.mark.parametrize("store_name", ["memory_store", "redis_store", "sqlite_store"])
+def test_mood_points_are_appended_and_trimmed(request, store_name):
+    store = request.getfixturevalue(store_name)
+    store.save_many({"a": {"version": 1}})
+    for i in range(40):
+        store.append_mood("a", bytes([i]) * 6, 16)
+    raw = store.load_mood("a")
+    assert 16 * 6 <= len(raw) <= 18 * 6 and len(raw) % 6 == 0
+    assert raw[-6:] == bytes([39]) * 6
+    assert raw == b"".join(bytes([i]) * 6 for i in range(40 - len(raw) // 6, 40))
+    assert store.load("a") == {"version": 1}  # the session itself is untouched
+    store.delete("a")
+    assert store.load_mood("a") == b""
+
+
+def test_redis_exec_refused_when_written_before_exec(fake, redis_store):
+    redis_store.save_many({"a": {"version": 1}})
+    fake.before_exec = lambda: fake.write(b"t:a", json.dumps({"version": 2}).encode())
+    assert redis_store.save_many({"a": {"version": 2, "mine": True}}, {"a": 1}) == ["a"]
+    assert redis_store.load("a") == {"version": 2}
+
+
+def test_error_reply_is_raised_after_draining(fake):
+    conn = RespConnection(fake.url)
+    conn.pipeline([("SET", "k", "v")])
+    fake.fail.append(b"SET")
+    with pytest.raises(RuntimeError, match="injected"):
+        conn.pipeline([("SET", "k", "w"), ("GET", "k"), ("GET", "k")])
+    # The GET replies were read too, so the next call is not out of step
+    assert conn.pipeline([("GET", "missing"), ("GET", "k")]) == [None, b"v"]
+    conn.close()
+
+
+def test_reconnects_once_after_dropped_connection(fake):
+    conn = RespConnection(fake.url)
+    conn.pipeline([("SET", "k", "v")])
+    fake.drop_next = True
+    assert conn.pipeline([("GET", "k")]) == [b"v"]
+    assert fake.connections == 2
+    fake.drop_next = True
+    with pytest.raises((ConnectionError, OSError)):
+        conn.pipeline([("GET", "k")], reconnect=False)
+    conn.close()
+
+
+def test_setup_failure_closes_connection(fake):
+    conn = RespConnection(fake.url.replace("redis://", "redis://:secret@"))
+    fake.fail.append(b"AUTH")
+    with pytest.raises(RuntimeError):
+        conn.pipeline([("GET", "k")])
+    assert conn._sock is None
+    assert conn.pipeline([("GET", "k")]) == [None]
+    conn.close()
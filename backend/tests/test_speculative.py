@@ -0,0 +1,60 @@
+import asyncio
+
+from services import speculative
+from services.speculative import SpeculativeReply, SpeculativeStream, speculation_stats
+
+
+def reset_stats():
+    for key in speculative._stats:
+        speculative._stats[key] = 0
+
+
+def test_failed_draft_is_regenerated_and_settled_as_discard():
+    reset_stats()
+    calls = []
+
+    async def start(emotion):
+        calls.append(emotion["emotion"])
+        if len(calls) == 1:
+            raise RuntimeError("draft failed")
+        return "fresh"
+
+    async def run():
+        draft = SpeculativeReply({"emotion": "sad"}, start)
+        return await draft.result({"emotion": "sad"})
+
+    assert asyncio.run(run()) == "fresh"
+    stats = speculation_stats()
+    assert (stats["wins"], stats["discards"], stats["saved_ms_total"]) == (0, 1, 0)
+
+
+def test_failed_stream_draft_is_settled_as_discard():
+    reset_stats()
+    calls = []
+
+    async def start(emotion):
+        calls.append(emotion["emotion"])
+        if len(calls) == 1:
+            raise RuntimeError("draft failed")
+        yield "fresh"
+
+    async def run():
+        draft = SpeculativeStream({"emotion": "sad"}, start)
+        return [sentence async for sentence in draft.stream({"emotion": "sad"})]
+
+    assert asyncio.run(run()) == ["fresh"]
+    assert (speculation_stats()["wins"], speculation_stats()["discards"]) == (0, 1)
+
+
+def test_kept_draft_is_a_win():
+    reset_stats()
+
+    async def start(emotion):
+        return f"reply for {emotion['emotion']}"
+
+    async def run():
+        draft = SpeculativeReply({"emotion": "sad"}, start)
+        return await draft.result({"emotion": "sad", "intensity": 0.9})
+
+    assert asyncio.run(run()) == "reply for sad"
+    assert (speculation_stats()["wins"], speculation_stats()["discards"]) == (1, 0)
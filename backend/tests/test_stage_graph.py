@@ -0,0 +1,105 @@
+import asyncio
+
+import pytest
+
+from services.stage_graph import StageGraph, StageTimeout
+
+
+def run(graph: StageGraph, **inputs):
+    return asyncio.run(graph.run(**inputs))
+
+
+def test_stages_run_in_dependency_order_and_overlap():
+    events = []
+
+    async def a(x):
+        events.append("a")
+        return x + 1
+
+    async def slow(a):
+        events.append("slow start")
+        await asyncio.sleep(0.05)
+        events.append("slow end")
+        return a * 10
+
+    async def fast(a):
+        events.append("fast")
+        return a * 2
+
+    async def total(slow, fast):
+        return slow + fast
+
+    graph = StageGraph()
+    # Registered out of order on purpose
+    graph.add("total", total, deps=("slow", "fast"))
+    graph.add("slow", slow, deps=("a",))
+    graph.add("fast", fast, deps=("a",))
+    graph.add("a", a, deps=("x",))
+    results = run(graph, x=1)
+    assert results["total"] == 24
+    assert events.index("fast") < events.index("slow end")  # independent stages overlap
+    assert {"a", "slow", "fast", "total"} <= set(graph.timings)
+
+
+def test_timeout_uses_fallback():
+    async def stuck(x):
+        await asyncio.sleep(10)
+
+    graph = StageGraph()
+    graph.add("stuck", stuck, deps=("x",), timeout=0.01, fallback=lambda x: f"fallback {x}")
+    assert run(graph, x=1)["stuck"] == "fallback 1"
+
+
+def test_timeout_without_fallback_fails_the_run():
+    async def stuck():
+        await asyncio.sleep(10)
+
+    graph = StageGraph()
+    graph.add("stuck", stuck, timeout=0.01)
+    with pytest.raises(StageTimeout, match="stuck"):
+        run(graph)
+
+
+def test_failure_cancels_stages_in_flight():
+    cancelled = []
+
+    async def long_running():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append("long_running")
+            raise
+
+    async def boom():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("boom")
+
+    async def never(long_running):
+        raise AssertionError("dependent stage must not run")
+
+    graph = StageGraph()
+    graph.add("long_running", long_running)
+    graph.add("boom", boom)
+    graph.add("never", never, deps=("long_running",))
+    with pytest.raises(RuntimeError, match="boom"):
+        run(graph)
+    assert cancelled == ["long_running"]
+
+
+def test_invalid_graphs_are_rejected():
+    async def stage(**_):
+        return None
+
+    graph = StageGraph()
+    graph.add("a", stage, deps=("missing",))
+    with pytest.raises(ValueError, match="unknown inputs"):
+        run(graph)
+
+    graph = StageGraph()
+    graph.add("a", stage, deps=("b",))
+    graph.add("b", stage, deps=("a",))
+    with pytest.raises(ValueError, match="cycle"):
+        run(graph)
+
+    with pytest.raises(ValueError, match="duplicate"):
+        StageGraph().add("a", stage).add("a", stage)
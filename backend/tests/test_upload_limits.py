@@ -0,0 +1,102 @@
+import asyncio
+import io
+import json
+
+import pytest
+from fastapi import UploadFile
+
+from services.upload_limits import _MULTIPART_SLACK, UploadLimitMiddleware, UploadTooLarge, read_upload
+
+LIMIT = 1000
+
+
+def call(middleware, path, chunks, content_length=None):
+    """Drive the middleware as ASGI; returns ``(status, body, chunks_received)``."""
+    headers = [] if content_length is None else [(b"content-length", str(content_length).encode())]
+    scope = {"type": "http", "method": "POST", "path": path, "headers": headers}
+    messages = [
+        {"type": "http.request", "body": chunk, "more_body": i < len(chunks) - 1}
+        for i, chunk in enumerate(chunks)
+    ]
+    received = []
+    sent = []
+
+    async def receive():
+        message = messages[len(received)]
+        received.append(message)
+        return message
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(middleware(scope, receive, send))
+    status = sent[0]["status"]
+    body = b"".join(m.get("body", b"") for m in sent[1:])
+    return status, body, len(received)
+
+
+async def echo(scope, receive, send):
+    """Reads the whole body and answers with its size, like a form parser would."""
+    size = 0
+    while True:
+        message = await receive()
+        size += len(message.get("body", b""))
+        if not message.get("more_body"):
+            break
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": str(size).encode()})
+
+
+def middleware(app=echo):
+    return UploadLimitMiddleware(app, {"/chat": LIMIT, "/chat/stream": LIMIT * 2})
+
+
+def test_under_limit_passes_through():
+    assert call(middleware(), "/chat", [b"x" * 500, b"x" * 500]) == (200, b"1000", 2)
+
+
+def test_content_length_over_limit_is_rejected_before_reading():
+    def app(scope, receive, send):
+        raise AssertionError("app must not run")
+
+    status, body, received = call(middleware(app), "/chat", [b"x"], content_length=LIMIT + _MULTIPART_SLACK + 1)
+    assert status == 413
+    assert json.loads(body)["error"] == "upload_too_large"
+    assert received == 0
+
+
+def test_body_over_limit_is_cut_off_mid_stream():
+    # No Content-Length (chunked): the limit is enforced by counting bytes
+    chunk = b"x" * (_MULTIPART_SLACK // 4)
+    status, body, received = call(middleware(), "/chat", [chunk] * 20)
+    assert status == 413
+    assert json.loads(body)["error"] == "upload_too_large"
+    assert received == 5  # stopped at the first chunk past the limit
+
+
+def test_oversized_body_reported_by_the_framework_still_gets_413():
+    async def app(scope, receive, send):
+        try:
+            await echo(scope, receive, send)
+        except UploadTooLarge:
+            await send({"type": "http.response.start", "status": 400, "headers": []})
+            await send({"type": "http.response.body", "body": b"bad form"})
+
+    status, body, _ = call(middleware(app), "/chat", [b"x" * (LIMIT + _MULTIPART_SLACK + 1)])
+    assert status == 413
+    assert json.loads(body)["error"] == "upload_too_large"
+
+
+def test_longest_prefix_wins_and_other_paths_are_unlimited():
+    size = LIMIT + _MULTIPART_SLACK + 1
+    assert call(middleware(), "/chat", [b"x" * size])[0] == 413
+    assert call(middleware(), "/chat/stream", [b"x" * size])[0] == 200
+    assert call(middleware(), "/session", [b"x" * size * 2])[0] == 200
+
+
+def test_read_upload_caps_the_read():
+    assert asyncio.run(read_upload(UploadFile(io.BytesIO(b"x" * 10)), 10)) == b"x" * 10
+    with pytest.raises(UploadTooLarge):
+        asyncio.run(read_upload(UploadFile(io.BytesIO(b"x" * 11)), 10))
+    with pytest.raises(UploadTooLarge):
+        asyncio.run(read_upload(UploadFile(io.BytesIO(b""), size=11), 10))
@@ -0,0 +1,22 @@
+import asyncio
+
+from services import voxtral_service
+from services.upstream_scheduler import UpstreamOverloaded
+
+
+class SheddingScheduler:
+    async def run(self, fn, key=None):
+        raise UpstreamOverloaded("mistral: wait queue full (0)")
+
+
+def test_shed_attempt_is_not_a_model_failure(monkeypatch):
+    model = voxtral_service.STT_MODELS[0]
+    health = voxtral_service._model_health[model]
+    before = (len(health["recent"]), health["consecutive_failures"])
+    monkeypatch.setattr(voxtral_service, "get_scheduler", lambda name: SheddingScheduler())
+
+    for _ in range(10):
+        assert asyncio.run(voxtral_service._transcribe_with(model, b"RIFF", "audio/wav")) == ""
+
+    assert (len(health["recent"]), health["consecutive_failures"]) == before
+    assert health["open_until"] <= voxtral_service.time.monotonic()
@@ -13,6 +13,7 @@ export async function fullChat(
   transcript: string;
   response: string;
   audio_base64: string;
+  audio_url?: string;
   session_id: string;
   emotion?: { emotion: string; intensity: number; summary: string };
 }> {
@@ -20,6 +21,8 @@ export async function fullChat(
   form.append("audio", audio, "recording.webm");
   form.append("session_id", sessionId);
 
+  // Inline base64 audio: /audio/{id} clips live only in the worker that made
+  // them, so audio_mode=url needs sticky sessions when running several workers.
   const res = await fetch(`${API_BASE}/chat`, {
     method: "POST",
     body: form,
@@ -43,3 +46,12 @@ export async function fullChat(
 
   return body;
 }
+
+export function audioSource(result: {
+  audio_base64?: string;
+  audio_url?: string;
+}): string | null {
+  if (result.audio_url) return `${API_BASE}${result.audio_url}`;
+  if (result.audio_base64) return `data:audio/mpeg;base64,${result.audio_base64}`;
+  return null;
+}
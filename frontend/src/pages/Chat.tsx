@@ -1,7 +1,7 @@
 import { useState, useEffect, useRef } from "react";
 import { useNavigate } from "react-router-dom";
 import { useAudioRecorder } from "../hooks/useAudioRecorder";
-import { createSession, fullChat } from "../api";
+import { audioSource, createSession, fullChat } from "../api";
 import WaveAnimation from "../components/WaveAnimation";
 import MessageBubble from "../components/MessageBubble";
 import EmotionBadge from "../components/EmotionBadge";
@@ -71,9 +71,10 @@ export default function Chat() {
         setMessages((prev) => [...prev, { role: "assistant", text: result.response }]);
 
         // Play TTS audio if available
-        if (result.audio_base64) {
+        const audioSrc = audioSource(result);
+        if (audioSrc) {
           setStatus("speaking");
-          const audio = new Audio(`data:audio/mpeg;base64,${result.audio_base64}`);
+          const audio = new Audio(audioSrc);
           setCurrentAudio(audio);
           audio.onended = () => {
             setStatus("idle");